@@ -0,0 +1,151 @@
+"""
+Cutter worker process
+Pulls cut, montage, sound batch and pipeline jobs from the shared job queue
+and runs them with the same code as the Flask cutter (video_cutter_v5).
+
+Usage (Flask cutter started with JOB_QUEUE_ENABLED=1):
+    JOB_QUEUE_DB=/shared/cache/job_queue.db python cutter_worker.py --ops cut,montage,sound --capacity 2
+
+Every machine needs the same uploads/ and outputs/ storage mounted under the
+cutter's BASE_DIR and the same JOB_QUEUE_DB path. Run it with the same
+PYTHONPATH as the cutter server (video editor utils importable).
+"""
+
+import os
+import copy
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+
+# Eviction of cold output folders and content store pruning stay with the web process:
+# they start only when the cutter blueprint is registered on an app
+import video_cutter_v5 as cutter
+from utils.job_queue import get_job_queue, HEARTBEAT_INTERVAL, FINAL_STATUSES
+
+try:
+    from utils.spawn_server import start_spawn_server
+except ImportError:
+    start_spawn_server = None
+
+logger = logging.getLogger('cutter_worker')
+
+POLL_INTERVAL = 1.0
+ALL_OPS = ('cut', 'montage', 'sound', 'pipeline')
+
+
+class CutterWorker:
+    """Claims jobs up to its capacity, mirrors their state into the queue, sends heartbeats"""
+
+    def __init__(self, ops, capacity):
+        self.queue = get_job_queue(cutter.CACHE_DIR)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # A pipeline job requires the ops of its stages; 'pipeline' itself is the runner
+        self.capabilities = set(ops) | {'pipeline'}
+        self.capacity = capacity
+        self.running = {}
+        self.stopping = threading.Event()
+
+    def run_job(self, job):
+        job_id = job['id']
+        with cutter.job_lock:
+            cutter.active_jobs[job_id] = dict(job['state'] or {}, status='pending', cancelled=False)
+        try:
+            cutter.JOB_RUNNERS[job['op']](job_id, job['payload'])
+        except Exception as e:
+            logger.exception(f"Job {job_id} crashed")
+            with cutter.job_lock:
+                cutter.active_jobs[job_id]['status'] = 'error'
+                cutter.active_jobs[job_id]['error'] = str(e)
+
+        with cutter.job_lock:
+            state = copy.deepcopy(cutter.active_jobs.pop(job_id))
+        status = state.get('status') if state.get('status') in FINAL_STATUSES else 'error'
+        self.queue.finish(job_id, status, state, state.get('error'))
+        logger.info(f"Job {job_id} finished: {status}")
+
+    def sync(self):
+        """Heartbeat, push job states, pull cancel flags, requeue jobs of dead workers"""
+        if not self.queue.heartbeat(self.worker_id, len(self.running)):
+            logger.warning("Worker was considered dead, registering again")
+            self.queue.register_worker(self.worker_id, self.capabilities, self.capacity)
+
+        for job_id in list(self.running):
+            with cutter.job_lock:
+                state = copy.deepcopy(cutter.active_jobs.get(job_id))
+            if state and self.queue.update_state(job_id, state):
+                with cutter.job_lock:
+                    if job_id in cutter.active_jobs:
+                        cutter.active_jobs[job_id]['cancelled'] = True
+
+        self.queue.requeue_dead()
+
+    def reap(self):
+        for job_id, thread in list(self.running.items()):
+            if not thread.is_alive():
+                del self.running[job_id]
+
+    def claim(self):
+        free = self.capacity - len(self.running)
+        if free <= 0 or self.stopping.is_set():
+            return
+        for job in self.queue.claim(self.worker_id, self.capabilities, limit=free):
+            logger.info(f"Claimed {job['op']} job {job['id']} (attempt {job['attempts']})")
+            thread = threading.Thread(target=self.run_job, args=(job,))
+            thread.daemon = True
+            thread.start()
+            self.running[job['id']] = thread
+
+    def loop(self):
+        self.queue.register_worker(self.worker_id, self.capabilities, self.capacity)
+        logger.info(f"Worker {self.worker_id}: ops={sorted(self.capabilities)} capacity={self.capacity}")
+        last_sync = 0
+        try:
+            # After a stop request: no new claims, finish running jobs with heartbeats going
+            while not self.stopping.is_set() or self.running:
+                self.reap()
+                try:
+                    self.claim()
+                    if time.time() - last_sync >= HEARTBEAT_INTERVAL:
+                        self.sync()
+                        last_sync = time.time()
+                except Exception as e:
+                    logger.warning(f"Queue access failed: {e}")
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self.queue.unregister_worker(self.worker_id)
+
+    def stop(self, *args):
+        logger.info("Stopping: waiting for running jobs")
+        self.stopping.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cutter worker for the shared job queue')
+    parser.add_argument('--ops', default='cut,montage,sound',
+                        help='comma separated operations this worker can run')
+    parser.add_argument('--capacity', type=int, default=int(os.getenv('WORKER_CAPACITY', '2')),
+                        help='jobs run at the same time')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    ops = [op.strip() for op in args.ops.split(',') if op.strip()]
+    unknown = set(ops) - set(ALL_OPS)
+    if unknown:
+        parser.error(f"unknown ops: {', '.join(sorted(unknown))}")
+
+    if start_spawn_server:
+        start_spawn_server()
+
+    worker = CutterWorker(ops, args.capacity)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.loop()
+
+
+if __name__ == '__main__':
+    main()
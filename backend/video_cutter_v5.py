@@ -10,11 +10,13 @@ import json
 import shutil
 import subprocess
 import threading
+import multiprocessing
+import queue
 import random
 import hashlib
 import requests
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 
 # Try to import S3 storage
 try:
@@ -24,6 +26,91 @@ except ImportError:
     S3_AVAILABLE = False
     print("Warning: S3 storage not available")
 
+# In-process probing (PyAV) from the video editor utils, ffprobe subprocess as fallback
+try:
+    from utils.media_probe import probe as media_probe
+    MEDIA_PROBE_AVAILABLE = True
+except ImportError:
+    MEDIA_PROBE_AVAILABLE = False
+
+# ffmpeg/ffprobe launches go through the small spawn server process when available
+try:
+    from utils.spawn_server import run as run_command
+except ImportError:
+    run_command = subprocess.run
+
+# Frame-accurate smart-render cuts (re-encode only partial GOPs at the edges)
+try:
+    from utils.smart_cut import smart_cut
+    SMART_CUT_AVAILABLE = True
+except ImportError:
+    SMART_CUT_AVAILABLE = False
+
+# Media catalog and edit-friendly mezzanine copies of masters
+try:
+    from utils.media_catalog import get_catalog
+    from utils.mezzanine import transcode_mezzanine, mezzanine_path_for
+    CATALOG_AVAILABLE = True
+except ImportError:
+    CATALOG_AVAILABLE = False
+
+# Content-addressed storage: uploads hashed while streaming in and deduplicated by hardlink
+try:
+    from utils.content_store import (save_upload, ingest_file, content_id, cached_probe,
+                                     link_or_copy, start_orphan_pruner)
+    CONTENT_STORE_AVAILABLE = True
+except ImportError:
+    CONTENT_STORE_AVAILABLE = False
+
+# Finished cut/montage results memoized by (source content ID, operation, params)
+try:
+    from utils import job_memo
+    MEMO_AVAILABLE = CONTENT_STORE_AVAILABLE
+except ImportError:
+    MEMO_AVAILABLE = False
+
+# Durable job queue: with JOB_QUEUE_ENABLED=1 cut and pipeline jobs run in
+# cutter_worker.py processes (any number of machines sharing the storage)
+try:
+    from utils.job_queue import get_job_queue
+    JOB_QUEUE_AVAILABLE = True
+except ImportError:
+    JOB_QUEUE_AVAILABLE = False
+USE_JOB_QUEUE = JOB_QUEUE_AVAILABLE and os.getenv('JOB_QUEUE_ENABLED', '0') == '1'
+
+# Object storage refs (s3://bucket/key): ffmpeg reads presigned URLs with range requests,
+# outputs can be streamed from the encoder straight into the bucket
+try:
+    from utils.object_store import get_object_store, is_object_ref, encode_to_object, parse_ref
+    OBJECT_STORE_AVAILABLE = True
+except ImportError:
+    OBJECT_STORE_AVAILABLE = False
+
+# Tiered storage: cold output folders move to object storage above a disk watermark
+try:
+    from utils.tiered_storage import TieredStorage, start_tier_manager, is_evicted, read_manifest
+    TIERED_STORAGE_AVAILABLE = True
+except ImportError:
+    TIERED_STORAGE_AVAILABLE = False
+
+# Disk budget: jobs reserve their estimated output size before writing anything
+try:
+    from utils.disk_budget import (get_disk_budget, copy_estimate, encode_estimate,
+                                   DiskBudgetExceeded, ADMISSION_TIMEOUT)
+    DISK_BUDGET_AVAILABLE = True
+except ImportError:
+    DISK_BUDGET_AVAILABLE = False
+
+    class DiskBudgetExceeded(Exception):
+        """Never raised without the disk budget; keeps the except clauses valid"""
+
+# Scratch workspaces for intermediates (concat lists, temp sounds): tmpfs first
+try:
+    from utils.scratch import get_scratch_space
+    SCRATCH_AVAILABLE = True
+except ImportError:
+    SCRATCH_AVAILABLE = False
+
 cutter_bp = Blueprint('cutter', __name__)
 
 # Configuration
@@ -36,6 +123,8 @@ CUTS_DIR = os.path.join(OUTPUT_DIR, 'cuts')           # Нарезки
 MONTAGES_DIR = os.path.join(OUTPUT_DIR, 'montages')   # Комбинированные
 UNIQUIFIED_DIR = os.path.join(OUTPUT_DIR, 'uniquified')  # Уникализированные
 ARCHIVE_DIR = os.path.join(OUTPUT_DIR, 'archive')     # Архив
+MEZZANINE_DIR = os.path.join(UPLOAD_DIR, 'mezzanine')  # Мастера с GOP 1s для точной нарезки
+CACHE_DIR = os.path.join(BASE_DIR, 'cache')            # Каталог медиа и кэши
 
 # S3 Configuration
 S3_PUBLIC_URL = os.environ.get('S3_PUBLIC_URL', 'https://video-editor-files.s3.ru-3.storage.selcloud.ru')
@@ -46,24 +135,59 @@ BRIGHTDATA_ZONE = os.environ.get('BRIGHTDATA_ZONE', 'web_unlocker1')
 BRIGHTDATA_API_BASE = 'https://api.brightdata.com'
 
 # Ensure directories exist
-for d in [UPLOAD_DIR, OUTPUT_DIR, CUTS_DIR, MONTAGES_DIR, UNIQUIFIED_DIR, ARCHIVE_DIR]:
+for d in [UPLOAD_DIR, OUTPUT_DIR, CUTS_DIR, MONTAGES_DIR, UNIQUIFIED_DIR, ARCHIVE_DIR,
+          MEZZANINE_DIR, CACHE_DIR]:
     os.makedirs(d, exist_ok=True)
 
+# Output folders that may be evicted to object storage (keys match the s3_url layout)
+TIERED_ROOTS = {
+    'cuts': CUTS_DIR,
+    'montages': MONTAGES_DIR,
+    'uniquified': UNIQUIFIED_DIR,
+    'with_sound': os.path.join(OUTPUT_DIR, 'with_sound'),
+}
+tier_storage = None
+if TIERED_STORAGE_AVAILABLE and OBJECT_STORE_AVAILABLE and get_object_store() \
+        and os.getenv('TIERED_STORAGE', '1') == '1':
+    tier_storage = TieredStorage(TIERED_ROOTS, CACHE_DIR, get_object_store())
+
+# Reservations live in SQLite (JOB_QUEUE_DB when set): cutter workers on other machines see them
+disk_budget = get_disk_budget(OUTPUT_DIR, CACHE_DIR) if DISK_BUDGET_AVAILABLE else None
+
+# Smart cuts re-encode (whole ranges inside one GOP, non-H.264 sources): x264 at the
+# default CRF stays under this for 1080p, audio as in smart_cut
+REENCODE_VIDEO_BITRATE_ESTIMATE = 8_000_000
+REENCODE_AUDIO_BITRATE_ESTIMATE = 192_000
+
+# Disk fallback for scratch sits on the uploads volume, as intermediates did before
+scratch = get_scratch_space(os.path.join(UPLOAD_DIR, '.scratch')) if SCRATCH_AVAILABLE else None
+
 # Active jobs storage
 active_jobs = {}
 job_lock = threading.Lock()
 
 # ==================== HELPERS ====================
 
+def probe_media(filepath):
+    """In-process probe, cached by content ID for files known to the content store"""
+    if CONTENT_STORE_AVAILABLE and os.path.exists(filepath):
+        return cached_probe(filepath, CACHE_DIR, media_probe)
+    return media_probe(filepath)
+
 def get_video_duration(filepath):
-    """Get video duration using ffprobe"""
+    """Get video duration (in-process probe when available, else ffprobe)"""
+    if MEDIA_PROBE_AVAILABLE:
+        try:
+            return probe_media(filepath)['duration']
+        except Exception:
+            pass
     try:
         cmd = [
             'ffprobe', '-v', 'error',
             '-show_entries', 'format=duration',
             '-of', 'json', filepath
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_command(cmd, capture_output=True, text=True)
         data = json.loads(result.stdout)
         return float(data['format']['duration'])
     except:
@@ -71,6 +195,12 @@ def get_video_duration(filepath):
 
 def get_video_info(filepath):
     """Get video info (duration, width, height)"""
+    if MEDIA_PROBE_AVAILABLE:
+        try:
+            info = probe_media(filepath)
+            return {'width': info['width'], 'height': info['height'], 'duration': info['duration']}
+        except Exception:
+            pass
     try:
         cmd = [
             'ffprobe', '-v', 'error',
@@ -79,7 +209,7 @@ def get_video_info(filepath):
             '-show_entries', 'format=duration',
             '-of', 'json', filepath
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_command(cmd, capture_output=True, text=True)
         data = json.loads(result.stdout)
         streams = data.get('streams', [{}])
         fmt = data.get('format', {})
@@ -99,13 +229,70 @@ def format_time(seconds):
     secs = int(seconds % 60)
     return f"{hours:02d}:{minutes:02d}:{secs:02d}"
 
-def upload_to_s3(filepath, s3_key):
-    """Upload file to S3"""
-    if not S3_AVAILABLE:
+def ensure_folder_local(folder_path):
+    """Bring an evicted output folder back from object storage; returns an error or None"""
+    if not tier_storage:
         return None
     try:
-        s3 = get_s3_storage()
-        if s3 and s3.upload_file(filepath, s3_key):
+        tier_storage.ensure_local(folder_path)
+    except Exception as e:
+        return f'Could not restore folder from storage: {e}'
+    return None
+
+def admit_output(job_id, size, wait=True):
+    """
+    Reserve disk space for a job's outputs (None when budgeting is off).
+    Waits while running jobs hold the space; raises DiskBudgetExceeded when it
+    cannot fit (immediately if wait=False).
+    """
+    if not disk_budget or size <= 0:
+        return None
+    
+    def on_wait():
+        with job_lock:
+            if job_id in active_jobs:
+                active_jobs[job_id]['status'] = 'waiting_disk'
+                active_jobs[job_id]['message'] = 'Waiting for disk space...'
+    
+    return disk_budget.admit(job_id, size, timeout=ADMISSION_TIMEOUT if wait else 0,
+                             on_wait=on_wait)
+
+def request_workspace(name, expected_size=0):
+    """Scratch workspace removed when the current request ends (None without scratch)"""
+    if not scratch:
+        return None
+    workspace = scratch.workspace(name, expected_size)
+    g.setdefault('scratch_workspaces', []).append(workspace)
+    return workspace
+
+@cutter_bp.teardown_app_request
+def close_request_workspaces(exc):
+    for workspace in g.pop('scratch_workspaces', []):
+        workspace.close()
+
+def busy_output_folders():
+    """Output folders of jobs still running (never evicted)"""
+    folders = set()
+    with job_lock:
+        for job_id, job in active_jobs.items():
+            if job.get('status') not in ('pending', 'queued', 'waiting_disk', 'processing'):
+                continue
+            if job.get('output_folder'):
+                folders.add(job['output_folder'])
+            for stage_id in job.get('stages', {}):
+                for base_dir in TIERED_ROOTS.values():
+                    folders.add(os.path.join(base_dir, f'{job_id}_{stage_id}'))
+    return folders
+
+def upload_to_s3(filepath, s3_key):
+    """Upload file to S3 (storage module, or the built-in object store client)"""
+    try:
+        if S3_AVAILABLE:
+            s3 = get_s3_storage()
+            if s3 and s3.upload_file(filepath, s3_key):
+                return f"{S3_PUBLIC_URL}/{s3_key}"
+        elif OBJECT_STORE_AVAILABLE and get_object_store():
+            get_object_store().upload_file(filepath, s3_key)
             return f"{S3_PUBLIC_URL}/{s3_key}"
     except Exception as e:
         print(f"S3 upload error: {e}")
@@ -214,7 +401,7 @@ def uniquify_video(input_path, output_path, preset='balanced'):
     ])
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+        result = run_command(cmd, capture_output=True, text=True, timeout=600)
         if result.returncode != 0:
             return {'error': result.stderr[:300]}
         
@@ -293,11 +480,201 @@ def uniquify_worker(job_id, input_path, output_folder, count, preset, upload_s3)
 
 # ==================== CUT WORKER ====================
 
-def cut_video_worker(job_id, source_path, folder_path, segment_duration, upload_to_s3_flag):
-    """Background worker for video cutting"""
+def get_ready_mezzanine(source_path):
+    """Path of a finished mezzanine copy made from the current master, or None"""
+    if not CATALOG_AVAILABLE:
+        return None
+    return get_catalog(CACHE_DIR).mezzanine_for(source_path)
+
+
+def mezzanine_worker(job_id, source_path):
+    """Background worker: transcode a master into the mezzanine profile"""
+    catalog = get_catalog(CACHE_DIR)
+    output_path = mezzanine_path_for(source_path, MEZZANINE_DIR)
+    
+    def on_progress(fraction):
+        with job_lock:
+            active_jobs[job_id]['progress'] = round(fraction * 100, 1)
+            active_jobs[job_id]['message'] = f'Mezzanine {fraction * 100:.0f}%'
+        catalog.update(source_path, mezzanine_progress=round(fraction, 3))
+    
+    try:
+        # Master version the copy is made from: a later overwrite makes it stale
+        stat = os.stat(source_path)
+        catalog.register(source_path, get_video_info)
+        catalog.update(source_path, mezzanine_status='processing', mezzanine_progress=0,
+                       mezzanine_path=output_path, mezzanine_error=None,
+                       mezzanine_source_size=stat.st_size, mezzanine_source_mtime=stat.st_mtime)
+        with job_lock:
+            active_jobs[job_id]['status'] = 'processing'
+        
+        result = transcode_mezzanine(source_path, output_path, on_progress=on_progress)
+        
+        catalog.update(source_path, mezzanine_status='ready', mezzanine_progress=1.0)
+        with job_lock:
+            active_jobs[job_id]['status'] = 'completed'
+            active_jobs[job_id]['progress'] = 100
+            active_jobs[job_id]['mezzanine'] = os.path.basename(result['path'])
+            active_jobs[job_id]['message'] = 'Mezzanine ready'
+    except Exception as e:
+        catalog.update(source_path, mezzanine_status='error', mezzanine_error=str(e)[:500])
+        with job_lock:
+            active_jobs[job_id]['status'] = 'error'
+            active_jobs[job_id]['error'] = str(e)
+
+
+def cut_segment(source_path, start_time, segment_duration, duration, output_path, cut_mode='copy'):
+    """
+    Cut one segment; smart mode falls back to stream copy if it fails.
+    The cut is written to a temporary file and renamed over output_path: an
+    existing output may be a hardlink shared with a memoized cut folder, and
+    ffmpeg -y would truncate that shared file in place.
+    """
+    directory, name = os.path.split(output_path)
+    tmp_path = os.path.join(directory, f'.{threading.get_ident()}_{name}')
+    try:
+        if cut_mode == 'smart' and SMART_CUT_AVAILABLE:
+            try:
+                end_time = min(start_time + segment_duration, duration)
+                smart_cut(source_path, start_time, end_time, tmp_path)
+                os.replace(tmp_path, output_path)
+                return
+            except Exception as e:
+                print(f"Smart cut failed for {name}, using copy: {e}")
+        
+        cmd = [
+            'ffmpeg', '-y', '-ss', str(start_time),
+            '-i', source_path,
+            '-t', str(segment_duration),
+            '-c', 'copy',
+            '-avoid_negative_ts', 'make_zero',
+            tmp_path
+        ]
+        run_command(cmd, capture_output=True, check=True)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def cut_segment_to_object(source, start_time, segment_duration, duration, cut_mode, key):
+    """
+    Cut one segment straight into object storage.
+    Copy cuts stream from ffmpeg into a multipart upload; smart cuts need seekable
+    output, so they are rendered to a temporary file first.
+    Returns the object ref or None on failure.
+    """
+    store = get_object_store()
+    try:
+        if cut_mode == 'smart' and SMART_CUT_AVAILABLE:
+            tmp_path = os.path.join(CUTS_DIR, f'.{threading.get_ident()}_{os.path.basename(key)}')
+            try:
+                cut_segment(source, start_time, segment_duration, duration, tmp_path, cut_mode)
+                return store.upload_file(tmp_path, key)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return encode_to_object(store, [
+            'ffmpeg', '-y', '-ss', str(start_time),
+            '-i', source,
+            '-t', str(segment_duration),
+            '-c', 'copy',
+            '-avoid_negative_ts', 'make_zero'
+        ], key, timeout=600)
+    except Exception as e:
+        print(f"Object cut error ({key}): {e}")
+        return None
+
+
+def cut_source_plan(source_path, segment_duration, cut_mode):
+    """
+    File to cut and the cut mode actually used: (path, cut_mode, from_mezzanine).
+    A mezzanine copy has a keyframe every second, so whole-second copy cuts are exact
+    and the requested mode is replaced by stream copy.
+    """
+    mezzanine_path = get_ready_mezzanine(source_path)
+    if mezzanine_path and float(segment_duration).is_integer():
+        return mezzanine_path, 'copy', True
+    return source_path, cut_mode, False
+
+
+def cut_memo_key(source_id, segment_duration, cut_mode, upload_to_s3_flag, from_mezzanine=False):
+    """cut_mode is the mode actually used (see cut_source_plan), not the requested one"""
+    return job_memo.memo_key(source_id, 'cut', {
+        'segment_duration': segment_duration,
+        'cut_mode': cut_mode,
+        'mezzanine': bool(from_mezzanine),
+        'upload_to_s3': bool(upload_to_s3_flag)
+    })
+
+
+def apply_cut_memo(job_id, result, folder_path):
+    """Complete a cut job from a memoized result (hardlinking cuts into a new folder if needed)"""
+    cuts = []
+    for cut in result['cuts']:
+        cut = dict(cut)
+        if os.path.abspath(result['output_folder']) != os.path.abspath(folder_path):
+            link_or_copy(os.path.join(result['output_folder'], cut['filename']),
+                         os.path.join(folder_path, cut['filename']))
+            cut['download_url'] = f"/video-outputs/cuts/{job_id}/{cut['filename']}"
+        cuts.append(cut)
+    
+    with job_lock:
+        active_jobs[job_id].update({
+            'status': 'completed',
+            'progress': 100,
+            'current_cut': len(cuts),
+            'total_cuts': len(cuts),
+            'cuts': cuts,
+            'memoized': True,
+            'message': 'Готово (из кэша)'
+        })
+
+
+def cut_video_worker(job_id, source_path, folder_path, segment_duration, upload_to_s3_flag,
+                     cut_mode='copy', force=False, output='local'):
+    """
+    Background worker for video cutting
+    source_path: local file, or an s3:// ref read through a presigned URL
+    cut_mode: 'copy' - stream copy, cuts snap to keyframes
+              'smart' - frame-accurate, re-encodes only the partial GOPs at the edges
+    force: ignore a memoized result of the same cut
+    output: 'local' - files in folder_path, 'object' - straight into object storage
+    """
     global active_jobs
     
+    reservation = None
     try:
+        memo_key = None
+        source_size = None
+        source_filename = os.path.basename(source_path)
+        if OBJECT_STORE_AVAILABLE and is_object_ref(source_path):
+            # Presigned here, in the worker that runs the job, so the URL is fresh
+            source_bucket, source_key = parse_ref(source_path)
+            source_filename = os.path.basename(source_key)
+            if output == 'local':
+                source_size = get_object_store().head(source_key, source_bucket)
+            source_path = get_object_store().presign_ref(source_path)
+        
+        # Cuts from a ready mezzanine are memoized apart from cuts of the master
+        cut_path, cut_mode, from_mezzanine = cut_source_plan(source_path, segment_duration, cut_mode)
+        
+        # Register the master by content: a re-upload under a new name becomes a hardlink
+        if CONTENT_STORE_AVAILABLE and os.path.exists(source_path):
+            with job_lock:
+                active_jobs[job_id]['message'] = 'Hashing source...'
+            source_id = ingest_file(source_path, CACHE_DIR)
+            with job_lock:
+                active_jobs[job_id]['content_id'] = source_id
+            
+            if MEMO_AVAILABLE and output == 'local':
+                memo_key = cut_memo_key(source_id, segment_duration, cut_mode,
+                                        upload_to_s3_flag, from_mezzanine)
+                result = None if force else job_memo.lookup(CACHE_DIR, memo_key)
+                if result:
+                    apply_cut_memo(job_id, result, folder_path)
+                    return
+        
         duration = get_video_duration(source_path)
         if duration <= 0:
             with job_lock:
@@ -306,9 +683,25 @@ def cut_video_worker(job_id, source_path, folder_path, segment_duration, upload_
             return
         
         total_cuts = int(duration // segment_duration) + (1 if duration % segment_duration > 0 else 0)
-        source_filename = os.path.basename(source_path)
         base_name = os.path.splitext(source_filename)[0]
         
+        if from_mezzanine:
+            source_path = cut_path
+            with job_lock:
+                active_jobs[job_id]['mezzanine'] = True
+        
+        # Copy cuts together take about as much as the source; smart cuts may re-encode
+        # whole segments, so they reserve the larger of that and an encode estimate
+        if output == 'local' and disk_budget:
+            if os.path.exists(source_path):
+                source_size = os.path.getsize(source_path)
+            estimate = copy_estimate(duration, size=source_size) if source_size else 0
+            if cut_mode == 'smart' and SMART_CUT_AVAILABLE:
+                estimate = max(estimate, encode_estimate(duration, REENCODE_VIDEO_BITRATE_ESTIMATE,
+                                                         REENCODE_AUDIO_BITRATE_ESTIMATE))
+            if estimate:
+                reservation = admit_output(job_id, estimate)
+        
         with job_lock:
             active_jobs[job_id]['total_cuts'] = total_cuts
             active_jobs[job_id]['status'] = 'processing'
@@ -326,17 +719,32 @@ def cut_video_worker(job_id, source_path, folder_path, segment_duration, upload_
             output_filename = f"{base_name}_cut_{i+1:03d}.mp4"
             output_path = os.path.join(folder_path, output_filename)
             
-            cmd = [
-                'ffmpeg', '-y', '-ss', str(start_time),
-                '-i', source_path,
-                '-t', str(segment_duration),
-                '-c', 'copy',
-                '-avoid_negative_ts', 'make_zero',
-                output_path
-            ]
-            
             try:
-                subprocess.run(cmd, capture_output=True, check=True)
+                if output == 'object':
+                    s3_key = f"outputs/cuts/{job_id}/{output_filename}"
+                    ref = cut_segment_to_object(source_path, start_time, segment_duration,
+                                                duration, cut_mode, s3_key)
+                    if not ref:
+                        continue
+                    cuts.append({
+                        'index': i,
+                        'filename': output_filename,
+                        'start_time': start_time,
+                        'start_time_formatted': format_time(start_time),
+                        'object': ref,
+                        's3_url': f'{S3_PUBLIC_URL}/{s3_key}'
+                    })
+                    with job_lock:
+                        active_jobs[job_id]['current_cut'] = i + 1
+                        active_jobs[job_id]['progress'] = round((i + 1) / total_cuts * 100, 1)
+                        active_jobs[job_id]['message'] = f'Кусок {i+1} из {total_cuts}'
+                        active_jobs[job_id]['cuts'] = cuts
+                    continue
+                
+                cut_segment(source_path, start_time, segment_duration, duration,
+                            output_path, cut_mode)
+                if reservation:
+                    reservation.written(os.path.getsize(output_path))
                 size_mb = os.path.getsize(output_path) / (1024 * 1024)
                 
                 cut_info = {
@@ -370,14 +778,40 @@ def cut_video_worker(job_id, source_path, folder_path, segment_duration, upload_
             active_jobs[job_id]['status'] = 'completed'
             active_jobs[job_id]['progress'] = 100
             active_jobs[job_id]['cuts'] = cuts
+        
+        if memo_key and len(cuts) == total_cuts:
+            job_memo.remember(
+                CACHE_DIR, memo_key,
+                {'cuts': cuts, 'output_folder': folder_path},
+                [os.path.join(folder_path, c['filename']) for c in cuts]
+            )
             
     except Exception as e:
         with job_lock:
             active_jobs[job_id]['status'] = 'error'
             active_jobs[job_id]['error'] = str(e)
+    finally:
+        if reservation:
+            reservation.release()
 
 # ==================== API ENDPOINTS ====================
 
+def get_mezzanine_status(filepath):
+    """Mezzanine state of a master from the media catalog"""
+    if not CATALOG_AVAILABLE:
+        return None
+    catalog = get_catalog(CACHE_DIR)
+    catalog.mezzanine_for(filepath)  # flags a copy of an overwritten master as stale
+    item = catalog.get(filepath)
+    if not item or not item['mezzanine_status']:
+        return {'status': 'none'}
+    return {
+        'status': item['mezzanine_status'],
+        'progress': round((item['mezzanine_progress'] or 0) * 100, 1),
+        'error': item['mezzanine_error']
+    }
+
+
 @cutter_bp.route('/list-videos', methods=['GET'])
 def list_videos():
     """List available master videos"""
@@ -404,7 +838,8 @@ def list_videos():
                     'width': info['width'],
                     'height': info['height'],
                     'created': datetime.fromtimestamp(os.path.getctime(filepath)).isoformat(),
-                    'type': 'master'
+                    'type': 'master',
+                    'mezzanine': get_mezzanine_status(filepath)
                 })
             except:
                 continue
@@ -421,13 +856,33 @@ def start_cut():
     segment_duration = data.get('segment_duration', 15)
     folder_name = data.get('folder_name', '')
     upload_s3 = data.get('upload_to_s3', True)
+    cut_mode = data.get('cut_mode', 'copy')
+    force = bool(data.get('force', False))
+    source = data.get('source')  # s3://bucket/key instead of a local filename
+    output = data.get('output', 'local')
     
-    if not filename:
-        return jsonify({'success': False, 'error': 'filename required'})
+    if not filename and not source:
+        return jsonify({'success': False, 'error': 'filename or source required'})
     
-    source_path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(source_path):
-        return jsonify({'success': False, 'error': 'Video file not found'})
+    if cut_mode not in ('copy', 'smart'):
+        return jsonify({'success': False, 'error': "cut_mode must be 'copy' or 'smart'"})
+    
+    if output not in ('local', 'object'):
+        return jsonify({'success': False, 'error': "output must be 'local' or 'object'"})
+    
+    if source or output == 'object':
+        if not OBJECT_STORE_AVAILABLE or not get_object_store():
+            return jsonify({'success': False, 'error': 'Object storage not configured'})
+    
+    if source:
+        if not is_object_ref(source):
+            return jsonify({'success': False, 'error': 'source must be an s3://bucket/key reference'})
+        filename = os.path.basename(parse_ref(source)[1])
+        source_path = source
+    else:
+        source_path = os.path.join(UPLOAD_DIR, filename)
+        if not os.path.exists(source_path):
+            return jsonify({'success': False, 'error': 'Video file not found'})
     
     if folder_name:
         job_id = re.sub(r'[^a-zA-Z0-9_-]', '_', folder_name)
@@ -447,24 +902,90 @@ def start_cut():
             'total_cuts': 0,
             'source_file': filename,
             'output_folder': folder_path,
+            'cut_mode': cut_mode,
+            'output': output,
             'cuts': [],
             'message': 'Запуск...',
             'cancelled': False
         }
     
-    thread = threading.Thread(
-        target=cut_video_worker,
-        args=(job_id, source_path, folder_path, segment_duration, upload_s3)
-    )
+    # Same master (by content) already cut with the same parameters - finish instantly
+    if MEMO_AVAILABLE and not force and not source and output == 'local':
+        source_id = content_id(source_path, CACHE_DIR, compute=False)
+        _, memo_cut_mode, from_mezzanine = cut_source_plan(source_path, segment_duration, cut_mode)
+        result = source_id and job_memo.lookup(
+            CACHE_DIR, cut_memo_key(source_id, segment_duration, memo_cut_mode, upload_s3,
+                                    from_mezzanine))
+        if result:
+            apply_cut_memo(job_id, result, folder_path)
+            return jsonify({'success': True, 'job_id': job_id, 'memoized': True})
+    
+    dispatch_job(job_id, 'cut', {
+        'filename': filename,
+        'source': source,
+        'output': output,
+        'folder': job_id,
+        'segment_duration': segment_duration,
+        'upload_to_s3': upload_s3,
+        'cut_mode': cut_mode,
+        'force': force
+    })
+    
+    return jsonify({'success': True, 'job_id': job_id, 'memoized': False})
+
+
+@cutter_bp.route('/mezzanine', methods=['POST'])
+def start_mezzanine():
+    """
+    Transcode a master into the mezzanine profile (background, with progress)
+    Parameters: filename, force (re-create even if ready)
+    """
+    if not CATALOG_AVAILABLE:
+        return jsonify({'success': False, 'error': 'Media catalog not available'})
+    
+    data = request.get_json() or {}
+    filename = data.get('filename')
+    force = bool(data.get('force', False))
+    
+    if not filename:
+        return jsonify({'success': False, 'error': 'filename required'})
+    
+    source_path = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.exists(source_path):
+        return jsonify({'success': False, 'error': 'Video file not found'})
+    
+    base_name = os.path.splitext(filename)[0][:30]
+    job_id = f"mezz_{re.sub(r'[^a-zA-Z0-9_-]', '_', base_name)}"
+    
+    if not force and get_ready_mezzanine(source_path):
+        return jsonify({'success': True, 'job_id': None, 'status': 'ready'})
+    
+    with job_lock:
+        if active_jobs.get(job_id, {}).get('status') in ('pending', 'processing'):
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'processing'})
+        active_jobs[job_id] = {
+            'type': 'mezzanine',
+            'status': 'pending',
+            'progress': 0,
+            'source_file': filename,
+            'message': 'Запуск...',
+            'cancelled': False
+        }
+    
+    thread = threading.Thread(target=mezzanine_worker, args=(job_id, source_path))
     thread.daemon = True
     thread.start()
     
-    return jsonify({'success': True, 'job_id': job_id})
+    return jsonify({'success': True, 'job_id': job_id, 'status': 'processing'})
 
 
 @cutter_bp.route('/job/<job_id>', methods=['GET'])
 def get_job_status(job_id):
     """Get job status"""
+    if USE_JOB_QUEUE:
+        queued = get_job_queue(CACHE_DIR).get(job_id)
+        if queued:
+            return jsonify({'success': True, 'job_id': job_id, **queued_job_status(queued)})
     with job_lock:
         if job_id not in active_jobs:
             return jsonify({'success': False, 'error': 'Job not found'})
@@ -475,6 +996,8 @@ def get_job_status(job_id):
 @cutter_bp.route('/cancel/<job_id>', methods=['POST'])
 def cancel_job(job_id):
     """Cancel running job"""
+    if USE_JOB_QUEUE and get_job_queue(CACHE_DIR).cancel(job_id):
+        return jsonify({'success': True})
     with job_lock:
         if job_id not in active_jobs:
             return jsonify({'success': False, 'error': 'Job not found'})
@@ -497,16 +1020,21 @@ def list_folders():
         for name in os.listdir(base_dir):
             path = os.path.join(base_dir, name)
             if os.path.isdir(path):
-                files = [f for f in os.listdir(path) if f.endswith('.mp4')]
-                total_size = sum(os.path.getsize(os.path.join(path, f)) for f in files) / (1024*1024)
+                evicted = TIERED_STORAGE_AVAILABLE and is_evicted(path)
+                if evicted:
+                    # Files are in object storage, sizes come from the manifest
+                    sizes = [f['size'] for f in read_manifest(path)['files'] if f['name'].endswith('.mp4')]
+                else:
+                    sizes = [os.path.getsize(os.path.join(path, f)) for f in os.listdir(path) if f.endswith('.mp4')]
                 folders.append({
                     'name': name,
                     'path': path,
                     'type': folder_type,
-                    'files_count': len(files),
-                    'total_size_mb': round(total_size, 1),
+                    'files_count': len(sizes),
+                    'total_size_mb': round(sum(sizes) / (1024*1024), 1),
                     'created': datetime.fromtimestamp(os.path.getctime(path)).isoformat(),
-                    'archived': False
+                    'archived': False,
+                    'evicted': evicted
                 })
     
     if video_type in ['cuts', 'all']:
@@ -534,6 +1062,9 @@ def get_folder_files(folder_name):
     ]:
         folder_path = os.path.join(base_dir, folder_name)
         if os.path.exists(folder_path):
+            restore_error = ensure_folder_local(folder_path)
+            if restore_error:
+                return jsonify({'success': False, 'error': restore_error})
             files = []
             for f in sorted(os.listdir(folder_path)):
                 if f.endswith('.mp4'):
@@ -579,7 +1110,12 @@ def get_s3_urls(folder_name):
         folder_path = os.path.join(base_dir, folder_name)
         if os.path.exists(folder_path):
             urls = []
-            for f in sorted(os.listdir(folder_path)):
+            # Evicted folders: the objects are already under the same keys, no restore needed
+            if TIERED_STORAGE_AVAILABLE and is_evicted(folder_path):
+                names = [f['name'] for f in read_manifest(folder_path)['files']]
+            else:
+                names = os.listdir(folder_path)
+            for f in sorted(names):
                 if f.endswith('.mp4'):
                     urls.append({
                         'filename': f,
@@ -593,6 +1129,43 @@ def get_s3_urls(folder_name):
 
 # ==================== MONTAGE ====================
 
+def concat_videos(paths, output_path):
+    """Join videos with identical stream parameters without re-encoding (concat demuxer)"""
+    if scratch:
+        with scratch.workspace('concat') as workspace:
+            return run_concat(paths, output_path, workspace.file('concat.txt'))
+    return run_concat(paths, output_path, f"{os.path.splitext(output_path)[0]}_concat.txt")
+
+
+def run_concat(paths, output_path, concat_file):
+    try:
+        with open(concat_file, 'w') as f:
+            for path in paths:
+                f.write(f"file '{path}'\n")
+        cmd = [
+            'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
+            '-i', concat_file, '-c', 'copy', output_path
+        ]
+        run_command(cmd, capture_output=True, check=True)
+    finally:
+        if os.path.exists(concat_file):
+            os.remove(concat_file)
+
+
+def folder_content_id(folder_path, filenames):
+    """
+    Content ID of a set of cuts: their content IDs when known to the store,
+    otherwise name/size/mtime (cuts are written once and never edited in place)
+    """
+    parts = []
+    for filename in filenames:
+        path = os.path.join(folder_path, filename)
+        stat = os.stat(path)
+        parts.append(content_id(path, CACHE_DIR, compute=False)
+                     or f'{filename}:{stat.st_size}:{stat.st_mtime_ns}')
+    return hashlib.blake2b('\n'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
 @cutter_bp.route('/combine-montage', methods=['POST'])
 def combine_montage():
     """Create montage from cuts"""
@@ -601,6 +1174,8 @@ def combine_montage():
     middle_count = data.get('middle_count', 10)
     variants = data.get('variants', 1)
     shuffle = data.get('shuffle', True)
+    seed = data.get('seed')
+    force = bool(data.get('force', False))
     
     if not folder_name:
         return jsonify({'success': False, 'error': 'folder_name required'})
@@ -609,12 +1184,83 @@ def combine_montage():
     folder_path = os.path.join(CUTS_DIR, folder_name)
     if not os.path.exists(folder_path):
         return jsonify({'success': False, 'error': 'Folder not found'})
+
+    restore_error = ensure_folder_local(folder_path)
+    if restore_error:
+        return jsonify({'success': False, 'error': restore_error})
     
     all_files = sorted([f for f in os.listdir(folder_path) if f.endswith('.mp4')])
     if not all_files:
         return jsonify({'success': False, 'error': 'No videos in folder'})
     
     middle_count = min(middle_count, len(all_files))
+    rng = random.Random(seed) if seed is not None else random
+    
+    # Only reproducible montages (fixed seed or no shuffle) can be memoized
+    memo_key = None
+    if MEMO_AVAILABLE and (seed is not None or not shuffle):
+        inputs_id = folder_content_id(folder_path, all_files)
+        memo_key = job_memo.memo_key(inputs_id, 'combine_montage', {
+            'middle_count': middle_count, 'variants': variants,
+            'shuffle': bool(shuffle), 'seed': seed
+        })
+        result = None if force else job_memo.lookup(CACHE_DIR, memo_key)
+        if result:
+            return jsonify({'success': True, 'memoized': True, **result})
+    
+    if USE_JOB_QUEUE:
+        # With a worker pool the montage runs on a worker; the result comes via /job/<job_id>
+        job_id = f"montage_{folder_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        with job_lock:
+            active_jobs[job_id] = {
+                'type': 'montage',
+                'status': 'pending',
+                'progress': 0,
+                'folder': folder_name,
+                'message': 'Запуск...',
+                'cancelled': False
+            }
+        dispatch_job(job_id, 'montage', {
+            'folder': folder_name,
+            'files': all_files,
+            'middle_count': middle_count,
+            'variants': variants,
+            'shuffle': bool(shuffle),
+            'seed': seed,
+            'memo_key': memo_key
+        })
+        return jsonify({'success': True, 'memoized': False, 'queued': True, 'job_id': job_id})
+    
+    try:
+        reservation = admit_output(f'montage_{folder_name}',
+                                   montage_estimate(folder_path, all_files, middle_count, variants),
+                                   wait=False)
+    except DiskBudgetExceeded as e:
+        return jsonify({'success': False, 'error': str(e)})
+    
+    try:
+        response = render_montage(folder_name, all_files, middle_count, variants, shuffle, rng,
+                                  reservation)
+    finally:
+        if reservation:
+            reservation.release()
+    
+    remember_montage(memo_key, response, variants)
+    return jsonify({'success': True, 'memoized': False, **response})
+
+
+def montage_estimate(folder_path, all_files, middle_count, variants):
+    """Concat copies streams: a variant is about middle_count average cuts"""
+    if not disk_budget:
+        return 0
+    avg_size = sum(os.path.getsize(os.path.join(folder_path, f)) for f in all_files) / len(all_files)
+    return copy_estimate(size=avg_size * middle_count * variants)
+
+
+def render_montage(folder_name, all_files, middle_count, variants, shuffle, rng, reservation,
+                   job_id=None):
+    """Concat the variants into a new montage folder; returns the response body"""
+    folder_path = os.path.join(CUTS_DIR, folder_name)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
     # Create montage output folder
@@ -626,25 +1272,16 @@ def combine_montage():
     for v in range(variants):
         selected = all_files.copy()
         if shuffle:
-            random.shuffle(selected)
+            rng.shuffle(selected)
         selected = selected[:middle_count]
         
-        # Concat file
-        concat_file = os.path.join(montage_folder, f'concat_v{v:02d}.txt')
-        with open(concat_file, 'w') as f:
-            for filename in selected:
-                f.write(f"file '{os.path.join(folder_path, filename)}'\n")
-        
         output_filename = f"combined_{folder_name}_{timestamp}_v{v:02d}.mp4"
         output_path = os.path.join(montage_folder, output_filename)
         
-        cmd = [
-            'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
-            '-i', concat_file, '-c', 'copy', output_path
-        ]
-        
         try:
-            subprocess.run(cmd, capture_output=True, check=True)
+            concat_videos([os.path.join(folder_path, f) for f in selected], output_path)
+            if reservation:
+                reservation.written(os.path.getsize(output_path))
             duration = get_video_duration(output_path)
             size_mb = os.path.getsize(output_path) / (1024 * 1024)
             
@@ -659,16 +1296,25 @@ def combine_montage():
         except:
             continue
         finally:
-            if os.path.exists(concat_file):
-                os.remove(concat_file)
+            if job_id:
+                with job_lock:
+                    active_jobs[job_id]['progress'] = round((v + 1) / variants * 100, 1)
+                    active_jobs[job_id]['message'] = f'Variant {v + 1}/{variants}'
     
-    return jsonify({
-        'success': True,
+    return {
         'folder': folder_name,
         'output_folder': f"montage_{folder_name}_{timestamp}",
         'variants': results,
         'total_variants': len(results)
-    })
+    }
+
+
+def remember_montage(memo_key, response, variants):
+    """Memoize a montage only when every variant was produced"""
+    if memo_key and len(response['variants']) == variants:
+        montage_folder = os.path.join(MONTAGES_DIR, response['output_folder'])
+        job_memo.remember(CACHE_DIR, memo_key, response,
+                          [os.path.join(montage_folder, r['filename']) for r in response['variants']])
 
 
 # ==================== UNIQUIFICATION ====================
@@ -789,6 +1435,10 @@ def create_zip(folder_name):
     
     if not folder_path:
         return jsonify({'success': False, 'error': 'Folder not found'})
+
+    restore_error = ensure_folder_local(folder_path)
+    if restore_error:
+        return jsonify({'success': False, 'error': restore_error})
     
     # Get MP4 files
     files = sorted([f for f in os.listdir(folder_path) if f.endswith('.mp4')])
@@ -848,6 +1498,10 @@ def prepare_tiktok_upload():
     
     if not folder_path:
         return jsonify({'success': False, 'error': 'Folder not found'})
+
+    restore_error = ensure_folder_local(folder_path)
+    if restore_error:
+        return jsonify({'success': False, 'error': restore_error})
     
     # Get videos info
     files = sorted([f for f in os.listdir(folder_path) if f.endswith('.mp4')])
@@ -938,7 +1592,8 @@ def get_stats():
         'cuts': count_folder(CUTS_DIR),
         'montages': count_folder(MONTAGES_DIR),
         'uniquified': count_folder(UNIQUIFIED_DIR),
-        'archived': count_folder(ARCHIVE_DIR)
+        'archived': count_folder(ARCHIVE_DIR),
+        'disk_budget': disk_budget.status() if disk_budget else None
     })
 
 
@@ -1214,37 +1869,157 @@ def download_sound(url, output_path):
         return {'success': False, 'error': str(e)}
 
 
-def extract_audio_from_video(video_path, output_path):
-    """Extract audio track from video file"""
+# Audio codec -> container it can be stream-copied into
+AUDIO_COPY_CONTAINERS = {
+    'aac': ('.m4a', ['-c:a', 'copy']),
+    'mp3': ('.mp3', ['-c:a', 'copy']),
+    'opus': ('.ogg', ['-c:a', 'copy']),
+    'vorbis': ('.ogg', ['-c:a', 'copy']),
+    'pcm_s16le': ('.wav', ['-c:a', 'copy']),
+}
+# Canonical fallback when the codec can't be copied into a library format
+AUDIO_TRANSCODE = ('.mp3', ['-c:a', 'libmp3lame', '-q:a', '2'])
+
+
+def get_audio_codec(filepath):
+    """Get codec name of the first audio stream (None if no audio)"""
     try:
         cmd = [
-            'ffmpeg', '-y', '-i', video_path,
-            '-vn', '-acodec', 'libmp3lame', '-q:a', '2',
-            output_path
+            'ffprobe', '-v', 'error',
+            '-select_streams', 'a:0',
+            '-show_entries', 'stream=codec_name',
+            '-of', 'json', filepath
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+        result = run_command(cmd, capture_output=True, text=True)
+        streams = json.loads(result.stdout).get('streams', [])
+        return streams[0].get('codec_name') if streams else None
+    except:
+        return None
+
+
+def ingest_audio(source_path, output_base):
+    """
+    Store the audio of source_path as output_base + <ext>.
+    Remuxes with -c:a copy when the codec fits a library container
+    (AAC->m4a, Opus/Vorbis->ogg, MP3->mp3, PCM->wav), transcodes to MP3 otherwise.
+    """
+    codec = get_audio_codec(source_path)
+    if not codec:
+        return {'success': False, 'error': 'No audio stream found'}
+    
+    ext, codec_args = AUDIO_COPY_CONTAINERS.get(codec, AUDIO_TRANSCODE)
+    copied = codec in AUDIO_COPY_CONTAINERS
+    output_path = output_base + ext
+    
+    # Already an audio-only file in the right container - nothing to do
+    if copied and source_path.lower().endswith(ext) and not get_video_info(source_path)['width']:
+        if os.path.abspath(source_path) != os.path.abspath(output_path):
+            shutil.move(source_path, output_path)
+        return {'success': True, 'path': output_path, 'codec': codec, 'copied': True}
+    
+    try:
+        cmd = ['ffmpeg', '-y', '-i', source_path, '-vn', '-map', '0:a:0'] + codec_args + [output_path]
+        result = run_command(cmd, capture_output=True, text=True, timeout=600)
         if result.returncode == 0 and os.path.exists(output_path):
-            return {'success': True, 'path': output_path}
+            return {'success': True, 'path': output_path, 'codec': codec, 'copied': copied}
         return {'success': False, 'error': result.stderr[:300]}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
 
+def extract_audio_from_video(video_path, output_path):
+    """
+    Extract audio track from video file.
+    The extension of output_path follows the source codec (see ingest_audio);
+    the actual path is returned in the result.
+    """
+    return ingest_audio(video_path, os.path.splitext(output_path)[0])
+
+
 def get_audio_duration(filepath):
     """Get audio duration in seconds"""
+    if MEDIA_PROBE_AVAILABLE:
+        try:
+            return probe_media(filepath)['duration']
+        except Exception:
+            pass
     try:
         cmd = [
             'ffprobe', '-v', 'error',
             '-show_entries', 'format=duration',
             '-of', 'json', filepath
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_command(cmd, capture_output=True, text=True)
         data = json.loads(result.stdout)
         return float(data['format']['duration'])
     except:
         return 0
 
 
+# Canonical forms of library sounds, created once per sound:
+# - AAC-LC 48 kHz stereo (.m4a) - stream-copied into videos in 'replace' mode
+# - PCM s16le 48 kHz stereo (.wav) - fed to trim/volume/amix graphs without decoding
+SOUNDS_NORMALIZED_DIR = os.path.join(SOUNDS_DIR, '.normalized')
+os.makedirs(SOUNDS_NORMALIZED_DIR, exist_ok=True)
+
+SOUND_SAMPLE_RATE = 48000
+SOUND_AAC_BITRATE = '192k'
+
+
+def _normalized_sound_paths(sound_path):
+    # Keyed by the full file name: track.mp3 and track.m4a are different sounds
+    base = os.path.basename(sound_path)
+    return {
+        'aac': os.path.join(SOUNDS_NORMALIZED_DIR, f'{base}.m4a'),
+        'pcm': os.path.join(SOUNDS_NORMALIZED_DIR, f'{base}.wav')
+    }
+
+
+def normalize_sound(sound_path):
+    """
+    Get canonical AAC and PCM variants of a sound, creating them if missing or stale.
+    Returns {'aac': path, 'pcm': path} or None if conversion failed.
+    """
+    paths = _normalized_sound_paths(sound_path)
+    source_mtime = os.path.getmtime(sound_path)
+    
+    if all(os.path.exists(p) and os.path.getmtime(p) >= source_mtime for p in paths.values()):
+        return paths
+    
+    tmp_aac = f"{paths['aac']}.{threading.get_ident()}.tmp.m4a"
+    tmp_pcm = f"{paths['pcm']}.{threading.get_ident()}.tmp.wav"
+    try:
+        # One decode, two outputs
+        cmd = [
+            'ffmpeg', '-y', '-i', sound_path, '-vn',
+            '-ar', str(SOUND_SAMPLE_RATE), '-ac', '2',
+            '-c:a', 'aac', '-profile:a', 'aac_low', '-b:a', SOUND_AAC_BITRATE, tmp_aac,
+            '-vn', '-ar', str(SOUND_SAMPLE_RATE), '-ac', '2',
+            '-c:a', 'pcm_s16le', tmp_pcm
+        ]
+        result = run_command(cmd, capture_output=True, text=True, timeout=300)
+        if result.returncode != 0:
+            print(f"Sound normalization failed for {sound_path}: {result.stderr[:300]}")
+            return None
+        os.replace(tmp_aac, paths['aac'])
+        os.replace(tmp_pcm, paths['pcm'])
+        return paths
+    except Exception as e:
+        print(f"Sound normalization error: {e}")
+        return None
+    finally:
+        for tmp in (tmp_aac, tmp_pcm):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def remove_normalized_sound(sound_path):
+    """Delete cached canonical variants of a sound"""
+    for path in _normalized_sound_paths(sound_path).values():
+        if os.path.exists(path):
+            os.remove(path)
+
+
 @cutter_bp.route('/sounds', methods=['GET'])
 def list_sounds():
     """List available sounds in library"""
@@ -1293,16 +2068,21 @@ def upload_sound():
     filename = f"{timestamp}_{safe_name}"
     filepath = os.path.join(SOUNDS_DIR, filename)
     
-    file.save(filepath)
+    if CONTENT_STORE_AVAILABLE:
+        save_upload(file, filepath, CACHE_DIR)
+    else:
+        file.save(filepath)
     
     duration = get_audio_duration(filepath)
     size_kb = os.path.getsize(filepath) / 1024
+    normalized = normalize_sound(filepath)
     
     return jsonify({
         'success': True,
         'filename': filename,
         'duration': round(duration, 2),
-        'size_kb': round(size_kb, 1)
+        'size_kb': round(size_kb, 1),
+        'normalized': normalized is not None
     })
 
 
@@ -1356,40 +2136,45 @@ def download_tiktok_sound():
         filename = f"{safe_name}_{timestamp}.mp3"
         filepath = os.path.join(SOUNDS_DIR, filename)
         
-        # Try using yt-dlp if available
+        # Try using yt-dlp if available (native audio, no conversion)
         try:
+            output_base = os.path.splitext(filepath)[0]
+            download_base = f"{output_base}_src"
             ytdlp_cmd = [
-                'yt-dlp', '-x', '--audio-format', 'mp3',
-                '-o', filepath.replace('.mp3', '.%(ext)s'),
+                'yt-dlp', '-x',
+                '-o', f"{download_base}.%(ext)s",
                 f'https://www.tiktok.com/music/-{sound_id}'
             ]
-            result = subprocess.run(ytdlp_cmd, capture_output=True, text=True, timeout=60)
+            result = run_command(ytdlp_cmd, capture_output=True, text=True, timeout=60)
             
-            # Check if file was created (yt-dlp may change extension)
-            possible_files = [
-                filepath,
-                filepath.replace('.mp3', '.m4a'),
-                filepath.replace('.mp3', '.webm')
+            # yt-dlp picks the extension of the source stream
+            downloaded = [
+                os.path.join(SOUNDS_DIR, f) for f in os.listdir(SOUNDS_DIR)
+                if f.startswith(os.path.basename(download_base) + '.')
             ]
             
-            for pf in possible_files:
+            for pf in downloaded:
+                # Remux into a library container (transcode only if the codec requires it)
+                ingest = ingest_audio(pf, output_base)
                 if os.path.exists(pf):
-                    # Convert to mp3 if needed
-                    if not pf.endswith('.mp3'):
-                        mp3_path = pf.rsplit('.', 1)[0] + '.mp3'
-                        convert_cmd = ['ffmpeg', '-y', '-i', pf, '-acodec', 'libmp3lame', '-q:a', '2', mp3_path]
-                        subprocess.run(convert_cmd, capture_output=True, timeout=60)
-                        os.remove(pf)
-                        pf = mp3_path
-                    
-                    duration = get_audio_duration(pf)
-                    return jsonify({
-                        'success': True,
-                        'filename': os.path.basename(pf),
-                        'sound_id': sound_id,
-                        'duration': round(duration, 2),
-                        'method': 'yt-dlp'
-                    })
+                    os.remove(pf)
+                if not ingest.get('success'):
+                    continue
+                pf = ingest['path']
+                if CONTENT_STORE_AVAILABLE:
+                    ingest_file(pf, CACHE_DIR)
+                
+                normalize_sound(pf)
+                duration = get_audio_duration(pf)
+                return jsonify({
+                    'success': True,
+                    'filename': os.path.basename(pf),
+                    'sound_id': sound_id,
+                    'duration': round(duration, 2),
+                    'codec': ingest['codec'],
+                    'transcoded': not ingest['copied'],
+                    'method': 'yt-dlp'
+                })
         except FileNotFoundError:
             pass  # yt-dlp not installed
         except subprocess.TimeoutExpired:
@@ -1468,6 +2253,8 @@ def add_sound_to_video():
         for base_dir, vtype in search_dirs:
             folder_path = os.path.join(base_dir, video_folder)
             if os.path.exists(folder_path):
+                if base_dir != UPLOAD_DIR and ensure_folder_local(folder_path):
+                    continue
                 file_path = os.path.join(folder_path, video_file)
                 if os.path.exists(file_path):
                     video_path = file_path
@@ -1502,6 +2289,7 @@ def add_sound_to_video():
     
     # Get/download sound file
     sound_path = None
+    temp_workspace = None
     
     if sound_file:
         sound_path = os.path.join(SOUNDS_DIR, sound_file)
@@ -1510,7 +2298,10 @@ def add_sound_to_video():
     elif sound_url:
         # Download sound
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        temp_sound = os.path.join(SOUNDS_DIR, f'temp_sound_{timestamp}.mp3')
+        # One-off sound: lives in a scratch workspace for this request only
+        temp_workspace = request_workspace('sound_url')
+        temp_sound = os.path.join(temp_workspace.path if temp_workspace else SOUNDS_DIR,
+                                  f'temp_sound_{timestamp}.mp3')
         download_result = download_sound(sound_url, temp_sound)
         if not download_result.get('success'):
             return jsonify({'success': False, 'error': f'Failed to download sound: {download_result.get("error")}'})
@@ -1544,9 +2335,27 @@ def add_sound_to_video():
     output_filename = f"{os.path.splitext(video_file)[0]}_sound_{sound_name}.mp4"
     output_path = os.path.join(output_dir, output_filename)
     
+    # Canonical sound forms (fall back to the original file); not worth it for a one-off sound
+    normalized = normalize_sound(sound_path) if not temp_workspace else None
+    mix_input = normalized['pcm'] if normalized else sound_path
+    
     # Build FFmpeg command
     try:
-        if mix_mode == 'replace':
+        if mix_mode == 'replace' and normalized and sound_start == 0 and volume == 1.0 \
+                and video_start == 0 and not duration:
+            # Nothing to trim, scale or delay - stream-copy the canonical AAC
+            cmd = [
+                'ffmpeg', '-y',
+                '-i', video_path,
+                '-i', normalized['aac'],
+                '-map', '0:v',
+                '-map', '1:a',
+                '-c:v', 'copy',
+                '-c:a', 'copy',
+                '-shortest',
+                output_path
+            ]
+        elif mix_mode == 'replace':
             # Replace original audio completely
             filter_complex = []
             
@@ -1574,7 +2383,7 @@ def add_sound_to_video():
             cmd = [
                 'ffmpeg', '-y',
                 '-i', video_path,
-                '-i', sound_path,
+                '-i', mix_input,
                 '-filter_complex', ';'.join(filter_complex),
                 '-map', '0:v',
                 '-map', '[final]',
@@ -1616,7 +2425,7 @@ def add_sound_to_video():
             cmd = [
                 'ffmpeg', '-y',
                 '-i', video_path,
-                '-i', sound_path,
+                '-i', mix_input,
                 '-filter_complex', ';'.join(filter_parts),
                 '-map', '0:v',
                 '-map', '[mixed]',
@@ -1627,7 +2436,7 @@ def add_sound_to_video():
             ]
         
         # Execute FFmpeg
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        result = run_command(cmd, capture_output=True, text=True, timeout=300)
         
         if result.returncode != 0:
             return jsonify({
@@ -1667,6 +2476,47 @@ def add_sound_to_video():
         return jsonify({'success': False, 'error': str(e)})
 
 
+def build_sound_batch_cmd(video_path, output_path, sound_path, normalized,
+                          sound_start=0, volume=1.0, mix_mode='mix', mix_ratio=0.3):
+    """FFmpeg command putting a library sound on a video (simplified settings for batches)"""
+    mix_input = normalized['pcm'] if normalized else sound_path
+    
+    if normalized and mix_mode == 'replace' and sound_start == 0 and volume == 1.0:
+        return [
+            'ffmpeg', '-y', '-i', video_path, '-i', normalized['aac'],
+            '-map', '0:v', '-map', '1:a',
+            '-c:v', 'copy', '-c:a', 'copy',
+            '-shortest', output_path
+        ]
+    if mix_mode == 'replace':
+        filter_complex = f"[1:a]atrim=start={sound_start},asetpts=PTS-STARTPTS,volume={volume}[snd]"
+        return [
+            'ffmpeg', '-y', '-i', video_path, '-i', mix_input,
+            '-filter_complex', filter_complex,
+            '-map', '0:v', '-map', '[snd]',
+            '-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k',
+            '-shortest', output_path
+        ]
+    new_vol = volume * (1 - mix_ratio)
+    orig_vol = mix_ratio
+    filter_complex = f"[1:a]atrim=start={sound_start},asetpts=PTS-STARTPTS,volume={new_vol}[snd];[0:a]volume={orig_vol}[orig];[orig][snd]amix=inputs=2:duration=first[mix]"
+    return [
+        'ffmpeg', '-y', '-i', video_path, '-i', mix_input,
+        '-filter_complex', filter_complex,
+        '-map', '0:v', '-map', '[mix]',
+        '-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k',
+        '-shortest', output_path
+    ]
+
+
+# Folders a sound batch can take videos from
+SOUND_BATCH_DIRS = {
+    'cuts': CUTS_DIR,
+    'montages': MONTAGES_DIR,
+    'uniquified': UNIQUIFIED_DIR
+}
+
+
 @cutter_bp.route('/add-sound-batch', methods=['POST'])
 def add_sound_to_batch():
     """
@@ -1698,11 +2548,7 @@ def add_sound_to_batch():
     folder_path = None
     folder_type = None
     
-    for base_dir, ftype in [
-        (CUTS_DIR, 'cuts'),
-        (MONTAGES_DIR, 'montages'),
-        (UNIQUIFIED_DIR, 'uniquified')
-    ]:
+    for ftype, base_dir in SOUND_BATCH_DIRS.items():
         path = os.path.join(base_dir, source_folder)
         if os.path.exists(path):
             folder_path = path
@@ -1711,6 +2557,10 @@ def add_sound_to_batch():
     
     if not folder_path:
         return jsonify({'success': False, 'error': f'Folder not found: {source_folder}'})
+
+    restore_error = ensure_folder_local(folder_path)
+    if restore_error:
+        return jsonify({'success': False, 'error': restore_error})
     
     # Check sound file
     sound_path = os.path.join(SOUNDS_DIR, sound_file)
@@ -1726,9 +2576,6 @@ def add_sound_to_batch():
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     job_id = f"sound_batch_{source_folder[:15]}_{timestamp}"
     
-    output_dir = os.path.join(OUTPUT_DIR, 'with_sound', job_id)
-    os.makedirs(output_dir, exist_ok=True)
-    
     # Initialize job
     with job_lock:
         active_jobs[job_id] = {
@@ -1745,12 +2592,56 @@ def add_sound_to_batch():
             'cancelled': False
         }
     
-    # Process in background
-    def process_batch():
-        results = []
-        errors = []
-        
-        sound_name = os.path.splitext(sound_file)[0][:10]
+    # Workers advertise the 'sound' op
+    dispatch_job(job_id, 'sound_batch', {
+        'folder_type': folder_type,
+        'folder': source_folder,
+        'files': video_files,
+        'sound_file': sound_file,
+        'sound_start': sound_start,
+        'volume': volume,
+        'mix_mode': mix_mode,
+        'mix_ratio': mix_ratio
+    }, requires={'sound'})
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'total_videos': len(video_files),
+        'message': 'Processing started'
+    })
+
+
+def sound_batch_worker(job_id, folder_path, video_files, sound_file, sound_start, volume,
+                       mix_mode, mix_ratio):
+    """Put one library sound on every video of a folder"""
+    results = []
+    errors = []
+    
+    sound_path = os.path.join(SOUNDS_DIR, sound_file)
+    sound_name = os.path.splitext(sound_file)[0][:10]
+    output_dir = os.path.join(OUTPUT_DIR, 'with_sound', job_id)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # Video is stream-copied, the new audio track is encoded at 192k
+    try:
+        reservation = admit_output(job_id, sum(
+            copy_estimate(size=os.path.getsize(os.path.join(folder_path, f)))
+            + encode_estimate(get_video_duration(os.path.join(folder_path, f)),
+                              audio_bitrate=192000)
+            for f in video_files
+        ) if disk_budget else 0)
+    except DiskBudgetExceeded as e:
+        with job_lock:
+            active_jobs[job_id]['status'] = 'error'
+            active_jobs[job_id]['error'] = str(e)
+        return
+    with job_lock:
+        active_jobs[job_id]['status'] = 'processing'
+    
+    try:
+        # Canonical sound forms are prepared once for the whole batch
+        normalized = normalize_sound(sound_path)
         
         for i, video_file in enumerate(video_files):
             # Check cancelled
@@ -1764,31 +2655,13 @@ def add_sound_to_batch():
             output_path = os.path.join(output_dir, output_filename)
             
             try:
-                # Build FFmpeg command (simplified for batch)
-                if mix_mode == 'replace':
-                    filter_complex = f"[1:a]atrim=start={sound_start},asetpts=PTS-STARTPTS,volume={volume}[snd]"
-                    cmd = [
-                        'ffmpeg', '-y', '-i', video_path, '-i', sound_path,
-                        '-filter_complex', filter_complex,
-                        '-map', '0:v', '-map', '[snd]',
-                        '-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k',
-                        '-shortest', output_path
-                    ]
-                else:
-                    new_vol = volume * (1 - mix_ratio)
-                    orig_vol = mix_ratio
-                    filter_complex = f"[1:a]atrim=start={sound_start},asetpts=PTS-STARTPTS,volume={new_vol}[snd];[0:a]volume={orig_vol}[orig];[orig][snd]amix=inputs=2:duration=first[mix]"
-                    cmd = [
-                        'ffmpeg', '-y', '-i', video_path, '-i', sound_path,
-                        '-filter_complex', filter_complex,
-                        '-map', '0:v', '-map', '[mix]',
-                        '-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k',
-                        '-shortest', output_path
-                    ]
-                
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+                cmd = build_sound_batch_cmd(video_path, output_path, sound_path, normalized,
+                                            sound_start, volume, mix_mode, mix_ratio)
+                result = run_command(cmd, capture_output=True, text=True, timeout=120)
                 
                 if result.returncode == 0 and os.path.exists(output_path):
+                    if reservation:
+                        reservation.written(os.path.getsize(output_path))
                     size_mb = os.path.getsize(output_path) / (1024 * 1024)
                     results.append({
                         'filename': output_filename,
@@ -1809,23 +2682,15 @@ def add_sound_to_batch():
                 active_jobs[job_id]['results'] = results
                 active_jobs[job_id]['errors'] = errors
                 active_jobs[job_id]['message'] = f'Processing {i+1}/{len(video_files)}'
-        
-        # Complete
-        with job_lock:
-            active_jobs[job_id]['status'] = 'completed'
-            active_jobs[job_id]['progress'] = 100
-            active_jobs[job_id]['output_folder'] = job_id
-    
-    thread = threading.Thread(target=process_batch)
-    thread.daemon = True
-    thread.start()
+    finally:
+        if reservation:
+            reservation.release()
     
-    return jsonify({
-        'success': True,
-        'job_id': job_id,
-        'total_videos': len(video_files),
-        'message': 'Processing started'
-    })
+    # Complete
+    with job_lock:
+        active_jobs[job_id]['status'] = 'completed'
+        active_jobs[job_id]['progress'] = 100
+        active_jobs[job_id]['output_folder'] = job_id
 
 
 @cutter_bp.route('/delete-sound/<filename>', methods=['DELETE'])
@@ -1834,5 +2699,449 @@ def delete_sound(filename):
     filepath = os.path.join(SOUNDS_DIR, filename)
     if os.path.exists(filepath):
         os.remove(filepath)
+        remove_normalized_sound(filepath)
         return jsonify({'success': True})
     return jsonify({'success': False, 'error': 'Sound not found'})
+
+
+# ==================== PIPELINE ====================
+
+PIPELINE_OPS = ('cut', 'montage', 'sound')
+PIPELINE_END = object()  # end-of-stream marker between stages
+
+
+def validate_pipeline(stages):
+    """
+    Check a pipeline DAG: unique ids, known ops, inputs reference earlier stages.
+    Listing order is a topological order, so the graph cannot have cycles.
+    """
+    if not isinstance(stages, list) or not stages:
+        return 'stages must be a non-empty list'
+    seen = {}
+    for stage in stages:
+        stage_id = stage.get('id')
+        op = stage.get('op')
+        if not stage_id or stage_id in seen:
+            return f'stage id missing or duplicated: {stage_id}'
+        if op not in PIPELINE_OPS:
+            return f"stage {stage_id}: op must be one of {', '.join(PIPELINE_OPS)}"
+        source = stage.get('input')
+        if op == 'cut':
+            if source:
+                return f'stage {stage_id}: cut takes no input'
+            filename = stage.get('filename')
+            if not filename or not os.path.exists(os.path.join(UPLOAD_DIR, filename)):
+                return f'stage {stage_id}: video file not found: {filename}'
+        elif source not in seen:
+            return f'stage {stage_id}: input must be an earlier stage id'
+        if op == 'montage' and seen.get(source) == 'sound':
+            return f'stage {stage_id}: montage input must be cuts or montages'
+        if op == 'sound' and not os.path.exists(os.path.join(SOUNDS_DIR, stage.get('sound_file') or '')):
+            return f"stage {stage_id}: sound file not found: {stage.get('sound_file')}"
+        seen[stage_id] = op
+    return None
+
+
+def pipeline_stage_update(job_id, stage_id, **fields):
+    with job_lock:
+        active_jobs[job_id]['stages'][stage_id].update(fields)
+
+
+def pipeline_emit(job_id, stage_id, item, outputs):
+    """Record a produced item and hand it to every downstream stage"""
+    with job_lock:
+        job = active_jobs[job_id]
+        stage = job['stages'][stage_id]
+        stage['items'].append({
+            **item,
+            'download_url': f"{stage['url_prefix']}/{item['filename']}"
+        })
+        stage['done'] = len(stage['items'])
+        if stage.get('total'):
+            stage['progress'] = round(min(100, stage['done'] / stage['total'] * 100), 1)
+        job['progress'] = round(
+            sum(s['progress'] for s in job['stages'].values()) / len(job['stages']), 1)
+        job['message'] = f"{stage_id}: {stage['done']}" + (f"/{stage['total']}" if stage.get('total') else '')
+    for q in outputs:
+        q.put(item)
+
+
+def pipeline_stage_error(job_id, stage_id, filename, error):
+    """Per-item failure: recorded, the stage goes on with the next item"""
+    with job_lock:
+        active_jobs[job_id]['stages'][stage_id]['errors'].append({'file': filename, 'error': error})
+
+
+def pipeline_cancelled(job_id):
+    with job_lock:
+        return active_jobs[job_id].get('cancelled', False)
+
+
+def pipeline_inputs(inbox):
+    """Items from the upstream stage until it finishes"""
+    while True:
+        item = inbox.get()
+        if item is PIPELINE_END:
+            return
+        yield item
+
+
+def run_cut_stage(job_id, stage, folder, inbox, outputs):
+    source_path = os.path.join(UPLOAD_DIR, stage['filename'])
+    segment_duration = float(stage.get('segment_duration', 15))
+    cut_mode = stage.get('cut_mode', 'copy')
+    
+    duration = get_video_duration(source_path)
+    if duration <= 0:
+        raise RuntimeError('Could not get video duration')
+    total = int(duration // segment_duration) + (1 if duration % segment_duration > 0 else 0)
+    pipeline_stage_update(job_id, stage['id'], total=total)
+    
+    base_name = os.path.splitext(stage['filename'])[0]
+    for i in range(total):
+        if pipeline_cancelled(job_id):
+            return
+        start_time = i * segment_duration
+        output_filename = f"{base_name}_cut_{i+1:03d}.mp4"
+        output_path = os.path.join(folder, output_filename)
+        try:
+            cut_segment(source_path, start_time, segment_duration, duration, output_path, cut_mode)
+        except subprocess.CalledProcessError:
+            pipeline_stage_error(job_id, stage['id'], output_filename, 'FFmpeg failed')
+            continue
+        pipeline_emit(job_id, stage['id'], {
+            'path': output_path,
+            'filename': output_filename,
+            'start_time': start_time
+        }, outputs)
+
+
+def run_montage_stage(job_id, stage, folder, inbox, outputs):
+    """
+    Render variants as soon as enough cuts exist: the first variant starts once
+    middle_count cuts have arrived, then one more variant per new cut
+    """
+    middle_count = int(stage.get('middle_count', 10))
+    variants = int(stage.get('variants', 1))
+    shuffle = stage.get('shuffle', True)
+    seed = stage.get('seed')
+    rng = random.Random(seed) if seed is not None else random
+    pipeline_stage_update(job_id, stage['id'], total=variants)
+    
+    pool = []
+    rendered = 0
+    
+    def render(v):
+        selected = list(pool)
+        if shuffle:
+            rng.shuffle(selected)
+        selected = selected[:middle_count]
+        output_filename = f"combined_{stage['id']}_v{v:02d}.mp4"
+        output_path = os.path.join(folder, output_filename)
+        try:
+            concat_videos([c['path'] for c in selected], output_path)
+        except subprocess.CalledProcessError:
+            pipeline_stage_error(job_id, stage['id'], output_filename, 'FFmpeg failed')
+            return
+        pipeline_emit(job_id, stage['id'], {
+            'path': output_path,
+            'filename': output_filename,
+            'variant': v,
+            'shots_used': len(selected)
+        }, outputs)
+    
+    for item in pipeline_inputs(inbox):
+        pool.append(item)
+        if len(pool) >= middle_count and rendered < variants and not pipeline_cancelled(job_id):
+            render(rendered)
+            rendered += 1
+    
+    # Upstream finished: remaining variants from the full pool (fewer cuts than asked is fine)
+    while pool and rendered < variants and not pipeline_cancelled(job_id):
+        render(rendered)
+        rendered += 1
+
+
+def run_sound_stage(job_id, stage, folder, inbox, outputs):
+    sound_path = os.path.join(SOUNDS_DIR, stage['sound_file'])
+    sound_start = float(stage.get('sound_start', 0))
+    volume = float(stage.get('volume', 1.0))
+    mix_mode = stage.get('mix_mode', 'mix')
+    mix_ratio = float(stage.get('mix_ratio', 0.3))
+    normalized = normalize_sound(sound_path)
+    sound_name = os.path.splitext(stage['sound_file'])[0][:10]
+    
+    for item in pipeline_inputs(inbox):
+        if pipeline_cancelled(job_id):
+            continue  # drain the queue so upstream never blocks
+        output_filename = f"{os.path.splitext(item['filename'])[0]}_s{sound_name}.mp4"
+        output_path = os.path.join(folder, output_filename)
+        cmd = build_sound_batch_cmd(item['path'], output_path, sound_path, normalized,
+                                    sound_start, volume, mix_mode, mix_ratio)
+        result = run_command(cmd, capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            pipeline_stage_error(job_id, stage['id'], item['filename'], 'FFmpeg failed')
+            continue
+        pipeline_emit(job_id, stage['id'], {
+            'path': output_path,
+            'filename': output_filename,
+            'source': item['filename']
+        }, outputs)
+
+
+PIPELINE_RUNNERS = {
+    'cut': (run_cut_stage, CUTS_DIR, 'cuts'),
+    'montage': (run_montage_stage, MONTAGES_DIR, 'montages'),
+    'sound': (run_sound_stage, os.path.join(OUTPUT_DIR, 'with_sound'), 'with_sound'),
+}
+
+
+def pipeline_stage_worker(job_id, stage, inbox, outputs):
+    """Run one stage in its own thread; always closes downstream streams"""
+    runner, base_dir, url_prefix = PIPELINE_RUNNERS[stage['op']]
+    folder_name = f"{job_id}_{stage['id']}"
+    folder = os.path.join(base_dir, folder_name)
+    os.makedirs(folder, exist_ok=True)
+    pipeline_stage_update(job_id, stage['id'], status='processing', output_folder=folder_name,
+                          url_prefix=f'/video-outputs/{url_prefix}/{folder_name}')
+    try:
+        runner(job_id, stage, folder, inbox, outputs)
+        status = 'cancelled' if pipeline_cancelled(job_id) else 'completed'
+        pipeline_stage_update(job_id, stage['id'], status=status, progress=100)
+    except Exception as e:
+        pipeline_stage_update(job_id, stage['id'], status='error', error=str(e))
+        # Keep consuming so the upstream stage can finish
+        if inbox is not None:
+            for _ in pipeline_inputs(inbox):
+                pass
+    finally:
+        for q in outputs:
+            q.put(PIPELINE_END)
+
+
+def pipeline_worker(job_id, stages):
+    """Start every stage at once; items stream between them through queues"""
+    inboxes = {s['id']: queue.Queue() for s in stages if s['op'] != 'cut'}
+    threads = []
+    for stage in stages:
+        outputs = [inboxes[s['id']] for s in stages if s.get('input') == stage['id']]
+        thread = threading.Thread(
+            target=pipeline_stage_worker,
+            args=(job_id, stage, inboxes.get(stage['id']), outputs)
+        )
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    
+    for thread in threads:
+        thread.join()
+    
+    with job_lock:
+        job = active_jobs[job_id]
+        statuses = [s['status'] for s in job['stages'].values()]
+        if job.get('cancelled'):
+            job['status'] = 'cancelled'
+        elif 'error' in statuses:
+            job['status'] = 'error'
+            job['error'] = '; '.join(f"{sid}: {s['error']}" for sid, s in job['stages'].items()
+                                     if s.get('error'))
+        else:
+            job['status'] = 'completed'
+        job['progress'] = 100
+
+
+@cutter_bp.route('/pipeline', methods=['POST'])
+def start_pipeline():
+    """
+    Run a DAG of cut / montage / sound stages with items streamed between stages.
+    Body: {"stages": [
+        {"id": "cuts", "op": "cut", "filename": "master.mp4", "segment_duration": 15},
+        {"id": "mont", "op": "montage", "input": "cuts", "middle_count": 5, "variants": 3},
+        {"id": "snd", "op": "sound", "input": "mont", "sound_file": "track.mp3", "mix_mode": "mix"}
+    ]}
+    A stage may feed several downstream stages. Progress per stage via /job/<job_id>.
+    """
+    data = request.get_json() or {}
+    stages = data.get('stages')
+    
+    error = validate_pipeline(stages)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    job_id = f"pipeline_{timestamp}_{random.randint(1000, 9999)}"
+    
+    with job_lock:
+        active_jobs[job_id] = {
+            'type': 'pipeline',
+            'status': 'processing',
+            'progress': 0,
+            'stages': {
+                s['id']: {
+                    'op': s['op'],
+                    'input': s.get('input'),
+                    'status': 'pending',
+                    'done': 0,
+                    'total': None,
+                    'progress': 0,
+                    'items': [],
+                    'errors': []
+                } for s in stages
+            },
+            'message': 'Запуск...',
+            'cancelled': False
+        }
+    
+    dispatch_job(job_id, 'pipeline', {'stages': stages}, requires={s['op'] for s in stages})
+    
+    return jsonify({'success': True, 'job_id': job_id, 'stages': [s['id'] for s in stages]})
+
+
+# ==================== JOB DISPATCH ====================
+
+def run_cut_job(job_id, payload):
+    cut_video_worker(
+        job_id,
+        payload.get('source') or os.path.join(UPLOAD_DIR, payload['filename']),
+        os.path.join(CUTS_DIR, payload['folder']),
+        payload['segment_duration'],
+        payload['upload_to_s3'],
+        payload['cut_mode'],
+        payload['force'],
+        payload.get('output', 'local')
+    )
+
+
+def run_pipeline_job(job_id, payload):
+    pipeline_worker(job_id, payload['stages'])
+
+
+def run_montage_job(job_id, payload):
+    folder_name = payload['folder']
+    seed = payload['seed']
+    rng = random.Random(seed) if seed is not None else random
+    try:
+        reservation = admit_output(job_id, montage_estimate(
+            os.path.join(CUTS_DIR, folder_name), payload['files'],
+            payload['middle_count'], payload['variants']))
+    except DiskBudgetExceeded as e:
+        with job_lock:
+            active_jobs[job_id]['status'] = 'error'
+            active_jobs[job_id]['error'] = str(e)
+        return
+    with job_lock:
+        active_jobs[job_id]['status'] = 'processing'
+    
+    try:
+        response = render_montage(folder_name, payload['files'], payload['middle_count'],
+                                  payload['variants'], payload['shuffle'], rng, reservation,
+                                  job_id=job_id)
+    finally:
+        if reservation:
+            reservation.release()
+    
+    remember_montage(payload['memo_key'], response, payload['variants'])
+    with job_lock:
+        active_jobs[job_id].update(response)
+        active_jobs[job_id]['status'] = 'completed'
+        active_jobs[job_id]['progress'] = 100
+
+
+def run_sound_batch_job(job_id, payload):
+    sound_batch_worker(
+        job_id,
+        os.path.join(SOUND_BATCH_DIRS[payload['folder_type']], payload['folder']),
+        payload['files'],
+        payload['sound_file'],
+        payload['sound_start'],
+        payload['volume'],
+        payload['mix_mode'],
+        payload['mix_ratio']
+    )
+
+
+# Payloads hold names relative to the storage dirs, so any worker host can resolve them
+JOB_RUNNERS = {
+    'cut': run_cut_job,
+    'pipeline': run_pipeline_job,
+    'montage': run_montage_job,
+    'sound_batch': run_sound_batch_job,
+}
+
+
+def dispatch_job(job_id, op, payload, requires=None):
+    """Run a job in a background thread here, or hand it to the worker pool"""
+    if USE_JOB_QUEUE:
+        with job_lock:
+            active_jobs[job_id]['status'] = 'queued'
+            state = dict(active_jobs[job_id])
+        get_job_queue(CACHE_DIR).enqueue(job_id, op, payload, requires=requires, state=state)
+        return
+    
+    thread = threading.Thread(target=JOB_RUNNERS[op], args=(job_id, payload))
+    thread.daemon = True
+    thread.start()
+
+
+def queued_job_status(queued):
+    """Job state as reported by the worker that runs it"""
+    state = dict(queued['state'] or {})
+    if queued['status'] == 'running':
+        state.setdefault('status', 'processing')
+        if state['status'] in ('queued', 'pending'):
+            state['status'] = 'processing'
+    else:
+        state['status'] = queued['status']
+    if queued['error']:
+        state['error'] = queued['error']
+    state['worker_id'] = queued['worker_id']
+    state['attempts'] = queued['attempts']
+    return state
+
+
+@cutter_bp.route('/workers', methods=['GET'])
+def list_workers():
+    """Worker pool: registered workers with capabilities/capacity and queue counts"""
+    if not USE_JOB_QUEUE:
+        return jsonify({'success': True, 'enabled': False, 'workers': [], 'jobs': {}})
+    job_queue = get_job_queue(CACHE_DIR)
+    requeued = job_queue.requeue_dead()
+    return jsonify({
+        'success': True,
+        'enabled': True,
+        'workers': job_queue.list_workers(),
+        'jobs': job_queue.counts(),
+        'requeued': requeued
+    })
+
+
+def is_serving_process(app):
+    """
+    Whether this process serves requests, so background services belong here:
+    - multiprocessing children (spawn) re-import the main module and the app with it
+    - with the debug reloader the parent only watches files; requests are served
+      by the child started with WERKZEUG_RUN_MAIN=true
+    """
+    if multiprocessing.parent_process() is not None:
+        return False
+    if app.debug:
+        return os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    return True
+
+
+@cutter_bp.record_once
+def start_background_services(state):
+    """
+    Started when the blueprint is registered on the serving app, not at import:
+    cutter_worker.py and other importers of this module run none of them
+    """
+    if not is_serving_process(state.app):
+        return
+    
+    # Disk watermark checks run in the web process
+    if tier_storage and os.getenv('TIER_MANAGER', '1') == '1':
+        start_tier_manager(tier_storage, busy=busy_output_folders)
+    
+    # Content objects left without links by deleted or evicted cuts
+    if CONTENT_STORE_AVAILABLE and os.getenv('CONTENT_PRUNER', '1') == '1':
+        start_orphan_pruner(CACHE_DIR)
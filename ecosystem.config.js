@@ -37,6 +37,22 @@ module.exports = {
         NODE_ENV: 'production',
       },
     },
+    {
+      // Cutter job workers (cutter started with JOB_QUEUE_ENABLED=1); scale with instances
+      // here or run the same command on other machines sharing uploads/, outputs/ and the queue DB
+      name: 'cutter-worker',
+      script: 'backend/cutter_worker.py',
+      interpreter: 'python3',
+      args: '--ops cut,montage,sound --capacity 2',
+      cwd: __dirname,
+      instances: 1,
+      autorestart: true,
+      watch: false,
+      kill_timeout: 60000,
+      env: {
+        PYTHONPATH: 'video-editor-module',
+      },
+    },
     {
       name: 'tiktok-uploader-dev',
       script: './node_modules/ts-node/dist/bin.js',
@@ -10,16 +10,23 @@ from flask import Blueprint, request, jsonify, current_app
 import os
 import requests
 import json
-from datetime import datetime
 import time
 import logging
 
+from utils.catalog_cache import catalog_cache, catalog_response, CatalogError
+from utils.media_cache import params_key
+from utils.avatar_jobs import get_avatar_poller
+
 logger = logging.getLogger(__name__)
 
 avatar_bp = Blueprint('avatar', __name__)
 
 HEYGEN_API_BASE = "https://api.heygen.com/v2"
 
+def _api_base():
+    """Базовый URL HeyGen API (переопределяется в конфигурации, например для стенда)"""
+    return current_app.config.get('HEYGEN_API_BASE', HEYGEN_API_BASE)
+
 @avatar_bp.route('/create', methods=['POST'])
 def create_avatar_video():
     """
@@ -47,7 +54,7 @@ def create_avatar_video():
         api_key = current_app.config['HEYGEN_API_KEY']
         
         # HeyGen API endpoint для создания видео
-        url = f"{HEYGEN_API_BASE}/video/generate"
+        url = f"{_api_base()}/video/generate"
         
         headers = {
             "Content-Type": "application/json",
@@ -90,6 +97,9 @@ def create_avatar_video():
             if video_id:
                 logger.info(f"HeyGen video generation started: {video_id}")
                 
+                # Статус отслеживает фоновый поллер, готовое видео скачается само
+                get_avatar_poller(current_app.config).register(video_id)
+                
                 return jsonify({
                     'success': True,
                     'video_id': video_id,
@@ -113,48 +123,37 @@ def create_avatar_video():
         logger.error(f"Error creating avatar video: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _job_response(job):
+    """Ответ API по записи индекса задач"""
+    video_id = job['video_id']
+    response_data = {
+        'success': True,
+        'video_id': video_id,
+        'status': job['status'],
+        'video_url': job.get('video_url'),
+        'downloaded': bool(job.get('path'))
+    }
+    
+    if job['status'] == 'completed':
+        response_data['download_url'] = f'/api/avatar/download/{video_id}'
+    elif job['status'] == 'failed':
+        response_data['error'] = job.get('error') or 'Video generation failed'
+    
+    return response_data
+
 @avatar_bp.route('/status/<video_id>', methods=['GET'])
 def check_video_status(video_id):
     """
-    Проверить статус генерации видео
+    Проверить статус генерации видео (из индекса фонового поллера)
     """
     try:
-        api_key = current_app.config['HEYGEN_API_KEY']
-        url = f"{HEYGEN_API_BASE}/video/{video_id}"
+        # Задача не из индекса - разовая проверка в HeyGen и отслеживание дальше
+        job = get_avatar_poller(current_app.config).track(video_id)
         
-        headers = {
-            "X-Api-Key": api_key
-        }
+        if not job:
+            return jsonify({'error': 'Unknown video_id'}), 404
         
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            data = result.get('data', {})
-            
-            status = data.get('status', 'unknown')
-            video_url = data.get('video_url')
-            
-            response_data = {
-                'success': True,
-                'video_id': video_id,
-                'status': status,
-                'video_url': video_url
-            }
-            
-            if status == 'completed' and video_url:
-                response_data['download_url'] = f'/api/avatar/download/{video_id}'
-                logger.info(f"HeyGen video completed: {video_id}")
-            elif status == 'failed':
-                response_data['error'] = data.get('error', 'Video generation failed')
-                logger.error(f"HeyGen video failed: {video_id}")
-            
-            return jsonify(response_data)
-        else:
-            logger.error(f"HeyGen API error: {response.status_code}")
-            return jsonify({
-                'error': f'HeyGen API error: {response.status_code}'
-            }), response.status_code
+        return jsonify(_job_response(job))
     
     except Exception as e:
         logger.error(f"Error checking video status: {e}")
@@ -163,95 +162,116 @@ def check_video_status(video_id):
 @avatar_bp.route('/download/<video_id>', methods=['GET'])
 def download_avatar_video(video_id):
     """
-    Скачать готовое видео с аватаром
+    Скачать готовое видео с аватаром (один раз, дальше - из индекса)
     """
     try:
-        # Сначала получаем URL видео
-        api_key = current_app.config['HEYGEN_API_KEY']
-        url = f"{HEYGEN_API_BASE}/video/{video_id}"
+        poller = get_avatar_poller(current_app.config)
+        job = poller.track(video_id)
         
-        headers = {
-            "X-Api-Key": api_key
-        }
+        if not job:
+            return jsonify({'error': 'Unknown video_id'}), 404
         
-        response = requests.get(url, headers=headers, timeout=10)
+        if job['status'] == 'completed' and not (job.get('path') and os.path.exists(job['path'])):
+            job = poller.download(video_id)
         
-        if response.status_code == 200:
-            result = response.json()
-            video_url = result.get('data', {}).get('video_url')
-            
-            if video_url:
-                # Скачиваем видео
-                video_response = requests.get(video_url, stream=True, timeout=60)
-                
-                if video_response.status_code == 200:
-                    # Сохраняем видео локально
-                    output_folder = current_app.config['OUTPUT_FOLDER']
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    video_filename = f'avatar_{video_id}_{timestamp}.mp4'
-                    video_path = os.path.join(output_folder, video_filename)
-                    
-                    with open(video_path, 'wb') as f:
-                        for chunk in video_response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    
-                    logger.info(f"Avatar video downloaded: {video_filename}")
-                    
-                    return jsonify({
-                        'success': True,
-                        'filename': video_filename,
-                        'path': video_path,
-                        'url': f'/api/montage/download/{video_filename}'
-                    })
-            
-            return jsonify({'error': 'Video URL not available'}), 404
-        else:
-            return jsonify({'error': 'Failed to get video info'}), response.status_code
+        if not job.get('path'):
+            return jsonify({
+                'error': 'Video not ready',
+                'status': job['status']
+            }), 409 if job['status'] != 'failed' else 404
+        
+        return jsonify({
+            'success': True,
+            'filename': job['filename'],
+            'path': job['path'],
+            'url': f'/api/montage/download/{job["filename"]}'
+        })
     
     except Exception as e:
         logger.error(f"Error downloading avatar video: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _fetch_avatars(api_key, api_base):
+    """Загрузить и отформатировать список аватаров HeyGen"""
+    url = f"{api_base}/avatars"
+    
+    headers = {
+        "X-Api-Key": api_key
+    }
+    
+    response = requests.get(url, headers=headers, timeout=10)
+    
+    if response.status_code != 200:
+        raise CatalogError(response.status_code, f'HeyGen API error: {response.status_code}')
+    
+    avatars = response.json().get('data', {}).get('avatars', [])
+    
+    # Форматирование списка аватаров
+    formatted_avatars = []
+    for avatar in avatars:
+        formatted_avatars.append({
+            'avatar_id': avatar.get('avatar_id'),
+            'avatar_name': avatar.get('avatar_name'),
+            'gender': avatar.get('gender'),
+            'preview_image': avatar.get('preview_image_url'),
+            'preview_video': avatar.get('preview_video_url')
+        })
+    
+    return {
+        'success': True,
+        'avatars': formatted_avatars,
+        'count': len(formatted_avatars)
+    }
+
+def _fetch_voices(api_key, api_base):
+    """Загрузить и отформатировать список голосов HeyGen"""
+    url = f"{api_base}/voices"
+    
+    headers = {
+        "X-Api-Key": api_key
+    }
+    
+    response = requests.get(url, headers=headers, timeout=10)
+    
+    if response.status_code != 200:
+        raise CatalogError(response.status_code, f'HeyGen API error: {response.status_code}')
+    
+    voices = response.json().get('data', {}).get('voices', [])
+    
+    # Форматирование списка голосов
+    formatted_voices = []
+    for voice in voices:
+        formatted_voices.append({
+            'voice_id': voice.get('voice_id'),
+            'voice_name': voice.get('voice_name'),
+            'language': voice.get('language'),
+            'gender': voice.get('gender'),
+            'preview_audio': voice.get('preview_audio_url')
+        })
+    
+    return {
+        'success': True,
+        'voices': formatted_voices,
+        'count': len(formatted_voices)
+    }
+
 @avatar_bp.route('/list-avatars', methods=['GET'])
 def list_avatars():
     """
-    Получить список доступных аватаров
+    Получить список доступных аватаров (TTL-кэш, ETag)
     """
     try:
         api_key = current_app.config['HEYGEN_API_KEY']
-        url = f"{HEYGEN_API_BASE}/avatars"
-        
-        headers = {
-            "X-Api-Key": api_key
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            avatars = result.get('data', {}).get('avatars', [])
-            
-            # Форматирование списка аватаров
-            formatted_avatars = []
-            for avatar in avatars:
-                formatted_avatars.append({
-                    'avatar_id': avatar.get('avatar_id'),
-                    'avatar_name': avatar.get('avatar_name'),
-                    'gender': avatar.get('gender'),
-                    'preview_image': avatar.get('preview_image_url'),
-                    'preview_video': avatar.get('preview_video_url')
-                })
-            
-            return jsonify({
-                'success': True,
-                'avatars': formatted_avatars,
-                'count': len(formatted_avatars)
-            })
-        else:
-            logger.error(f"HeyGen API error: {response.status_code}")
-            return jsonify({
-                'error': f'HeyGen API error: {response.status_code}'
-            }), response.status_code
+        api_base = _api_base()
+        entry = catalog_cache.get(
+            f'heygen_avatars_{params_key(api_base, api_key)}',
+            lambda: _fetch_avatars(api_key, api_base)
+        )
+        return catalog_response(entry)
+    
+    except CatalogError as e:
+        logger.error(str(e))
+        return jsonify({'error': str(e)}), e.status_code
     
     except Exception as e:
         logger.error(f"Error listing avatars: {e}")
@@ -260,43 +280,20 @@ def list_avatars():
 @avatar_bp.route('/list-voices', methods=['GET'])
 def list_voices():
     """
-    Получить список доступных голосов для аватаров
+    Получить список доступных голосов для аватаров (TTL-кэш, ETag)
     """
     try:
         api_key = current_app.config['HEYGEN_API_KEY']
-        url = f"{HEYGEN_API_BASE}/voices"
-        
-        headers = {
-            "X-Api-Key": api_key
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            voices = result.get('data', {}).get('voices', [])
-            
-            # Форматирование списка голосов
-            formatted_voices = []
-            for voice in voices:
-                formatted_voices.append({
-                    'voice_id': voice.get('voice_id'),
-                    'voice_name': voice.get('voice_name'),
-                    'language': voice.get('language'),
-                    'gender': voice.get('gender'),
-                    'preview_audio': voice.get('preview_audio_url')
-                })
-            
-            return jsonify({
-                'success': True,
-                'voices': formatted_voices,
-                'count': len(formatted_voices)
-            })
-        else:
-            logger.error(f"HeyGen API error: {response.status_code}")
-            return jsonify({
-                'error': f'HeyGen API error: {response.status_code}'
-            }), response.status_code
+        api_base = _api_base()
+        entry = catalog_cache.get(
+            f'heygen_voices_{params_key(api_base, api_key)}',
+            lambda: _fetch_voices(api_key, api_base)
+        )
+        return catalog_response(entry)
+    
+    except CatalogError as e:
+        logger.error(str(e))
+        return jsonify({'error': str(e)}), e.status_code
     
     except Exception as e:
         logger.error(f"Error listing voices: {e}")
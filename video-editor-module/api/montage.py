@@ -12,12 +12,15 @@
 from flask import Blueprint, request, jsonify, current_app, send_file
 import os
 import random
-import subprocess
 import json
 from datetime import datetime
 from werkzeug.utils import secure_filename
 import logging
 
+from utils.spawn_server import run as run_command
+from utils.media_probe import probe
+from utils.avatar_cache import get_keyed_avatar
+
 logger = logging.getLogger(__name__)
 
 montage_bp = Blueprint('montage', __name__)
@@ -29,16 +32,9 @@ def allowed_file(filename, extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
 
 def get_video_duration(video_path):
-    """Получить длительность видео через ffprobe"""
+    """Получить длительность видео (PyAV в процессе, запасной вариант - ffprobe)"""
     try:
-        cmd = [
-            'ffprobe', '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            video_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        return float(result.stdout.strip())
+        return probe(video_path)['duration']
     except Exception as e:
         logger.error(f"Error getting video duration: {e}")
         return 0
@@ -112,6 +108,14 @@ def create_montage():
                 avatar.save(avatar_path)
                 logger.info(f"Saved avatar: {avatar_filename}")
         
+        # Chroma key аватара один раз на все варианты (кэш по хэшу)
+        keyed_avatar_path = None
+        if avatar_path:
+            try:
+                keyed_avatar_path = get_keyed_avatar(avatar_path, current_app.config['CACHE_FOLDER'])
+            except Exception as e:
+                logger.error(f"Avatar keying error: {e}")
+        
         # Создание вариантов монтажа
         output_videos = []
         
@@ -151,7 +155,7 @@ def create_montage():
             
             logger.info(f"Running ffmpeg command: {' '.join(ffmpeg_cmd)}")
             
-            result = subprocess.run(
+            result = run_command(
                 ffmpeg_cmd,
                 capture_output=True,
                 text=True
@@ -161,17 +165,17 @@ def create_montage():
                 logger.info(f"Successfully created montage variant {variant}")
                 
                 # Наложение аватара (если есть)
-                if avatar_path:
+                if keyed_avatar_path:
                     output_with_avatar = output_path.replace('.mp4', '_with_avatar.mp4')
                     overlay_cmd = [
-                        'ffmpeg', '-i', output_path, '-i', avatar_path,
-                        '-filter_complex', '[1:v]colorkey=0x00FF00:0.1:0.1[ckout];[0:v][ckout]overlay=x=10:y=10[out]',
+                        'ffmpeg', '-i', output_path, '-i', keyed_avatar_path,
+                        '-filter_complex', '[0:v][1:v]overlay=x=10:y=10[out]',
                         '-map', '[out]', '-map', '0:a?',
                         '-c:a', 'copy',
                         output_with_avatar
                     ]
                     
-                    overlay_result = subprocess.run(overlay_cmd, capture_output=True, text=True)
+                    overlay_result = run_command(overlay_cmd, capture_output=True, text=True)
                     
                     if overlay_result.returncode == 0:
                         output_path = output_with_avatar
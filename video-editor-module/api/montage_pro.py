@@ -10,82 +10,235 @@
 from flask import Blueprint, request, jsonify, current_app, send_from_directory
 import os
 import random
-import subprocess
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
 from werkzeug.utils import secure_filename
 import logging
 import shutil
 import sys
 
+from utils.spawn_server import run as run_command
+from utils.media_probe import probe
+from utils.content_store import save_upload, link_or_copy, cached_probe
+from utils.storage_index import get_storage_index
+from utils.scratch import get_scratch_space
+from utils.object_store import resolve_source
+from utils.scene_detect import detect_scenes
+from utils.smart_cut import smart_cut
+from utils.variant_planner import plan_variants, DEFAULT_TOLERANCE
+from utils.avatar_cache import get_keyed_avatar
+from utils.subtitles import load_subtitles, shift_cues, write_ass, ass_filter
+from utils.output_profiles import normalize_profiles, profile_filter, profile_output_path
+from api.voice_subtitles import get_transcript
+
 logger = logging.getLogger(__name__)
 
 montage_pro_bp = Blueprint('montage_pro', __name__)
 
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm'}
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'wav', 'aac', 'm4a', 'ogg'}
+ALLOWED_SUBTITLE_EXTENSIONS = {'srt', 'vtt'}
 
 # Максимальный возраст файлов в outputs (7 дней)
 MAX_FILE_AGE_DAYS = 7
+# Размер страницы списка файлов в /storage-info
+STORAGE_PAGE_SIZE = 100
+STORAGE_MAX_PAGE_SIZE = 1000
 
 
 def allowed_file(filename, extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
 
 
-def get_video_info(video_path):
-    """Получить полную информацию о видео через ffprobe"""
+def get_video_info(video_path, cache_folder=None):
+    """
+    Получить полную информацию о видео (PyAV в процессе, запасной вариант - ffprobe)
+    cache_folder - кэш метаданных по content ID файла
+    """
     try:
-        cmd = [
-            'ffprobe', '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'format=duration:stream=width,height,r_frame_rate',
-            '-of', 'json',
-            video_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        data = json.loads(result.stdout)
-        
-        duration = float(data['format']['duration'])
-        stream = data['streams'][0]
-        
-        # Парсинг frame rate
-        fps_parts = stream['r_frame_rate'].split('/')
-        fps = float(fps_parts[0]) / float(fps_parts[1]) if len(fps_parts) == 2 else 30.0
-        
-        return {
-            'duration': duration,
-            'width': stream['width'],
-            'height': stream['height'],
-            'fps': fps
-        }
+        if cache_folder:
+            return cached_probe(video_path, cache_folder, probe)
+        return probe(video_path)
     except Exception as e:
         logger.error(f"Error getting video info: {e}")
-        return {'duration': 0, 'width': 0, 'height': 0, 'fps': 30.0}
+        return {'duration': 0, 'width': 0, 'height': 0, 'fps': 30.0, 'has_audio': False}
 
 
-def cleanup_old_files(output_folder, max_age_days=MAX_FILE_AGE_DAYS):
-    """Удаление старых файлов из outputs"""
-    try:
-        cutoff_time = datetime.now() - timedelta(days=max_age_days)
-        deleted_count = 0
+def _storage_index():
+    """Индекс файлов outputs (учёт места и фоновая очистка - utils.storage_index)"""
+    return get_storage_index(current_app.config['OUTPUT_FOLDER'], current_app.config['CACHE_FOLDER'])
+
+
+def _scratch():
+    """Промежуточные файлы монтажа: tmpfs, при нехватке памяти - uploads/.scratch"""
+    return get_scratch_space(os.path.join(current_app.config['UPLOAD_FOLDER'], '.scratch'))
+
+
+def _advanced_scratch_size(data):
+    """Обрезанные шоты не больше исходных из temp_analysis - их размер и есть оценка"""
+    temp_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'temp_analysis')
+    shots = (data or {}).get('shots') or []
+    return sum(resolve_source(shot['temp_path'], temp_folder)[1]
+               for shot in shots if shot.get('temp_path'))
+
+
+def _render_variant(concat_file, output_path, audio_path=None, avatar_path=None,
+                    avatar_position='x=10:y=10', subtitles=None, profiles=None,
+                    force_encode=False):
+    """
+    Рендер варианта одним проходом ffmpeg:
+    concat шотов + аудио + наложение аватара + прожиг субтитров
+    Без аватара и субтитров видео копируется без перекодирования
+    
+    profiles - список профилей вывода (normalize_profiles): кадр декодируется
+    один раз и через split расходится на ветки crop/scale/pad со своим
+    энкодером, каждая ветка пишется в соседний файл
+    
+    force_encode - перекодировать даже без фильтров (шоты с разными
+    параметрами потока, например после smart-обрезки разных исходников)
+    
+    subtitles - {'cues', 'style', 'width', 'height'}: ASS пишется рядом с
+    concat-файлом; у каждого профиля свой файл с PlayRes = размеру профиля,
+    т.к. прожиг идёт после масштабирования ветки
+    
+    Возвращает (result, [(profile, path), ...])
+    """
+    cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', concat_file]
+    
+    next_input = 1
+    audio_input = None
+    if audio_path:
+        cmd.extend(['-i', audio_path])
+        audio_input = next_input
+        next_input += 1
+    
+    avatar_input = None
+    if avatar_path:
+        cmd.extend(['-i', avatar_path])
+        avatar_input = next_input
+        next_input += 1
+    
+    audio_map = [f'{audio_input}:a'] if audio_input is not None else ['0:a?']
+    audio_codec = ['-c:a', 'aac'] if audio_input is not None else ['-c:a', 'copy']
+    shortest = ['-shortest'] if audio_input is not None else []
+    
+    def write_branch_ass(width, height, suffix):
+        if not subtitles:
+            return None
+        return write_ass(
+            f'{os.path.splitext(concat_file)[0]}{suffix}.ass',
+            subtitles['cues'], width, height, subtitles.get('style')
+        )
+    
+    def branch_filters(source, avatar_label, suffix, ass_path):
+        """Аватар + субтитры поверх ветки, возвращает (фильтры, метка)"""
+        chain = []
+        label = source
+        if avatar_label:
+            chain.append(f'[{label}][{avatar_label}]overlay={avatar_position}[ov{suffix}]')
+            label = f'ov{suffix}'
+        if ass_path:
+            chain.append(f'[{label}]{ass_filter(ass_path)}[subs{suffix}]')
+            label = f'subs{suffix}'
+        return chain, label
+    
+    if not profiles:
+        filters, video_label = branch_filters(
+            '0:v', f'{avatar_input}:v' if avatar_input is not None else None, '',
+            write_branch_ass(subtitles['width'], subtitles['height'], '') if subtitles else None
+        )
+        if filters:
+            cmd.extend(['-filter_complex', ';'.join(filters), '-map', f'[{video_label}]'])
+            cmd.extend(['-c:v', 'libx264', '-preset', 'fast'])
+        elif force_encode:
+            cmd.extend(['-map', '0:v', '-c:v', 'libx264', '-preset', 'fast'])
+        else:
+            cmd.extend(['-map', '0:v', '-c:v', 'copy'])
+        for stream in audio_map:
+            cmd.extend(['-map', stream])
+        cmd.extend(audio_codec + shortest + [output_path])
+        outputs = [(None, output_path)]
+    else:
+        # Один декод -> split на ветки профилей
+        n = len(profiles)
+        filters = [f"[0:v]split={n}{''.join(f'[src{i}]' for i in range(n))}"]
+        if avatar_input is not None:
+            filters.append(
+                f"[{avatar_input}:v]split={n}{''.join(f'[av{i}]' for i in range(n))}"
+            )
         
-        for filename in os.listdir(output_folder):
-            filepath = os.path.join(output_folder, filename)
-            if os.path.isfile(filepath):
-                file_modified = datetime.fromtimestamp(os.path.getmtime(filepath))
-                if file_modified < cutoff_time:
-                    os.remove(filepath)
-                    deleted_count += 1
-                    logger.info(f"Deleted old file: {filename}")
-        
-        if deleted_count > 0:
-            logger.info(f"Cleaned up {deleted_count} old files")
-        
-        return deleted_count
-    except Exception as e:
-        logger.error(f"Error cleaning up old files: {e}")
-        return 0
+        branch_labels = []
+        for i, profile in enumerate(profiles):
+            filters.append(f'[src{i}]{profile_filter(profile)}[fit{i}]')
+            chain, label = branch_filters(
+                f'fit{i}', f'av{i}' if avatar_input is not None else None, str(i),
+                write_branch_ass(profile['width'], profile['height'], f"_{profile['name']}")
+            )
+            filters.extend(chain)
+            branch_labels.append(label)
+        
+        cmd.extend(['-filter_complex', ';'.join(filters)])
+        
+        outputs = []
+        for profile, label in zip(profiles, branch_labels):
+            profile_path = profile_output_path(output_path, profile)
+            cmd.extend(['-map', f'[{label}]'])
+            for stream in audio_map:
+                cmd.extend(['-map', stream])
+            cmd.extend([
+                '-c:v', 'libx264', '-preset', 'fast',
+                '-b:v', profile['video_bitrate'],
+                '-c:a', 'aac', '-b:a', profile['audio_bitrate']
+            ])
+            cmd.extend(shortest + [profile_path])
+            outputs.append((profile, profile_path))
+    
+    result = run_command(cmd, capture_output=True, text=True)
+    return result, outputs
+
+
+def _resolve_subtitle_cues(file_path, audio_path, cache_folder, language='auto'):
+    """
+    Реплики субтитров: из готового файла (SRT/VTT)
+    или из (кэшированного) транскрипта аудио через voice_subtitles
+    """
+    if file_path and os.path.exists(file_path):
+        return load_subtitles(file_path)
+    
+    if audio_path and os.path.exists(audio_path):
+        transcript, _ = get_transcript(audio_path, language, cache_folder)
+        if transcript:
+            return [
+                {'start': seg['start'], 'end': seg['end'], 'text': seg['text']}
+                for seg in transcript['segments'] if seg['text']
+            ]
+    
+    logger.warning("Subtitles requested but no subtitle source available")
+    return []
+
+
+def _describe_output(output_path, profile=None):
+    """Описание готового файла для ответа API"""
+    output_filename = os.path.basename(output_path)
+    final_info = get_video_info(output_path)
+    file_size = os.path.getsize(output_path)
+    _storage_index().record(output_path)
+    
+    description = {
+        'filename': output_filename,
+        'url': f'/video-outputs/{output_filename}',
+        'duration': round(final_info['duration'], 2),
+        'size': file_size,
+        'size_mb': round(file_size / (1024 * 1024), 2)
+    }
+    if profile:
+        description.update({
+            'profile': profile['name'],
+            'aspect': profile['aspect'],
+            'width': profile['width'],
+            'height': profile['height']
+        })
+    return description
 
 
 # =====================================================
@@ -97,12 +250,14 @@ def analyze_shots():
     Анализ загруженных шотов - возвращает длительность и мета-данные
     Параметры:
     - shots[]: видео файлы для анализа
+    - detect_scenes: предложить границы шотов (true/false, по умолчанию false)
     """
     try:
         if 'shots[]' not in request.files:
             return jsonify({'error': 'No video shots provided'}), 400
         
         shots = request.files.getlist('shots[]')
+        detect_scenes_enabled = request.form.get('detect_scenes', 'false').lower() == 'true'
         
         # Временная папка для анализа
         upload_folder = current_app.config['UPLOAD_FOLDER']
@@ -116,17 +271,17 @@ def analyze_shots():
             if shot and allowed_file(shot.filename, ALLOWED_VIDEO_EXTENSIONS):
                 filename = secure_filename(f'temp_{idx}_{shot.filename}')
                 filepath = os.path.join(temp_folder, filename)
-                shot.save(filepath)
+                save_upload(shot, filepath, current_app.config['CACHE_FOLDER'])
                 
-                # Копируем в outputs для доступа через Nginx /video-outputs/
+                # Ссылка в outputs для доступа через Nginx /video-outputs/
                 output_preview_path = os.path.join(output_folder, f'preview_{filename}')
-                shutil.copy2(filepath, output_preview_path)
+                link_or_copy(filepath, output_preview_path)
                 
                 # Анализ видео
-                info = get_video_info(filepath)
+                info = get_video_info(filepath, current_app.config['CACHE_FOLDER'])
                 file_size = os.path.getsize(filepath)
                 
-                analyzed_shots.append({
+                shot_data = {
                     'index': idx,
                     'original_filename': shot.filename,
                     'duration': round(info['duration'], 2),
@@ -136,7 +291,21 @@ def analyze_shots():
                     'file_size_mb': round(file_size / (1024 * 1024), 2),
                     'temp_path': filename,
                     'preview_url': f'/video-outputs/preview_{filename}'
-                })
+                }
+                
+                # Предложенные границы шотов (кэш по хэшу содержимого)
+                if detect_scenes_enabled:
+                    try:
+                        shot_data['scenes'] = detect_scenes(
+                            filepath,
+                            info['duration'],
+                            cache_folder=current_app.config['CACHE_FOLDER']
+                        )
+                    except Exception as e:
+                        logger.warning(f"Scene detection failed for shot {idx}: {e}")
+                        shot_data['scenes'] = None
+                
+                analyzed_shots.append(shot_data)
                 
                 logger.info(f"Analyzed shot {idx}: {shot.filename} - {info['duration']:.2f}s")
         
@@ -164,8 +333,15 @@ def create_montage():
     - shots[]: видео файлы
     - audio: аудио файл (опционально)
     - avatar: видео аватара (опционально)
+    - avatar_width: ширина аватара в пикселях (опционально)
     - shuffle_count: количество вариантов
-    - add_subtitles: добавлять субтитры
+    - seed: seed планировщика вариантов (опционально)
+    - add_subtitles: добавлять субтитры (прожиг в том же проходе)
+    - subtitles: файл SRT/VTT (опционально, иначе генерация по audio)
+    - subtitle_language: язык для генерации субтитров (по умолчанию auto)
+    - subtitle_style: JSON стиля субтитров (опционально)
+    - output_profiles: JSON список профилей вывода, например
+      ["9:16", "1:1", {"aspect": "16:9", "video_bitrate": "8M", "fit": "pad"}]
     
     Advanced Mode (JSON):
     {
@@ -181,10 +357,15 @@ def create_montage():
             }
         ],
         "shuffle_count": 5,
+        "seed": 12345,
         "enable_random_offsets": true,
+        "trim_mode": "smart",
         "target_duration": 30,
+        "duration_tolerance": 1.0,
         "audio": {"file_path": "...", "source": "upload"},
-        "avatar_overlay": {"file_path": "...", "position": "bottom-left"},
+        "avatar_overlay": {"file_path": "...", "position": "bottom-left", "width": 320},
+        "subtitles": {"enabled": true, "file_path": "...", "source": "generated", "style": {}},
+        "output_profiles": ["9:16", "1:1", {"aspect": "16:9", "width": 1920, "height": 1080, "video_bitrate": "8M"}],
         "uniquify": {"enabled": true, "preset": "balanced"}
     }
     """
@@ -192,18 +373,25 @@ def create_montage():
         # Определяем режим по Content-Type
         content_type = request.content_type or ''
         
+        # Промежуточные файлы проекта живут в рабочем пространстве до конца запроса
         if 'application/json' in content_type:
-            return _create_advanced_montage(request.get_json())
+            data = request.get_json()
+            with _scratch().workspace('montage_pro', _advanced_scratch_size(data)) as workspace:
+                return _create_advanced_montage(data, workspace)
         else:
-            return _create_quick_montage(request)
+            with _scratch().workspace('montage_pro', request.content_length or 0) as workspace:
+                return _create_quick_montage(request, workspace)
     
     except Exception as e:
         logger.error(f"Error creating montage: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-def _create_quick_montage(req):
-    """Создание монтажа в быстром режиме (V1 логика)"""
+def _create_quick_montage(req, workspace):
+    """
+    Создание монтажа в быстром режиме (V1 логика)
+    workspace - рабочее пространство для загруженных шотов и промежуточных файлов
+    """
     # Проверка наличия файлов
     if 'shots[]' not in req.files:
         return jsonify({'error': 'No video shots provided'}), 400
@@ -215,19 +403,29 @@ def _create_quick_montage(req):
     
     # Параметры
     shuffle_count = int(req.form.get('shuffle_count', 1))
+    seed = int(req.form.get('seed') or random.randrange(2 ** 31))
     add_subtitles = req.form.get('add_subtitles', 'false').lower() == 'true'
+    try:
+        output_profiles = normalize_profiles(json.loads(req.form.get('output_profiles') or '[]'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid output_profiles: {e}'}), 400
+    try:
+        subtitle_style = json.loads(req.form.get('subtitle_style') or '{}')
+    except ValueError as e:
+        return jsonify({'error': f'Invalid subtitle_style: {e}'}), 400
+    if not isinstance(subtitle_style, dict):
+        return jsonify({'error': 'Invalid subtitle_style: JSON object expected'}), 400
     
-    # Сохранение загруженных шотов
-    upload_folder = current_app.config['UPLOAD_FOLDER']
+    # Сохранение загруженных шотов: промежуточные файлы живут только в рабочем
+    # пространстве, хранилище по содержимому им не нужно (и держало бы место после выхода)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    project_folder = os.path.join(upload_folder, f'montage_pro_{timestamp}')
-    os.makedirs(project_folder, exist_ok=True)
+    project_folder = workspace.path
     
     shot_paths = []
     for idx, shot in enumerate(shots):
         if shot and allowed_file(shot.filename, ALLOWED_VIDEO_EXTENSIONS):
             filename = secure_filename(f'shot_{idx:02d}_{shot.filename}')
-            filepath = os.path.join(project_folder, filename)
+            filepath = workspace.file(filename)
             shot.save(filepath)
             shot_paths.append(filepath)
             logger.info(f"Saved shot {idx}: {filename}")
@@ -246,7 +444,7 @@ def _create_quick_montage(req):
         audio = req.files['audio']
         if audio and allowed_file(audio.filename, ALLOWED_AUDIO_EXTENSIONS):
             audio_filename = secure_filename(f'audio_{audio.filename}')
-            audio_path = os.path.join(project_folder, audio_filename)
+            audio_path = workspace.file(audio_filename)
             audio.save(audio_path)
             logger.info(f"Saved audio: {audio_filename}")
     
@@ -256,18 +454,56 @@ def _create_quick_montage(req):
         avatar = req.files['avatar']
         if avatar and allowed_file(avatar.filename, ALLOWED_VIDEO_EXTENSIONS):
             avatar_filename = secure_filename(f'avatar_{avatar.filename}')
-            avatar_path = os.path.join(project_folder, avatar_filename)
+            avatar_path = workspace.file(avatar_filename)
             avatar.save(avatar_path)
             logger.info(f"Saved avatar: {avatar_filename}")
     
+    # Chroma key аватара один раз на все варианты (кэш по хэшу)
+    keyed_avatar_path = None
+    if avatar_path:
+        try:
+            keyed_avatar_path = get_keyed_avatar(
+                avatar_path,
+                current_app.config['CACHE_FOLDER'],
+                width=req.form.get('avatar_width')
+            )
+        except Exception as e:
+            logger.error(f"Avatar keying error: {e}")
+    
+    # Субтитры: одна дорожка по аудио для всех вариантов
+    subtitles = None
+    if add_subtitles:
+        subtitle_file_path = None
+        if 'subtitles' in req.files:
+            subtitle_file = req.files['subtitles']
+            if subtitle_file and allowed_file(subtitle_file.filename, ALLOWED_SUBTITLE_EXTENSIONS):
+                subtitle_file_path = workspace.file(
+                    secure_filename(f'subtitles_{subtitle_file.filename}')
+                )
+                subtitle_file.save(subtitle_file_path)
+        
+        cues = _resolve_subtitle_cues(
+            subtitle_file_path, audio_path, current_app.config['CACHE_FOLDER'],
+            req.form.get('subtitle_language', 'auto')
+        )
+        if cues:
+            hook_info = get_video_info(hook_shot)
+            subtitles = {
+                'cues': cues,
+                'style': subtitle_style,
+                'width': hook_info['width'] or 1080,
+                'height': hook_info['height'] or 1920
+            }
+    
+    # Различные порядки middle шотов (воспроизводимы по seed)
+    plans, _ = plan_variants([0] * len(middle_shots), shuffle_count, seed)
+    
     # Создание вариантов монтажа
     output_folder = current_app.config['OUTPUT_FOLDER']
     output_videos = []
     
-    for variant in range(shuffle_count):
-        # Случайное перемешивание средних шотов
-        shuffled_middle = middle_shots.copy()
-        random.shuffle(shuffled_middle)
+    for variant, plan in enumerate(plans):
+        shuffled_middle = [middle_shots[i] for i in plan['order']]
         
         # Финальный порядок: Hook + shuffled middle + CTA
         final_order = [hook_shot] + shuffled_middle + [cta_shot]
@@ -278,69 +514,36 @@ def _create_quick_montage(req):
             for shot_path in final_order:
                 f.write(f"file '{shot_path}'\n")
         
-        # Монтаж видео через ffmpeg
-        output_filename = f'montage_pro_{timestamp}_v{variant:02d}.mp4'
+        # Монтаж видео одним проходом ffmpeg (аудио, аватар, субтитры)
+        suffix = '_avatar' if keyed_avatar_path else ''
+        output_filename = f'montage_pro_{timestamp}_v{variant:02d}{suffix}.mp4'
         output_path = os.path.join(output_folder, output_filename)
         
-        # Базовая команда ffmpeg для конкатенации
-        ffmpeg_cmd = [
-            'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
-            '-i', concat_file
-        ]
-        
-        # Добавление аудио если есть
-        if audio_path:
-            ffmpeg_cmd.extend(['-i', audio_path])
-            ffmpeg_cmd.extend(['-c:v', 'copy', '-c:a', 'aac', '-shortest'])
-        else:
-            ffmpeg_cmd.extend(['-c', 'copy'])
-        
-        ffmpeg_cmd.append(output_path)
-        
         logger.info(f"Running ffmpeg command for variant {variant}")
         
-        result = subprocess.run(
-            ffmpeg_cmd,
-            capture_output=True,
-            text=True
+        result, rendered = _render_variant(
+            concat_file, output_path,
+            audio_path=audio_path,
+            avatar_path=keyed_avatar_path,
+            subtitles=subtitles,
+            profiles=output_profiles
         )
         
         if result.returncode == 0:
             logger.info(f"Successfully created montage variant {variant}")
             
-            # Наложение аватара (если есть)
-            if avatar_path:
-                output_with_avatar = output_path.replace('.mp4', '_avatar.mp4')
-                overlay_cmd = [
-                    'ffmpeg', '-y', '-i', output_path, '-i', avatar_path,
-                    '-filter_complex', '[1:v]colorkey=0x00FF00:0.1:0.1[ckout];[0:v][ckout]overlay=x=10:y=10[out]',
-                    '-map', '[out]', '-map', '0:a?',
-                    '-c:a', 'copy',
-                    output_with_avatar
-                ]
-                
-                overlay_result = subprocess.run(overlay_cmd, capture_output=True, text=True)
-                
-                if overlay_result.returncode == 0:
-                    # Удаляем промежуточный файл
-                    os.remove(output_path)
-                    output_path = output_with_avatar
-                    output_filename = os.path.basename(output_with_avatar)
-                    logger.info(f"Successfully added avatar to variant {variant}")
-            
-            # Получаем информацию о результате
-            final_info = get_video_info(output_path)
-            file_size = os.path.getsize(output_path)
-            
-            output_videos.append({
+            # Получаем информацию о результате (первый профиль - основной)
+            described = [_describe_output(path, profile) for profile, path in rendered]
+            variant_data = dict(described[0])
+            variant_data.update({
                 'variant': variant,
-                'filename': output_filename,
-                'url': f'/video-outputs/{output_filename}',
-                'duration': round(final_info['duration'], 2),
-                'size': file_size,
-                'size_mb': round(file_size / (1024 * 1024), 2),
-                'shots_count': len(final_order)
+                'shots_count': len(final_order),
+                'subtitles': bool(subtitles)
             })
+            if output_profiles:
+                variant_data['profiles'] = described
+            
+            output_videos.append(variant_data)
         else:
             logger.error(f"FFmpeg error: {result.stderr}")
     
@@ -348,6 +551,7 @@ def _create_quick_montage(req):
         'success': True,
         'mode': 'quick',
         'project_id': timestamp,
+        'seed': seed,
         'variants_created': len(output_videos),
         'outputs': output_videos,
         'hook': os.path.basename(hook_shot),
@@ -356,30 +560,41 @@ def _create_quick_montage(req):
     })
 
 
-def _create_advanced_montage(data):
-    """Создание монтажа в продвинутом режиме (V2 логика с обрезкой)"""
+def _create_advanced_montage(data, workspace):
+    """
+    Создание монтажа в продвинутом режиме (V2 логика с обрезкой)
+    workspace - рабочее пространство для обрезанных шотов, concat-списков и субтитров
+    """
     if not data or 'shots' not in data:
         return jsonify({'error': 'No shots configuration provided'}), 400
     
     shots_config = data['shots']
     shuffle_count = int(data.get('shuffle_count', 1))
+    seed = int(data.get('seed') if data.get('seed') is not None else random.randrange(2 ** 31))
     target_duration = float(data.get('target_duration', 0))
+    duration_tolerance = float(data.get('duration_tolerance', DEFAULT_TOLERANCE))
     enable_random_offsets = data.get('enable_random_offsets', False)
+    # 'reencode' - полное перекодирование шота, 'smart' - только края GOP
+    trim_mode = data.get('trim_mode', 'reencode')
     uniquify_config = data.get('uniquify', {})
     audio_config = data.get('audio', {})
     avatar_config = data.get('avatar_overlay', {})
+    subtitles_config = data.get('subtitles', {})
+    try:
+        output_profiles = normalize_profiles(data.get('output_profiles'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid output_profiles: {e}'}), 400
+    if not isinstance(subtitles_config.get('style') or {}, dict):
+        return jsonify({'error': 'Invalid subtitles.style: JSON object expected'}), 400
     
-    # Очистка старых файлов
     output_folder = current_app.config['OUTPUT_FOLDER']
-    cleanup_old_files(output_folder)
     
     # Получаем файлы из temp папки
     upload_folder = current_app.config['UPLOAD_FOLDER']
     temp_folder = os.path.join(upload_folder, 'temp_analysis')
     
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    project_folder = os.path.join(upload_folder, f'montage_pro_{timestamp}')
-    os.makedirs(project_folder, exist_ok=True)
+    project_folder = workspace.path
     
     # Обработка каждого шота с точной обрезкой
     processed_shots = []
@@ -398,9 +613,10 @@ def _create_advanced_montage(data):
             logger.warning(f"Shot {idx}: no temp_path, skipping")
             continue
         
-        source_path = os.path.join(temp_folder, temp_path)
-        if not os.path.exists(source_path):
-            logger.warning(f"Shot {idx}: source not found at {source_path}")
+        # temp_path - файл из temp_analysis или ссылка s3://bucket/key
+        source_path, _ = resolve_source(temp_path, temp_folder)
+        if not source_path:
+            logger.warning(f"Shot {idx}: source not found: {temp_path}")
             continue
         
         # Обрезка видео по времени
@@ -436,22 +652,42 @@ def _create_advanced_montage(data):
             output_path
         ])
         
-        result = subprocess.run(trim_cmd, capture_output=True, text=True)
+        if trim_mode == 'smart':
+            try:
+                smart_cut(
+                    source_path, start_time,
+                    end_time if end_time is not None and end_time > start_time else None,
+                    output_path, audio_bitrate='128k'
+                )
+                trim_ok, trim_error = True, None
+            except Exception as e:
+                trim_ok, trim_error = False, str(e)
+        else:
+            result = run_command(trim_cmd, capture_output=True, text=True)
+            trim_ok, trim_error = result.returncode == 0, result.stderr
         
-        if result.returncode == 0:
+        if trim_ok:
             trimmed_info = get_video_info(output_path)
             logger.info(f"Shot {idx}: trimmed successfully, duration: {trimmed_info['duration']:.2f}s")
             
+            # Собственные субтитры шота (тайминг относительно исходника)
+            shot_cues = []
+            if shot_cfg.get('subtitle_path'):
+                subtitle_path = os.path.join(output_folder, os.path.basename(shot_cfg['subtitle_path']))
+                if os.path.exists(subtitle_path):
+                    shot_cues = load_subtitles(subtitle_path)
+            
             processed_shots.append({
                 'index': idx,
                 'type': shot_type,
                 'path': output_path,
                 'start_time': start_time,
                 'end_time': end_time,
-                'trimmed_duration': trimmed_info['duration']
+                'trimmed_duration': trimmed_info['duration'],
+                'subtitle_cues': shot_cues
             })
         else:
-            logger.error(f"Shot {idx}: trim error: {result.stderr}")
+            logger.error(f"Shot {idx}: trim error: {trim_error}")
     
     if len(processed_shots) < 3:
         return jsonify({'error': f'Failed to process minimum 3 shots, got {len(processed_shots)}'}), 500
@@ -484,13 +720,60 @@ def _create_advanced_montage(data):
         if avatar_config.get('source') == 'heygen':
             avatar_path = os.path.join(output_folder, avatar_path)
     
+    # Chroma key аватара один раз на все варианты (кэш по хэшу)
+    keyed_avatar_path = None
+    if avatar_path and os.path.exists(avatar_path):
+        try:
+            keyed_avatar_path = get_keyed_avatar(
+                avatar_path,
+                current_app.config['CACHE_FOLDER'],
+                width=avatar_config.get('width')
+            )
+        except Exception as e:
+            logger.error(f"Avatar keying error: {e}")
+    
+    # Определяем позицию аватара
+    position_map = {
+        'bottom-left': 'x=10:y=H-h-10',
+        'bottom-right': 'x=W-w-10:y=H-h-10',
+        'top-left': 'x=10:y=10',
+        'top-right': 'x=W-w-10:y=10'
+    }
+    position = position_map.get(avatar_position, 'x=10:y=H-h-10')
+    
+    # Субтитры: общая дорожка (по аудио) + субтитры шотов, сдвигаемые под порядок варианта
+    subtitles_enabled = subtitles_config.get('enabled', False)
+    global_cues = []
+    subtitle_size = (1080, 1920)
+    if subtitles_enabled:
+        subtitle_file = subtitles_config.get('file_path')
+        if subtitle_file and subtitles_config.get('source') == 'generated':
+            subtitle_file = os.path.join(output_folder, subtitle_file)
+        if subtitle_file or not any(s['subtitle_cues'] for s in processed_shots):
+            global_cues = _resolve_subtitle_cues(
+                subtitle_file,
+                audio_path,
+                current_app.config['CACHE_FOLDER'],
+                subtitles_config.get('language', 'auto')
+            )
+        hook_info = get_video_info(hook_shot['path'])
+        subtitle_size = (hook_info['width'] or 1080, hook_info['height'] or 1920)
+    
+    # План вариантов под target_duration (без рендера, по известным длительностям)
+    fixed_duration = hook_shot['trimmed_duration'] + cta_shot['trimmed_duration']
+    plans, plan_info = plan_variants(
+        [s['trimmed_duration'] for s in middle_shots],
+        shuffle_count,
+        seed,
+        target_middle_duration=target_duration - fixed_duration if target_duration > 0 else None,
+        tolerance=duration_tolerance
+    )
+    
     # Создание вариантов монтажа
     output_videos = []
     
-    for variant in range(shuffle_count):
-        # Случайное перемешивание middle шотов
-        shuffled_middle = middle_shots.copy()
-        random.shuffle(shuffled_middle)
+    for variant, plan in enumerate(plans):
+        shuffled_middle = [middle_shots[i] for i in plan['order']]
         
         # Финальный порядок
         final_order = [hook_shot] + shuffled_middle + [cta_shot]
@@ -501,81 +784,68 @@ def _create_advanced_montage(data):
             for shot in final_order:
                 f.write(f"file '{shot['path']}'\n")
         
-        # Монтаж
-        output_filename = f'montage_pro_{timestamp}_v{variant:02d}.mp4'
-        output_path = os.path.join(output_folder, output_filename)
-        
-        # Базовая конкатенация
-        concat_cmd = [
-            'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
-            '-i', concat_file,
-        ]
-        
-        # Добавление аудио
-        if audio_path and os.path.exists(audio_path):
-            concat_cmd.extend(['-i', audio_path])
-            concat_cmd.extend(['-c:v', 'copy', '-c:a', 'aac', '-shortest'])
-        else:
-            concat_cmd.extend(['-c', 'copy'])
+        # Субтитры варианта: реплики шотов сдвигаются на их позицию в порядке
+        subtitles = None
+        if subtitles_enabled:
+            variant_cues = list(global_cues)
+            offset = 0.0
+            for shot in final_order:
+                variant_cues.extend(shift_cues(
+                    shot['subtitle_cues'], offset, shot['start_time'], shot['end_time']
+                ))
+                offset += shot['trimmed_duration']
+            if variant_cues:
+                subtitles = {
+                    'cues': variant_cues,
+                    'style': subtitles_config.get('style'),
+                    'width': subtitle_size[0],
+                    'height': subtitle_size[1]
+                }
         
-        concat_cmd.append(output_path)
+        # Монтаж одним проходом ffmpeg (аудио, аватар, субтитры)
+        suffix = '_avatar' if keyed_avatar_path else ''
+        output_filename = f'montage_pro_{timestamp}_v{variant:02d}{suffix}.mp4'
+        output_path = os.path.join(output_folder, output_filename)
         
         logger.info(f"Creating montage variant {variant}")
         
-        result = subprocess.run(concat_cmd, capture_output=True, text=True)
+        result, rendered = _render_variant(
+            concat_file, output_path,
+            audio_path=audio_path if audio_path and os.path.exists(audio_path) else None,
+            avatar_path=keyed_avatar_path,
+            avatar_position=position,
+            subtitles=subtitles,
+            profiles=output_profiles,
+            force_encode=trim_mode == 'smart'
+        )
         
         if result.returncode == 0:
-            # Наложение аватара
-            if avatar_path and os.path.exists(avatar_path):
-                output_with_avatar = output_path.replace('.mp4', '_avatar.mp4')
-                
-                # Определяем позицию
-                position_map = {
-                    'bottom-left': 'x=10:y=H-h-10',
-                    'bottom-right': 'x=W-w-10:y=H-h-10',
-                    'top-left': 'x=10:y=10',
-                    'top-right': 'x=W-w-10:y=10'
-                }
-                position = position_map.get(avatar_position, 'x=10:y=H-h-10')
-                
-                overlay_cmd = [
-                    'ffmpeg', '-y', '-i', output_path, '-i', avatar_path,
-                    '-filter_complex', f'[1:v]colorkey=0x00FF00:0.1:0.1[ckout];[0:v][ckout]overlay={position}[out]',
-                    '-map', '[out]', '-map', '0:a?',
-                    '-c:a', 'copy',
-                    output_with_avatar
-                ]
-                
-                overlay_result = subprocess.run(overlay_cmd, capture_output=True, text=True)
-                
-                if overlay_result.returncode == 0:
-                    os.remove(output_path)
-                    output_path = output_with_avatar
-                    output_filename = os.path.basename(output_with_avatar)
-            
-            # Уникализация
-            if uniquify_config.get('enabled'):
-                output_path, output_filename = _apply_uniquification(
-                    output_path, 
-                    uniquify_config.get('preset', 'balanced'),
-                    output_folder
-                )
-            
-            # Получаем итоговую длительность
-            final_info = get_video_info(output_path)
-            file_size = os.path.getsize(output_path)
+            described = []
+            for profile, rendered_path in rendered:
+                # Уникализация
+                if uniquify_config.get('enabled'):
+                    rendered_path, _ = _apply_uniquification(
+                        rendered_path,
+                        uniquify_config.get('preset', 'balanced'),
+                        output_folder
+                    )
+                described.append(_describe_output(rendered_path, profile))
             
-            output_videos.append({
+            # Первый профиль - основной вывод варианта
+            variant_data = dict(described[0])
+            variant_data.update({
                 'variant': variant,
-                'filename': output_filename,
-                'url': f'/video-outputs/{output_filename}',
-                'duration': round(final_info['duration'], 2),
-                'size': file_size,
-                'size_mb': round(file_size / (1024 * 1024), 2),
-                'shots_count': len(final_order)
+                'shots_count': len(final_order),
+                'planned_duration': round(fixed_duration + plan['middle_duration'], 2),
+                'middle_order': [s['index'] for s in shuffled_middle],
+                'subtitles': bool(subtitles)
             })
+            if output_profiles:
+                variant_data['profiles'] = described
             
-            logger.info(f"Variant {variant} created: {final_info['duration']:.2f}s")
+            output_videos.append(variant_data)
+            
+            logger.info(f"Variant {variant} created: {variant_data['duration']:.2f}s")
         else:
             logger.error(f"Error creating variant {variant}: {result.stderr}")
     
@@ -589,6 +859,9 @@ def _create_advanced_montage(data):
         'success': True,
         'mode': 'advanced',
         'project_id': timestamp,
+        'seed': seed,
+        'target_duration': target_duration,
+        'target_met': plan_info['target_met'],
         'variants_created': len(output_videos),
         'outputs': output_videos,
         'total_shots': len(processed_shots),
@@ -643,31 +916,19 @@ def get_storage_info():
     """Получить информацию о хранилище"""
     try:
         output_folder = current_app.config['OUTPUT_FOLDER']
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', STORAGE_PAGE_SIZE)), 1), STORAGE_MAX_PAGE_SIZE)
         
-        # Подсчет файлов и размера
-        total_size = 0
-        file_count = 0
-        files = []
-        
-        for filename in os.listdir(output_folder):
-            filepath = os.path.join(output_folder, filename)
-            if os.path.isfile(filepath):
-                file_size = os.path.getsize(filepath)
-                file_modified = datetime.fromtimestamp(os.path.getmtime(filepath))
-                
-                total_size += file_size
-                file_count += 1
-                
-                files.append({
-                    'filename': filename,
-                    'size': file_size,
-                    'size_mb': round(file_size / (1024 * 1024), 2),
-                    'modified': file_modified.isoformat(),
-                    'url': f'/video-outputs/{filename}'
-                })
-        
-        # Сортировка по дате (новые первыми)
-        files.sort(key=lambda x: x['modified'], reverse=True)
+        # Итоги и страница файлов (новые первыми) из индекса, без обхода папки
+        index = _storage_index()
+        file_count, total_size = index.totals()
+        files = [{
+            'filename': item['filename'],
+            'size': item['size'],
+            'size_mb': round(item['size'] / (1024 * 1024), 2),
+            'modified': datetime.fromtimestamp(item['mtime']).isoformat(),
+            'url': f'/video-outputs/{item["filename"]}'
+        } for item in index.page(offset, limit)]
         
         # Получаем место на диске
         statvfs = os.statvfs(output_folder)
@@ -685,7 +946,12 @@ def get_storage_info():
                 'disk_total_gb': round(disk_total / (1024 * 1024 * 1024), 2),
                 'disk_usage_percent': round((1 - disk_free / disk_total) * 100, 2)
             },
-            'files': files
+            'files': files,
+            'pagination': {
+                'offset': offset,
+                'limit': limit,
+                'total': file_count
+            }
         })
     
     except Exception as e:
@@ -700,8 +966,7 @@ def manual_cleanup():
         data = request.get_json() or {}
         max_age_days = int(data.get('max_age_days', MAX_FILE_AGE_DAYS))
         
-        output_folder = current_app.config['OUTPUT_FOLDER']
-        deleted_count = cleanup_old_files(output_folder, max_age_days)
+        deleted_count = _storage_index().sweep(max_age_days)
         
         return jsonify({
             'success': True,
@@ -12,13 +12,20 @@
 from flask import Blueprint, request, jsonify, current_app, send_from_directory
 import os
 import random
-import subprocess
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
 from werkzeug.utils import secure_filename
 import logging
 import shutil
 
+from utils.spawn_server import run as run_command
+from utils.media_probe import probe
+from utils.content_store import save_upload, link_or_copy, cached_probe
+from utils.storage_index import get_storage_index
+from utils.scratch import get_scratch_space
+from utils.object_store import resolve_source
+from utils.variant_planner import plan_variants, DEFAULT_TOLERANCE
+
 logger = logging.getLogger(__name__)
 
 montage_v2_bp = Blueprint('montage_v2', __name__)
@@ -28,62 +35,38 @@ ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'wav', 'aac', 'm4a', 'ogg'}
 
 # Максимальный возраст файлов в outputs (7 дней)
 MAX_FILE_AGE_DAYS = 7
+# Размер страницы списка файлов в /storage-info
+STORAGE_PAGE_SIZE = 100
+STORAGE_MAX_PAGE_SIZE = 1000
 
 def allowed_file(filename, extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
 
-def get_video_info(video_path):
-    """Получить полную информацию о видео через ffprobe"""
+def get_video_info(video_path, cache_folder=None):
+    """
+    Получить полную информацию о видео (PyAV в процессе, запасной вариант - ffprobe)
+    cache_folder - кэш метаданных по content ID файла
+    """
     try:
-        cmd = [
-            'ffprobe', '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'format=duration:stream=width,height,r_frame_rate',
-            '-of', 'json',
-            video_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        data = json.loads(result.stdout)
-        
-        duration = float(data['format']['duration'])
-        stream = data['streams'][0]
-        
-        # Парсинг frame rate
-        fps_parts = stream['r_frame_rate'].split('/')
-        fps = float(fps_parts[0]) / float(fps_parts[1]) if len(fps_parts) == 2 else 30.0
-        
-        return {
-            'duration': duration,
-            'width': stream['width'],
-            'height': stream['height'],
-            'fps': fps
-        }
+        if cache_folder:
+            return cached_probe(video_path, cache_folder, probe)
+        return probe(video_path)
     except Exception as e:
         logger.error(f"Error getting video info: {e}")
-        return {'duration': 0, 'width': 0, 'height': 0, 'fps': 30.0}
+        return {'duration': 0, 'width': 0, 'height': 0, 'fps': 30.0, 'has_audio': False}
 
-def cleanup_old_files(output_folder, max_age_days=MAX_FILE_AGE_DAYS):
-    """Удаление старых файлов из outputs"""
-    try:
-        cutoff_time = datetime.now() - timedelta(days=max_age_days)
-        deleted_count = 0
-        
-        for filename in os.listdir(output_folder):
-            filepath = os.path.join(output_folder, filename)
-            if os.path.isfile(filepath):
-                file_modified = datetime.fromtimestamp(os.path.getmtime(filepath))
-                if file_modified < cutoff_time:
-                    os.remove(filepath)
-                    deleted_count += 1
-                    logger.info(f"Deleted old file: {filename}")
-        
-        if deleted_count > 0:
-            logger.info(f"Cleaned up {deleted_count} old files")
-        
-        return deleted_count
-    except Exception as e:
-        logger.error(f"Error cleaning up old files: {e}")
-        return 0
+def _storage_index():
+    """Индекс файлов outputs (учёт места и фоновая очистка - utils.storage_index)"""
+    return get_storage_index(current_app.config['OUTPUT_FOLDER'], current_app.config['CACHE_FOLDER'])
+
+def _scratch():
+    """Промежуточные файлы монтажа: tmpfs, при нехватке памяти - uploads/.scratch"""
+    return get_scratch_space(os.path.join(current_app.config['UPLOAD_FOLDER'], '.scratch'))
+
+def _shots_scratch_size(shots_config, temp_folder):
+    """Обрезанные шоты не больше исходных - их размер и есть оценка"""
+    return sum(resolve_source(shot['temp_path'], temp_folder)[1]
+               for shot in shots_config if shot.get('temp_path'))
 
 @montage_v2_bp.route('/analyze-shots', methods=['POST'])
 def analyze_shots():
@@ -110,14 +93,14 @@ def analyze_shots():
             if shot and allowed_file(shot.filename, ALLOWED_VIDEO_EXTENSIONS):
                 filename = secure_filename(f'temp_{idx}_{shot.filename}')
                 filepath = os.path.join(temp_folder, filename)
-                shot.save(filepath)
+                save_upload(shot, filepath, current_app.config['CACHE_FOLDER'])
                 
-                # Копируем в outputs для доступа через Nginx /video-outputs/
+                # Ссылка в outputs для доступа через Nginx /video-outputs/
                 output_preview_path = os.path.join(output_folder, f'preview_{filename}')
-                shutil.copy2(filepath, output_preview_path)
+                link_or_copy(filepath, output_preview_path)
                 
                 # Анализ видео
-                info = get_video_info(filepath)
+                info = get_video_info(filepath, current_app.config['CACHE_FOLDER'])
                 
                 analyzed_shots.append({
                     'index': idx,
@@ -169,10 +152,20 @@ def create_advanced_montage():
         ],
         "audio_file": "optional",
         "target_duration": 30,
+        "duration_tolerance": 1.0,
         "shuffle_count": 5,
+        "seed": 12345,
         "enable_random_offsets": true
     }
     """
+    temp_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'temp_analysis')
+    shots_config = (request.get_json(silent=True) or {}).get('shots') or []
+    # Обрезанные шоты и concat-списки - в рабочем пространстве (tmpfs, если помещается)
+    with _scratch().workspace('montage_v2', _shots_scratch_size(shots_config, temp_folder)) as workspace:
+        return _create_advanced_montage(workspace)
+
+def _create_advanced_montage(workspace):
+    """Тело create_advanced_montage: project_folder - папка рабочего пространства"""
     try:
         data = request.get_json()
         
@@ -181,20 +174,19 @@ def create_advanced_montage():
         
         shots_config = data['shots']
         shuffle_count = int(data.get('shuffle_count', 1))
+        seed = int(data.get('seed') if data.get('seed') is not None else random.randrange(2 ** 31))
         target_duration = float(data.get('target_duration', 0))
+        duration_tolerance = float(data.get('duration_tolerance', DEFAULT_TOLERANCE))
         enable_random_offsets = data.get('enable_random_offsets', False)
         
-        # Очистка старых файлов
         output_folder = current_app.config['OUTPUT_FOLDER']
-        cleanup_old_files(output_folder)
         
         # Получаем файлы из temp папки
         upload_folder = current_app.config['UPLOAD_FOLDER']
         temp_folder = os.path.join(upload_folder, 'temp_analysis')
         
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        project_folder = os.path.join(upload_folder, f'montage_v2_{timestamp}')
-        os.makedirs(project_folder, exist_ok=True)
+        project_folder = workspace.path
         
         # Обработка каждого шота с точной обрезкой
         processed_shots = []
@@ -222,8 +214,9 @@ def create_advanced_montage():
                 logger.warning(f"  SKIP: no temp_path")
                 continue
             
-            source_path = os.path.join(temp_folder, temp_path)
-            if not os.path.exists(source_path):
+            # temp_path - файл из temp_analysis или ссылка s3://bucket/key
+            source_path, _ = resolve_source(temp_path, temp_folder)
+            if not source_path:
                 continue
             
             # Обрезка видео по времени
@@ -263,7 +256,7 @@ def create_advanced_montage():
             
             logger.info(f"Trimming shot {idx}: {start_time}s to {end_time}s")
             
-            result = subprocess.run(trim_cmd, capture_output=True, text=True)
+            result = run_command(trim_cmd, capture_output=True, text=True)
             
             if result.returncode == 0:
                 # Проверяем итоговую длительность обрезанного файла
@@ -296,13 +289,21 @@ def create_advanced_montage():
         hook_shot = hook_shots[0]
         cta_shot = cta_shots[0]
         
+        # План вариантов под target_duration (различные порядки, воспроизводимы по seed)
+        fixed_duration = hook_shot['trimmed_duration'] + cta_shot['trimmed_duration']
+        plans, plan_info = plan_variants(
+            [s['trimmed_duration'] for s in middle_shots],
+            shuffle_count,
+            seed,
+            target_middle_duration=target_duration - fixed_duration if target_duration > 0 else None,
+            tolerance=duration_tolerance
+        )
+        
         # Создание вариантов монтажа
         output_videos = []
         
-        for variant in range(shuffle_count):
-            # Случайное перемешивание middle шотов
-            shuffled_middle = middle_shots.copy()
-            random.shuffle(shuffled_middle)
+        for variant, plan in enumerate(plans):
+            shuffled_middle = [middle_shots[i] for i in plan['order']]
             
             # Финальный порядок
             final_order = [hook_shot] + shuffled_middle + [cta_shot]
@@ -326,11 +327,12 @@ def create_advanced_montage():
             
             logger.info(f"Creating montage variant {variant}")
             
-            result = subprocess.run(concat_cmd, capture_output=True, text=True)
+            result = run_command(concat_cmd, capture_output=True, text=True)
             
             if result.returncode == 0:
                 # Получаем итоговую длительность
                 final_info = get_video_info(output_path)
+                _storage_index().record(output_path)
                 
                 output_videos.append({
                     'variant': variant,
@@ -338,7 +340,8 @@ def create_advanced_montage():
                     'url': f'/video-outputs/{output_filename}',
                     'duration': round(final_info['duration'], 2),
                     'size': os.path.getsize(output_path),
-                    'shots_count': len(final_order)
+                    'shots_count': len(final_order),
+                    'planned_duration': round(fixed_duration + plan['middle_duration'], 2)
                 })
                 
                 logger.info(f"Successfully created variant {variant}: {final_info['duration']:.2f}s")
@@ -354,6 +357,8 @@ def create_advanced_montage():
         return jsonify({
             'success': True,
             'project_id': timestamp,
+            'seed': seed,
+            'target_met': plan_info['target_met'],
             'variants_created': len(output_videos),
             'outputs': output_videos,
             'total_shots': len(processed_shots),
@@ -371,31 +376,19 @@ def get_storage_info():
     """Получить информацию о хранилище"""
     try:
         output_folder = current_app.config['OUTPUT_FOLDER']
-        
-        # Подсчет файлов и размера
-        total_size = 0
-        file_count = 0
-        files = []
-        
-        for filename in os.listdir(output_folder):
-            filepath = os.path.join(output_folder, filename)
-            if os.path.isfile(filepath):
-                file_size = os.path.getsize(filepath)
-                file_modified = datetime.fromtimestamp(os.path.getmtime(filepath))
-                
-                total_size += file_size
-                file_count += 1
-                
-                files.append({
-                    'filename': filename,
-                    'size': file_size,
-                    'size_mb': round(file_size / (1024 * 1024), 2),
-                    'modified': file_modified.isoformat(),
-                    'url': f'/video-outputs/{filename}'
-                })
-        
-        # Сортировка по дате (новые первыми)
-        files.sort(key=lambda x: x['modified'], reverse=True)
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', STORAGE_PAGE_SIZE)), 1), STORAGE_MAX_PAGE_SIZE)
+        
+        # Итоги и страница файлов (новые первыми) из индекса, без обхода папки
+        index = _storage_index()
+        file_count, total_size = index.totals()
+        files = [{
+            'filename': item['filename'],
+            'size': item['size'],
+            'size_mb': round(item['size'] / (1024 * 1024), 2),
+            'modified': datetime.fromtimestamp(item['mtime']).isoformat(),
+            'url': f'/video-outputs/{item["filename"]}'
+        } for item in index.page(offset, limit)]
         
         # Получаем место на диске
         statvfs = os.statvfs(output_folder)
@@ -413,7 +406,12 @@ def get_storage_info():
                 'disk_total_gb': round(disk_total / (1024 * 1024 * 1024), 2),
                 'disk_usage_percent': round((1 - disk_free / disk_total) * 100, 2)
             },
-            'files': files
+            'files': files,
+            'pagination': {
+                'offset': offset,
+                'limit': limit,
+                'total': file_count
+            }
         })
     
     except Exception as e:
@@ -427,8 +425,7 @@ def manual_cleanup():
         data = request.get_json() or {}
         max_age_days = int(data.get('max_age_days', MAX_FILE_AGE_DAYS))
         
-        output_folder = current_app.config['OUTPUT_FOLDER']
-        deleted_count = cleanup_old_files(output_folder, max_age_days)
+        deleted_count = _storage_index().sweep(max_age_days)
         
         return jsonify({
             'success': True,
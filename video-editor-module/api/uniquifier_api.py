@@ -17,6 +17,9 @@ from datetime import datetime
 from werkzeug.utils import secure_filename
 import logging
 
+from utils.content_store import save_upload
+from utils.storage_index import get_storage_index
+
 logger = logging.getLogger(__name__)
 
 uniquifier_bp = Blueprint('uniquifier', __name__)
@@ -30,6 +33,11 @@ UNIQUIFIER_PATH = os.path.join(
 )
 
 
+def record_output(path):
+    """Отметить файл в индексе outputs (учёт места для /storage-info)"""
+    get_storage_index(current_app.config['OUTPUT_FOLDER'], current_app.config['CACHE_FOLDER']).record(path)
+
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_VIDEO_EXTENSIONS
 
@@ -141,7 +149,7 @@ def uniquify_single():
         
         filename = secure_filename(video.filename)
         input_path = os.path.join(temp_folder, filename)
-        video.save(input_path)
+        save_upload(video, input_path, current_app.config['CACHE_FOLDER'])
         
         logger.info(f"Uniquifying video: {filename} with preset: {preset}")
         
@@ -157,6 +165,7 @@ def uniquify_single():
         final_filename = os.path.basename(output_path)
         final_path = os.path.join(output_folder, final_filename)
         shutil.move(output_path, final_path)
+        record_output(final_path)
         
         # Очистка
         try:
@@ -230,7 +239,7 @@ def uniquify_batch():
         
         filename = secure_filename(video.filename)
         input_path = os.path.join(temp_folder, filename)
-        video.save(input_path)
+        save_upload(video, input_path, current_app.config['CACHE_FOLDER'])
         
         logger.info(f"Batch uniquifying: {filename}, count={count}, preset={preset}")
         
@@ -252,6 +261,7 @@ def uniquify_batch():
                 
                 if os.path.exists(result['output_path']):
                     shutil.move(result['output_path'], final_path)
+                    record_output(final_path)
                     
                     outputs.append({
                         'version': result['version'],
@@ -342,6 +352,7 @@ def uniquify_from_path():
                 final_path = os.path.join(output_folder, os.path.basename(output_path))
                 shutil.move(output_path, final_path)
                 output_path = final_path
+            record_output(output_path)
             
             output_filename = os.path.basename(output_path)
             
@@ -377,6 +388,7 @@ def uniquify_from_path():
                     
                     if os.path.exists(result['output_path']):
                         shutil.move(result['output_path'], final_path)
+                        record_output(final_path)
                         
                         outputs.append({
                             'version': result['version'],
@@ -442,8 +454,8 @@ def compare_videos():
             video1_path = os.path.join(temp_folder, secure_filename(video1.filename))
             video2_path = os.path.join(temp_folder, secure_filename(video2.filename))
             
-            video1.save(video1_path)
-            video2.save(video2_path)
+            save_upload(video1, video1_path, current_app.config['CACHE_FOLDER'])
+            save_upload(video2, video2_path, current_app.config['CACHE_FOLDER'])
         
         # Или JSON с путями
         elif request.is_json:
@@ -526,7 +538,7 @@ def video_info():
             video = request.files['video']
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             temp_path = os.path.join(upload_folder, f'info_{timestamp}_{secure_filename(video.filename)}')
-            video.save(temp_path)
+            save_upload(video, temp_path, current_app.config['CACHE_FOLDER'])
             video_path = temp_path
             cleanup_after = True
         
@@ -8,12 +8,26 @@
 
 from flask import Blueprint, request, jsonify, current_app, send_file
 import os
-import requests
 import json
 from datetime import datetime
 from werkzeug.utils import secure_filename
 import logging
-import subprocess
+import tempfile
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.spawn_server import run as run_command
+from utils.media_cache import file_content_hash, params_key, load_json, save_json
+from utils.subtitles import render_transcript
+from utils.media_probe import probe
+from utils.transcription_worker import (
+    whisper_available, get_transcription_service, transcription_timeout, DEFAULT_MODEL
+)
+from utils.tts_client import (
+    synthesize, get_session, TTSError, DEFAULT_VOICE_ID, DEFAULT_MODEL_ID,
+    MAX_CONCURRENT_REQUESTS
+)
+from utils.catalog_cache import catalog_cache, catalog_response, CatalogError
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +35,148 @@ voice_subtitles_bp = Blueprint('voice_subtitles', __name__)
 
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'wav', 'aac', 'm4a', 'ogg', 'flac'}
 
+# Максимум текстов в одном batch запросе
+MAX_BATCH_ITEMS = 100
+
 def allowed_audio_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_AUDIO_EXTENSIONS
 
+def _transcribe_cli(audio_path, language='auto'):
+    """Транскрибация через Whisper CLI (JSON со словами) -> транскрипт или None"""
+    temp_dir = tempfile.mkdtemp(prefix='whisper_')
+    try:
+        whisper_cmd = [
+            'whisper', audio_path,
+            '--model', DEFAULT_MODEL,
+            '--output_format', 'json',
+            '--word_timestamps', 'True',
+            '--output_dir', temp_dir
+        ]
+        
+        if language != 'auto':
+            whisper_cmd.extend(['--language', language])
+        
+        # Таймаут от длительности аудио, как у резидентного воркера
+        try:
+            duration = probe(audio_path)['duration']
+        except Exception:
+            duration = 0
+        
+        result = run_command(
+            whisper_cmd,
+            capture_output=True,
+            text=True,
+            timeout=transcription_timeout(duration)
+        )
+        
+        base_name = os.path.splitext(os.path.basename(audio_path))[0]
+        json_path = os.path.join(temp_dir, f'{base_name}.json')
+        if result.returncode != 0 or not os.path.exists(json_path):
+            logger.warning("Whisper CLI not available, trying alternative method...")
+            return None
+        
+        with open(json_path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+        
+        return {
+            'language': raw.get('language') or language,
+            'model': DEFAULT_MODEL,
+            'segments': [
+                {
+                    'start': float(seg['start']),
+                    'end': float(seg['end']),
+                    'text': seg['text'].strip(),
+                    'words': [
+                        {'start': float(w['start']), 'end': float(w['end']), 'word': w['word']}
+                        for w in seg.get('words', [])
+                    ]
+                }
+                for seg in raw.get('segments', [])
+            ]
+        }
+    
+    except Exception as whisper_error:
+        logger.warning(f"Whisper error: {whisper_error}")
+        return None
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def get_transcript(audio_path, language='auto', cache_folder=None):
+    """
+    Транскрипт аудио со словами: {'language', 'model', 'segments': [...]}
+    Кэшируется по (хэш содержимого аудио, язык, модель) - повторные запросы
+    и смена формата субтитров не транскрибируют заново
+    Возвращает (transcript | None, cached)
+    """
+    key = None
+    if cache_folder:
+        key = f"{file_content_hash(audio_path)}_{params_key(language, DEFAULT_MODEL)}"
+        cached = load_json(cache_folder, 'transcripts', key)
+        if cached:
+            logger.info(f"Using cached transcript for {os.path.basename(audio_path)}")
+            return cached, True
+    
+    transcript = None
+    if whisper_available():
+        try:
+            transcript = get_transcription_service().transcribe(audio_path, language)
+            transcript['method'] = 'whisper-worker'
+        except Exception as worker_error:
+            logger.warning(f"Transcription worker error: {worker_error}, falling back to CLI")
+    
+    if transcript is None:
+        transcript = _transcribe_cli(audio_path, language)
+        if transcript:
+            transcript['method'] = 'whisper-cli'
+    
+    if transcript and key:
+        save_json(cache_folder, 'transcripts', key, transcript)
+    return transcript, False
+
+def _voice_item(item, defaults, output_filename):
+    """Озвучить один текст и скопировать результат из кэша в outputs"""
+    text = item['text']
+    voice_id = item.get('voice_id', defaults.get('voice_id', DEFAULT_VOICE_ID))
+    model_id = item.get('model_id', defaults.get('model_id', DEFAULT_MODEL_ID))
+    voice_settings = item.get('voice_settings', defaults.get('voice_settings'))
+    
+    cached_path, cached = synthesize(
+        text,
+        api_key=defaults['api_key'],
+        cache_folder=defaults['cache_folder'],
+        voice_id=voice_id,
+        model_id=model_id,
+        voice_settings=voice_settings,
+        api_base=defaults['api_base']
+    )
+    
+    audio_path = os.path.join(defaults['output_folder'], output_filename)
+    shutil.copyfile(cached_path, audio_path)
+    
+    return {
+        'success': True,
+        'filename': output_filename,
+        'path': audio_path,
+        'url': f'/api/voice-subtitles/download/{output_filename}',
+        'text_length': len(text),
+        'voice_id': voice_id,
+        'language': item.get('language', defaults.get('language', 'en')),
+        'cached': cached
+    }
+
+def _voice_defaults(data):
+    """Общие параметры озвучки из запроса и конфигурации приложения"""
+    return {
+        'voice_id': data.get('voice_id', DEFAULT_VOICE_ID),
+        'model_id': data.get('model_id', DEFAULT_MODEL_ID),
+        'voice_settings': data.get('voice_settings'),
+        'language': data.get('language', 'en'),
+        'api_key': current_app.config['ELEVENLABS_API_KEY'],
+        'api_base': current_app.config['ELEVENLABS_API_BASE'],
+        'cache_folder': current_app.config['CACHE_FOLDER'],
+        'output_folder': current_app.config['OUTPUT_FOLDER']
+    }
+
 @voice_subtitles_bp.route('/generate-voice', methods=['POST'])
 def generate_voice():
     """
@@ -34,6 +187,9 @@ def generate_voice():
     - voice_id: ID голоса (опционально, по умолчанию используется Rachel)
     - language: язык (en, ru, etc.)
     - model_id: модель ElevenLabs (по умолчанию eleven_multilingual_v2)
+    - voice_settings: настройки голоса (опционально)
+    
+    Повторная озвучка того же текста тем же голосом берётся из кэша
     """
     try:
         data = request.get_json()
@@ -41,66 +197,80 @@ def generate_voice():
         if not data or 'text' not in data:
             return jsonify({'error': 'Text is required'}), 400
         
-        text = data['text']
-        voice_id = data.get('voice_id', '21m00Tcm4TlvDq8ikWAM')  # Rachel voice
-        language = data.get('language', 'en')
-        model_id = data.get('model_id', 'eleven_multilingual_v2')
+        logger.info(f"Generating voice for text: {data['text'][:50]}...")
         
-        # ElevenLabs API endpoint
-        api_key = current_app.config['ELEVENLABS_API_KEY']
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        result = _voice_item(data, _voice_defaults(data), f'voice_{timestamp}.mp3')
         
-        headers = {
-            "Accept": "audio/mpeg",
-            "Content-Type": "application/json",
-            "xi-api-key": api_key
-        }
+        logger.info(f"Voice generated successfully: {result['filename']}")
+        return jsonify(result)
+    
+    except TTSError as e:
+        logger.error(f"ElevenLabs API error: {e.status_code} - {e.details}")
+        return jsonify({
+            'error': str(e),
+            'details': e.details
+        }), e.status_code
+    
+    except Exception as e:
+        logger.error(f"Error generating voice: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@voice_subtitles_bp.route('/generate-voice-batch', methods=['POST'])
+def generate_voice_batch():
+    """
+    Пакетная озвучка с ограниченной параллельностью
+    
+    Ожидаемые поля:
+    - items: [{"text": "...", "voice_id": "...", ...}] или texts: ["...", ...]
+    - voice_id, model_id, voice_settings, language: значения по умолчанию для items
+    - max_concurrency: параллельность (не больше лимита API)
+    """
+    try:
+        data = request.get_json()
         
-        payload = {
-            "text": text,
-            "model_id": model_id,
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.75,
-                "style": 0.0,
-                "use_speaker_boost": True
-            }
-        }
+        if not data:
+            return jsonify({'error': 'items or texts are required'}), 400
         
-        logger.info(f"Generating voice for text: {text[:50]}...")
+        items = data.get('items') or [{'text': t} for t in data.get('texts', [])]
+        items = [item for item in items if isinstance(item, dict) and item.get('text')]
         
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
+        if not items:
+            return jsonify({'error': 'items or texts are required'}), 400
+        if len(items) > MAX_BATCH_ITEMS:
+            return jsonify({'error': f'Max {MAX_BATCH_ITEMS} items per batch'}), 400
         
-        if response.status_code == 200:
-            # Сохранение аудио файла
-            output_folder = current_app.config['OUTPUT_FOLDER']
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            audio_filename = f'voice_{timestamp}.mp3'
-            audio_path = os.path.join(output_folder, audio_filename)
-            
-            with open(audio_path, 'wb') as f:
-                f.write(response.content)
-            
-            logger.info(f"Voice generated successfully: {audio_filename}")
-            
-            return jsonify({
-                'success': True,
-                'filename': audio_filename,
-                'path': audio_path,
-                'url': f'/api/voice-subtitles/download/{audio_filename}',
-                'text_length': len(text),
-                'voice_id': voice_id,
-                'language': language
-            })
-        else:
-            logger.error(f"ElevenLabs API error: {response.status_code} - {response.text}")
-            return jsonify({
-                'error': f'ElevenLabs API error: {response.status_code}',
-                'details': response.text
-            }), response.status_code
+        max_concurrency = max(1, min(int(data.get('max_concurrency', MAX_CONCURRENT_REQUESTS)),
+                                     MAX_CONCURRENT_REQUESTS))
+        defaults = _voice_defaults(data)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        
+        def run(indexed):
+            index, item = indexed
+            try:
+                return _voice_item(item, defaults, f'voice_{timestamp}_{index + 1:03d}.mp3')
+            except TTSError as e:
+                return {'success': False, 'error': str(e), 'details': e.details}
+            except Exception as e:
+                return {'success': False, 'error': str(e)}
+        
+        logger.info(f"Voicing batch of {len(items)} texts (concurrency {max_concurrency})")
+        
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            results = list(executor.map(run, enumerate(items)))
+        
+        successful = sum(1 for r in results if r['success'])
+        
+        return jsonify({
+            'success': successful > 0,
+            'total': len(results),
+            'successful': successful,
+            'failed': len(results) - successful,
+            'results': results
+        })
     
     except Exception as e:
-        logger.error(f"Error generating voice: {e}")
+        logger.error(f"Error generating voice batch: {e}")
         return jsonify({'error': str(e)}), 500
 
 @voice_subtitles_bp.route('/generate-subtitles', methods=['POST'])
@@ -135,57 +305,31 @@ def generate_subtitles():
         
         logger.info(f"Generating subtitles for: {audio_filename}")
         
-        # Использование Whisper (через whisper-cli или whisper.cpp)
-        # Альтернатива: можно использовать OpenAI Whisper API или Deepgram
+        output_folder = current_app.config['OUTPUT_FOLDER']
+        transcript, cached = get_transcript(
+            audio_path, language, current_app.config['CACHE_FOLDER']
+        )
         
-        try:
-            # Попытка использовать whisper CLI (если установлен)
-            output_folder = current_app.config['OUTPUT_FOLDER']
-            subtitle_base = os.path.join(output_folder, f'subtitles_{timestamp}')
-            
-            whisper_cmd = [
-                'whisper', audio_path,
-                '--model', 'base',
-                '--output_format', subtitle_format,
-                '--output_dir', output_folder
-            ]
-            
-            if language != 'auto':
-                whisper_cmd.extend(['--language', language])
-            
-            result = subprocess.run(
-                whisper_cmd,
-                capture_output=True,
-                text=True,
-                timeout=300
-            )
-            
-            if result.returncode == 0:
-                # Найти сгенерированный файл субтитров
-                subtitle_filename = f'{os.path.splitext(audio_filename)[0]}.{subtitle_format}'
-                subtitle_path = os.path.join(output_folder, subtitle_filename)
-                
-                if os.path.exists(subtitle_path):
-                    with open(subtitle_path, 'r', encoding='utf-8') as f:
-                        subtitle_content = f.read()
-                    
-                    logger.info(f"Subtitles generated successfully: {subtitle_filename}")
-                    
-                    return jsonify({
-                        'success': True,
-                        'filename': subtitle_filename,
-                        'path': subtitle_path,
-                        'url': f'/api/voice-subtitles/download/{subtitle_filename}',
-                        'format': subtitle_format,
-                        'content': subtitle_content,
-                        'method': 'whisper-local'
-                    })
+        if transcript:
+            subtitle_content = render_transcript(transcript, subtitle_format)
+            subtitle_filename = f'{os.path.splitext(audio_filename)[0]}.{subtitle_format}'
+            subtitle_path = os.path.join(output_folder, subtitle_filename)
+            with open(subtitle_path, 'w', encoding='utf-8') as f:
+                f.write(subtitle_content)
             
-            # Если Whisper не сработал, пробуем альтернативный метод
-            logger.warning("Whisper CLI not available, trying alternative method...")
+            logger.info(f"Subtitles generated successfully: {subtitle_filename}")
             
-        except Exception as whisper_error:
-            logger.warning(f"Whisper error: {whisper_error}")
+            return jsonify({
+                'success': True,
+                'filename': subtitle_filename,
+                'path': subtitle_path,
+                'url': f'/api/voice-subtitles/download/{subtitle_filename}',
+                'format': subtitle_format,
+                'content': subtitle_content,
+                'language': transcript.get('language'),
+                'method': transcript.get('method', 'whisper-local'),
+                'cached': cached
+            })
         
         # Альтернативный метод: использование ffmpeg для извлечения текста (если есть встроенные субтитры)
         # Или возврат ошибки с рекомендацией установить Whisper
@@ -204,46 +348,56 @@ def generate_subtitles():
         logger.error(f"Error generating subtitles: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _fetch_voices(api_key, api_base):
+    """Загрузить и отформатировать список голосов ElevenLabs"""
+    url = f"{api_base}/voices"
+    
+    headers = {
+        "Accept": "application/json",
+        "xi-api-key": api_key
+    }
+    
+    response = get_session().get(url, headers=headers, timeout=10)
+    
+    if response.status_code != 200:
+        raise CatalogError(response.status_code, f'ElevenLabs API error: {response.status_code}')
+    
+    voices_data = response.json()
+    
+    # Форматирование списка голосов
+    voices = []
+    for voice in voices_data.get('voices', []):
+        voices.append({
+            'voice_id': voice.get('voice_id'),
+            'name': voice.get('name'),
+            'category': voice.get('category'),
+            'labels': voice.get('labels', {}),
+            'preview_url': voice.get('preview_url')
+        })
+    
+    return {
+        'success': True,
+        'voices': voices,
+        'count': len(voices)
+    }
+
 @voice_subtitles_bp.route('/list-voices', methods=['GET'])
 def list_voices():
     """
-    Получить список доступных голосов из ElevenLabs
+    Получить список доступных голосов из ElevenLabs (TTL-кэш, ETag)
     """
     try:
         api_key = current_app.config['ELEVENLABS_API_KEY']
-        url = "https://api.elevenlabs.io/v1/voices"
-        
-        headers = {
-            "Accept": "application/json",
-            "xi-api-key": api_key
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            voices_data = response.json()
-            
-            # Форматирование списка голосов
-            voices = []
-            for voice in voices_data.get('voices', []):
-                voices.append({
-                    'voice_id': voice.get('voice_id'),
-                    'name': voice.get('name'),
-                    'category': voice.get('category'),
-                    'labels': voice.get('labels', {}),
-                    'preview_url': voice.get('preview_url')
-                })
-            
-            return jsonify({
-                'success': True,
-                'voices': voices,
-                'count': len(voices)
-            })
-        else:
-            logger.error(f"ElevenLabs API error: {response.status_code}")
-            return jsonify({
-                'error': f'ElevenLabs API error: {response.status_code}'
-            }), response.status_code
+        api_base = current_app.config['ELEVENLABS_API_BASE']
+        entry = catalog_cache.get(
+            f'elevenlabs_voices_{params_key(api_base, api_key)}',
+            lambda: _fetch_voices(api_key, api_base)
+        )
+        return catalog_response(entry)
+    
+    except CatalogError as e:
+        logger.error(str(e))
+        return jsonify({'error': str(e)}), e.status_code
     
     except Exception as e:
         logger.error(f"Error listing voices: {e}")
@@ -13,14 +13,37 @@ Legacy (для обратной совместимости):
 - Montage V2
 """
 
+import os
+
+
+def is_serving_process():
+    """
+    Процесс, который обслуживает запросы: фоновые службы запускаются только в нём
+    - __mp_main__ - дочерний процесс multiprocessing (spawn, воркеры Whisper)
+      заново импортирует главный модуль
+    - python app.py с debug: родитель только следит за файлами (reloader),
+      запросы обслуживает дочерний процесс с WERKZEUG_RUN_MAIN=true
+    - gunicorn и прочие импортируют модуль как app
+    """
+    if __name__ == '__mp_main__':
+        return False
+    if __name__ == '__main__':
+        return os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    return True
+
+
+# Запускатель ffmpeg стартует первым, пока процесс ещё маленький
+from utils.spawn_server import start_spawn_server
+if is_serving_process():
+    start_spawn_server()
+
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
-import os
 import logging
 from datetime import datetime
 
 # Импорт новых подмодулей
-from api.montage_pro import montage_pro_bp
+from api.montage_pro import montage_pro_bp, MAX_FILE_AGE_DAYS
 from api.uniquifier_api import uniquifier_bp
 
 # Импорт legacy подмодулей (для обратной совместимости)
@@ -29,6 +52,8 @@ from api.montage_v2 import montage_v2_bp
 from api.voice_subtitles import voice_subtitles_bp
 from api.avatar import avatar_bp
 
+from utils.storage_index import get_storage_index, start_storage_sweeper
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -44,20 +69,34 @@ CORS(app)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500 MB max file size
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
 app.config['OUTPUT_FOLDER'] = os.path.join(os.path.dirname(__file__), 'outputs')
+app.config['CACHE_FOLDER'] = os.path.join(os.path.dirname(__file__), 'cache')
 
 # API Keys (из environment variables для безопасности)
 app.config['ELEVENLABS_API_KEY'] = os.getenv(
     'ELEVENLABS_API_KEY',
     'sk_9537f51db5a1bbf57f6ef774e4fe1c23de43617d0123a177'
 )
+app.config['ELEVENLABS_API_BASE'] = os.getenv(
+    'ELEVENLABS_API_BASE', 'https://api.elevenlabs.io/v1'
+)
 app.config['HEYGEN_API_KEY'] = os.getenv(
     'HEYGEN_API_KEY',
     'sk_V2_hgu_kqlUGXHp4ZH_9KpXEW7bSJtfoy4tXvhvcgm1no0xFPtN'
 )
+app.config['HEYGEN_API_BASE'] = os.getenv('HEYGEN_API_BASE', 'https://api.heygen.com/v2')
 
 # Создание необходимых директорий
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+os.makedirs(app.config['CACHE_FOLDER'], exist_ok=True)
+
+# Фоновая очистка outputs и учёт места (вместо обхода папки в каждом запросе)
+if is_serving_process():
+    start_storage_sweeper(
+        get_storage_index(app.config['OUTPUT_FOLDER'], app.config['CACHE_FOLDER']),
+        MAX_FILE_AGE_DAYS,
+        content_cache=app.config['CACHE_FOLDER']
+    )
 
 # Регистрация новых blueprints (Video Editor Pro)
 app.register_blueprint(montage_pro_bp, url_prefix='/api/video-editor')
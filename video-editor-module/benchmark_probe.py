@@ -0,0 +1,122 @@
+"""
+Бенчмарк бэкендов получения метаданных (PyAV vs ffprobe)
+
+Использование:
+    python benchmark_probe.py /path/to/folder [--limit 1000] [--ballast-mb 0]
+                              [--ffprobe-mode both]
+
+--ballast-mb раздувает память процесса перед замером, чтобы увидеть,
+как стоимость fork для ffprobe растёт с размером веб-воркера
+--ffprobe-mode: direct - subprocess.run из этого процесса (fork раздутого процесса),
+spawn - через запускатель utils.spawn_server (fork маленького процесса), both - оба
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from functools import partial
+
+from utils.media_probe import probe_pyav, probe_ffprobe, PYAV_AVAILABLE
+from utils.spawn_server import start_spawn_server
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.mp3', '.m4a', '.wav')
+
+
+def collect_files(folder, limit):
+    files = []
+    for root, _, names in os.walk(folder):
+        for name in sorted(names):
+            if name.lower().endswith(VIDEO_EXTENSIONS):
+                files.append(os.path.join(root, name))
+                if len(files) >= limit:
+                    return files
+    return files
+
+
+def run_backend(name, func, files):
+    timings = []
+    errors = 0
+    results = {}
+    started = time.perf_counter()
+    for path in files:
+        t0 = time.perf_counter()
+        try:
+            results[path] = func(path)
+        except Exception:
+            errors += 1
+        timings.append(time.perf_counter() - t0)
+    total = time.perf_counter() - started
+
+    timings.sort()
+    print(f"\n{name}")
+    print(f"  files:   {len(files)} ({errors} errors)")
+    print(f"  total:   {total:.2f}s")
+    print(f"  mean:    {statistics.mean(timings) * 1000:.2f} ms")
+    print(f"  median:  {statistics.median(timings) * 1000:.2f} ms")
+    print(f"  p95:     {timings[int(len(timings) * 0.95) - 1] * 1000:.2f} ms")
+    return results
+
+
+def compare(pyav_results, ffprobe_results):
+    """Расхождения между бэкендами (длительность > 0.1с, размеры, наличие аудио)"""
+    mismatches = 0
+    for path, a in pyav_results.items():
+        b = ffprobe_results.get(path)
+        if not b:
+            continue
+        if (abs(a['duration'] - b['duration']) > 0.1 or a['width'] != b['width']
+                or a['height'] != b['height'] or a['has_audio'] != b['has_audio']):
+            mismatches += 1
+            print(f"  mismatch: {os.path.basename(path)}: pyav={a} ffprobe={b}")
+    print(f"\nMismatches: {mismatches}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyAV vs ffprobe probe benchmark')
+    parser.add_argument('folder')
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--ballast-mb', type=int, default=0)
+    parser.add_argument('--ffprobe-mode', choices=('direct', 'spawn', 'both'), default='both')
+    args = parser.parse_args()
+
+    files = collect_files(args.folder, args.limit)
+    if not files:
+        print(f"No media files in {args.folder}")
+        return 1
+
+    # Запускатель стартует до балласта - как в app.py, до загрузки тяжёлых модулей
+    spawn_ready = args.ffprobe_mode != 'direct' and start_spawn_server()
+    if args.ffprobe_mode != 'direct' and not spawn_ready:
+        print("Spawn server not available - ffprobe (spawn) would fall back to direct, skipping")
+
+    ballast = bytearray(args.ballast_mb * 1024 * 1024) if args.ballast_mb else None
+    if ballast:
+        # Касаемся каждой страницы, чтобы память была реально выделена
+        for i in range(0, len(ballast), 4096):
+            ballast[i] = 1
+        print(f"Process ballast: {args.ballast_mb} MB")
+
+    print(f"Benchmarking {len(files)} files from {args.folder}")
+
+    ffprobe_results = None
+    if args.ffprobe_mode in ('direct', 'both'):
+        ffprobe_results = run_backend('ffprobe (direct subprocess)',
+                                      partial(probe_ffprobe, runner=subprocess.run), files)
+    if spawn_ready:
+        spawn_results = run_backend('ffprobe (spawn server)', probe_ffprobe, files)
+        ffprobe_results = ffprobe_results or spawn_results
+    if ffprobe_results is None:
+        return 1
+    if not PYAV_AVAILABLE:
+        print("\nPyAV not installed (pip install av) - skipping in-process backend")
+        return 0
+    pyav_results = run_backend('PyAV (in-process)', probe_pyav, files)
+    compare(pyav_results, ffprobe_results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Поллер задач HeyGen против локальной заглушки API"""
+
+import json
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from utils import avatar_jobs
+from utils.avatar_jobs import AvatarJobPoller
+
+
+class FakeHeyGen(BaseHTTPRequestHandler):
+    """GET /video/<id>: код и статус из responses[id]; GET /file/<id> - содержимое видео"""
+    responses = {}
+    checks = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        kind, video_id = self.path.strip('/').split('/')
+        if kind == 'file':
+            self._send(200, f'video {video_id}'.encode())
+            return
+        type(self).checks.append(video_id)
+        code, status = self.responses.get(video_id, (404, None))
+        data = {'data': {'status': status,
+                         'video_url': f'{self.base}/file/{video_id}' if status == 'completed' else None}}
+        self._send(code, json.dumps(data).encode())
+
+    def _send(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def poller(http_server, tmp_path):
+    handler = type('Handler', (FakeHeyGen,), {'responses': {}, 'checks': []})
+    base = http_server(handler)
+    handler.base = base
+    (tmp_path / 'out').mkdir()
+    poller = AvatarJobPoller(base, 'key', str(tmp_path / 'out'), str(tmp_path / 'cache'))
+    poller.start = lambda: None
+    return poller, handler
+
+
+def test_unknown_ids_are_not_polled(poller):
+    poller, handler = poller
+    assert poller.poll_once('foreign') is None
+    assert handler.checks == []
+
+
+def test_completed_video_is_downloaded_once(poller):
+    poller, handler = poller
+    handler.responses['v1'] = (200, 'completed')
+    poller.register('v1')
+    job = poller.poll_once('v1')
+    assert job['status'] == 'completed'
+    assert open(job['path']).read() == 'video v1'
+    assert poller.download('v1')['downloaded_at'] == job['downloaded_at']
+
+
+def test_client_error_is_terminal(poller):
+    poller, handler = poller
+    handler.responses['v1'] = (404, None)
+    poller.register('v1')
+    job = poller.poll_once('v1')
+    assert job['status'] == 'failed' and '404' in job['error']
+    assert 'v1' not in poller._due_jobs()
+
+
+def test_rate_limit_is_retried(poller):
+    poller, handler = poller
+    handler.responses['v1'] = (429, None)
+    poller.register('v1')
+    job = poller.poll_once('v1')
+    assert job['status'] == 'processing' and job['next_check'] > time.time()
+
+
+def test_polling_gives_up_after_max_attempts(poller, monkeypatch):
+    poller, handler = poller
+    monkeypatch.setattr(avatar_jobs, 'MAX_POLL_ATTEMPTS', 3)
+    handler.responses['v1'] = (200, 'processing')
+    poller.register('v1')
+    statuses = [poller.poll_once('v1')['status'] for _ in range(3)]
+    assert statuses == ['processing', 'processing', 'failed']
+
+
+def test_index_survives_restart_and_prunes_finished(poller, tmp_path):
+    poller, handler = poller
+    handler.responses['done'] = (404, None)
+    poller.register('done')
+    poller.register('running')
+    poller.poll_once('done')
+
+    reloaded = AvatarJobPoller(poller.api_base, 'key', poller.output_folder, poller.cache_folder)
+    assert reloaded.get('done')['status'] == 'failed'
+    assert reloaded.prune(ttl=3600) == 0
+    assert reloaded.prune(ttl=-1) == 1
+    assert reloaded.get('done') is None and reloaded.get('running')
+
+    again = AvatarJobPoller(poller.api_base, 'key', poller.output_folder, poller.cache_folder)
+    assert sorted(again._jobs) == ['running']
+
+
+def test_other_process_sees_job_row(poller):
+    poller, handler = poller
+    handler.responses['v1'] = (200, 'processing')
+    other = AvatarJobPoller(poller.api_base, 'key', poller.output_folder, poller.cache_folder)
+    other.start = lambda: None
+    other.register('v1')
+    assert poller.get('v1')['status'] == 'processing'
+    assert 'v1' not in poller._jobs
+
+
+def test_unknown_id_is_checked_once_and_tracked(poller):
+    poller, handler = poller
+    handler.responses['legacy'] = (200, 'completed')
+    job = poller.track('legacy')
+    assert job['status'] == 'completed' and open(job['path']).read() == 'video legacy'
+    assert poller.track('legacy')['path'] == job['path']
+    assert handler.checks == ['legacy']
+    assert poller.track('missing') is None
@@ -0,0 +1,74 @@
+"""Допуск по месту: резервы общие для всех экземпляров с одной базой (процессы, машины)"""
+
+import time
+import threading
+import subprocess
+
+import pytest
+
+from utils import disk_budget
+from utils.disk_budget import DiskBudget, DiskBudgetExceeded, copy_estimate, encode_estimate
+
+GB = 1024 ** 3
+
+
+@pytest.fixture
+def budgets(tmp_path, monkeypatch):
+    """Два бюджета одного диска (100 ГБ, занято 50, порог 90%) на общей базе"""
+    monkeypatch.setattr(DiskBudget, '_disk', lambda self: (100 * GB, 50 * GB))
+    monkeypatch.setattr(disk_budget, 'RECHECK_INTERVAL', 0.05)
+    db_path = str(tmp_path / 'shared' / 'job_queue.db')
+    return DiskBudget('/outputs', db_path), DiskBudget('/outputs', db_path)
+
+
+def test_estimates():
+    assert copy_estimate(size=1000) == 1100
+    assert copy_estimate(duration=8, bitrate=1000) == 1100
+    assert encode_estimate(8, video_bitrate=900, audio_bitrate=100) == 1100
+
+
+def test_reservations_are_shared(budgets):
+    first, second = budgets
+    reservation = first.admit('a', 30 * GB)
+    assert second.status()['reservations'] == 1
+    with pytest.raises(DiskBudgetExceeded, match='reserved by running jobs'):
+        second.admit('b', 20 * GB, timeout=0)
+
+    reservation.written(15 * GB)
+    assert second.status()['reserved_gb'] == 15
+    second.admit('b', 20 * GB, timeout=0).release()
+    reservation.release()
+    assert first.status()['reservations'] == 0
+
+
+def test_never_fitting_job_is_rejected_at_once(budgets):
+    first, _ = budgets
+    with pytest.raises(DiskBudgetExceeded, match='watermark'):
+        first.admit('huge', 50 * GB)
+
+
+def test_waiting_job_is_admitted_after_release_elsewhere(budgets):
+    first, second = budgets
+    reservation = first.admit('a', 35 * GB)
+    waited = []
+    threading.Timer(0.2, reservation.release).start()
+    started = time.time()
+    second.admit('b', 35 * GB, timeout=5, on_wait=lambda: waited.append(True)).release()
+    assert waited == [True] and time.time() - started < 2
+
+
+def test_reservations_of_dead_processes_are_dropped(budgets, monkeypatch):
+    first, second = budgets
+    first.admit('crashed', 35 * GB)
+    finished = subprocess.Popen(['true'])
+    finished.wait()
+    first._connect().execute('UPDATE disk_reservations SET pid = ?', (finished.pid,))
+    second.admit('b', 35 * GB, timeout=0).release()
+
+    # Резерв другой машины снимается только по TTL
+    first.admit('remote', 35 * GB)
+    first._connect().execute("UPDATE disk_reservations SET host = 'other-host'")
+    with pytest.raises(DiskBudgetExceeded):
+        second.admit('c', 35 * GB, timeout=0)
+    monkeypatch.setattr(disk_budget, 'RESERVATION_TTL', -1)
+    second.admit('c', 35 * GB, timeout=0).release()
@@ -0,0 +1,101 @@
+"""Очередь задач на временной базе SQLite (несколько экземпляров - как разные машины)"""
+
+import time
+import threading
+
+import pytest
+
+from utils.job_queue import JobQueue
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'queue' / 'job_queue.db')
+
+
+def test_claim_respects_capabilities_and_order(db_path):
+    queue = JobQueue(db_path)
+    queue.enqueue('a', 'cut', {'n': 1})
+    queue.enqueue('b', 'pipeline', {}, requires=['pipeline', 'montage'])
+    queue.enqueue('c', 'cut', {'n': 3})
+
+    claimed = queue.claim('w1', {'cut'}, limit=5)
+    assert [job['id'] for job in claimed] == ['a', 'c']
+    assert claimed[0]['payload'] == {'n': 1} and claimed[0]['attempts'] == 1
+    assert queue.claim('w1', {'cut'}) == []
+    assert [job['id'] for job in queue.claim('w2', {'pipeline', 'montage', 'cut'})] == ['b']
+
+
+def test_concurrent_claims_take_each_job_once(db_path):
+    JobQueue(db_path)
+    for i in range(40):
+        JobQueue(db_path).enqueue(f'job{i:02d}', 'cut', {})
+
+    taken = []
+    lock = threading.Lock()
+
+    def worker(name):
+        queue = JobQueue(db_path)
+        while True:
+            jobs = queue.claim(name, {'cut'}, limit=3)
+            if not jobs:
+                return
+            with lock:
+                taken.extend(job['id'] for job in jobs)
+
+    threads = [threading.Thread(target=worker, args=(f'w{i}',)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(taken) == [f'job{i:02d}' for i in range(40)]
+
+
+def test_state_cancel_and_finish(db_path):
+    queue = JobQueue(db_path)
+    queue.enqueue('queued', 'cut', {})
+    queue.enqueue('running', 'cut', {})
+    queue.claim('w1', {'cut'})  # забирает 'queued' (создана раньше)
+    queue.claim('w1', {'cut'})
+
+    assert queue.update_state('queued', {'progress': 50}) is False
+    assert queue.cancel('running')['cancel_requested'] is True
+    assert queue.update_state('running', {'progress': 10}) is True
+
+    queue.finish('queued', 'completed', {'progress': 100})
+    assert queue.get('queued')['state'] == {'progress': 100}
+    with pytest.raises(ValueError):
+        queue.finish('running', 'processing')
+
+    queue.enqueue('later', 'cut', {})
+    assert queue.cancel('later')['status'] == 'cancelled'
+    assert queue.counts() == {'completed': 1, 'running': 1, 'cancelled': 1}
+
+
+def test_jobs_of_dead_workers_are_requeued_from_initial_state(db_path):
+    queue = JobQueue(db_path)
+    queue.register_worker('dead', {'cut'}, 1)
+    queue.register_worker('alive', {'cut'}, 1)
+    queue.enqueue('j', 'cut', {}, state={'message': 'start'}, max_attempts=2)
+    queue.claim('dead', {'cut'})
+    queue.update_state('j', {'message': 'half done'})
+
+    time.sleep(0.05)
+    queue.heartbeat('alive', 0)
+    assert queue.requeue_dead(timeout=0.02) == 1
+    assert [w['id'] for w in queue.list_workers()] == ['alive']
+    assert queue.heartbeat('dead', 1) is False
+
+    job = queue.claim('alive', {'cut'})[0]
+    assert job['attempts'] == 2 and job['state'] == {'message': 'start'}
+
+    # Второй воркер тоже пропал - попытки исчерпаны
+    queue.unregister_worker('alive')
+    assert queue.requeue_dead() == 1
+    assert queue.get('j')['status'] == 'error'
+
+
+def test_queue_survives_reopen(db_path):
+    JobQueue(db_path).enqueue('j', 'sound', {'file': 'a.mp3'})
+    job = JobQueue(db_path).claim('w', {'sound'})[0]
+    assert job['payload'] == {'file': 'a.mp3'} and job['status'] == 'running'
@@ -0,0 +1,132 @@
+"""Клиент TTS против локальной заглушки ElevenLabs API"""
+
+import json
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from utils import tts_client
+from utils.tts_client import split_text, synthesize, TTSError
+
+
+class FakeElevenLabs(BaseHTTPRequestHandler):
+    """POST /text-to-speech/<voice>: отвечает кодами из statuses, затем 200 с текстом как mp3"""
+    statuses = []
+    delay = 0.0
+    requests = []
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        cls = type(self)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with cls.lock:
+            cls.requests.append(body['text'])
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            status = cls.statuses.pop(0) if cls.statuses else 200
+        try:
+            time.sleep(cls.delay)
+            data = body['text'].encode('utf-8') if status == 200 else b'{"detail": "error"}'
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+
+@pytest.fixture
+def api(http_server):
+    handler = type('Handler', (FakeElevenLabs,), {
+        'statuses': [], 'delay': 0.0, 'requests': [],
+        'in_flight': 0, 'max_in_flight': 0, 'lock': threading.Lock()
+    })
+    return handler, http_server(handler)
+
+
+def _synth(text, base, cache):
+    return synthesize(text, 'key', str(cache), api_base=base)
+
+
+def test_split_text_keeps_sentences_under_limit():
+    text = 'Первое предложение. Второе предложение! Третье? ' * 20
+    chunks = split_text(text, max_chars=100)
+    assert all(len(c) <= 100 for c in chunks)
+    assert all(c.endswith(('.', '!', '?')) for c in chunks)
+    assert ' '.join(chunks) == text.strip()
+
+
+def test_split_text_cuts_long_sentence_by_words():
+    chunks = split_text('слово ' * 50, max_chars=40)
+    assert all(len(c) <= 40 for c in chunks)
+    assert ' '.join(chunks).split() == ['слово'] * 50
+
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_retries_rate_limit_and_server_errors(api, tmp_path, status):
+    handler, base = api
+    handler.statuses = [status, status]
+    path, cached = _synth('hello', base, tmp_path)
+    assert not cached
+    assert open(path, 'rb').read() == b'hello'
+    assert handler.requests == ['hello'] * 3
+
+
+def test_client_error_is_not_retried(api, tmp_path):
+    handler, base = api
+    handler.statuses = [401]
+    with pytest.raises(TTSError) as error:
+        _synth('hello', base, tmp_path)
+    assert error.value.status_code == 401
+    assert len(handler.requests) == 1
+
+
+def test_cache_hit_skips_api(api, tmp_path):
+    handler, base = api
+    first, _ = _synth('same text', base, tmp_path)
+    second, cached = _synth('same text', base, tmp_path)
+    assert cached and first == second
+    assert len(handler.requests) == 1
+
+
+def test_concurrent_requests_are_capped(api, tmp_path):
+    handler, base = api
+    handler.delay = 0.2
+    texts = [f'text {i}' for i in range(tts_client.MAX_CONCURRENT_REQUESTS * 3)]
+    with ThreadPoolExecutor(max_workers=len(texts)) as executor:
+        list(executor.map(lambda t: _synth(t, base, tmp_path), texts))
+    assert len(handler.requests) == len(texts)
+    assert 1 < handler.max_in_flight <= tts_client.MAX_CONCURRENT_REQUESTS
+
+
+def test_long_text_is_voiced_in_parts_and_joined(api, tmp_path, monkeypatch):
+    handler, base = api
+    monkeypatch.setattr(tts_client, 'MAX_CHUNK_CHARS', 30)
+    monkeypatch.setattr(tts_client.split_text, '__defaults__', (30,))
+
+    def fake_concat(cmd, **kwargs):
+        parts = [line.split("'")[1] for line in open(cmd[cmd.index('-i') + 1])]
+        with open(cmd[-1], 'wb') as out:
+            out.write(b'|'.join(open(p, 'rb').read() for p in parts))
+        return subprocess.CompletedProcess(cmd, 0, '', '')
+
+    monkeypatch.setattr(tts_client, 'run_command', fake_concat)
+    text = 'First sentence here. Second sentence here. Third one.'
+    path, _ = _synth(text, base, tmp_path)
+    assert open(path, 'rb').read() == b'First sentence here.|Second sentence here.|Third one.'
+    assert sorted(handler.requests) == sorted(split_text(text, 30))
+
+    # Правка одного предложения переозвучивает только его
+    _synth('First sentence here. Second sentence here. Fourth one.', base, tmp_path)
+    assert handler.requests[-1] == 'Fourth one.'
+    assert len(handler.requests) == 4
@@ -0,0 +1,69 @@
+"""
+Кэш аватара с прозрачным фоном
+- Chroma key (colorkey) и масштабирование выполняются один раз
+- Результат хранится как ProRes 4444 с альфа-каналом
+- Ключ кэша: хэш аватара + параметры ключа/масштаба
+Все варианты монтажа и последующие проекты накладывают готовый файл
+"""
+
+import os
+import threading
+import logging
+
+from utils.spawn_server import run as run_command
+from utils.media_cache import file_content_hash, params_key, cache_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEY_COLOR = '0x00FF00'
+DEFAULT_SIMILARITY = 0.1
+DEFAULT_BLEND = 0.1
+
+# Блокировки по ключу кэша - параллельные запросы не кеят одно и то же дважды
+_key_locks = {}
+_key_locks_guard = threading.Lock()
+
+
+def _lock_for(key):
+    with _key_locks_guard:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def get_keyed_avatar(avatar_path, cache_folder, key_color=DEFAULT_KEY_COLOR,
+                     similarity=DEFAULT_SIMILARITY, blend=DEFAULT_BLEND, width=None):
+    """
+    Вернуть путь к аватару с вырезанным фоном (создаёт при первом обращении)
+    width - ширина наложения в пикселях (None - исходный размер)
+    """
+    width = int(width) if width else None
+    key = f"{file_content_hash(avatar_path)}_{params_key(key_color, similarity, blend, width)}"
+    keyed_path = cache_path(cache_folder, 'avatars', key, ext='mov')
+
+    with _lock_for(key):
+        if os.path.exists(keyed_path):
+            logger.info(f"Using cached keyed avatar: {os.path.basename(keyed_path)}")
+            return keyed_path
+
+        filters = [f'colorkey={key_color}:{similarity}:{blend}']
+        if width:
+            filters.append(f'scale={width}:-2')
+        filters.append('format=yuva444p10le')
+
+        tmp_path = keyed_path.replace('.mov', f'.{os.getpid()}.tmp.mov')
+        cmd = [
+            'ffmpeg', '-y', '-i', avatar_path,
+            '-vf', ','.join(filters),
+            '-an',
+            '-c:v', 'prores_ks', '-profile:v', '4444',
+            '-pix_fmt', 'yuva444p10le',
+            tmp_path
+        ]
+        result = run_command(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise RuntimeError(f"Avatar keying failed: {result.stderr[:300]}")
+
+        os.replace(tmp_path, keyed_path)
+        logger.info(f"Keyed avatar cached: {os.path.basename(keyed_path)}")
+        return keyed_path
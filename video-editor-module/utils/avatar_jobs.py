@@ -0,0 +1,351 @@
+"""
+Фоновый поллер задач HeyGen
+- Все незавершённые задачи проверяются одним проходом (параллельно, общая сессия)
+- Интервал проверки растёт с каждой попыткой (backoff)
+- Готовое видео скачивается ровно один раз (докачка через Range)
+- Локальный индекс по video_id (SQLite в кэше, одна строка на задачу):
+  статус, URL, путь к файлу; в индекс попадают только задачи,
+  созданные этим сервисом
+- 4xx от API (кроме 429) - задача завершается как failed; число проверок
+  ограничено MAX_POLL_ATTEMPTS
+- Завершённые задачи удаляются из индекса через FINISHED_TTL_SECONDS
+  (скачанный файл остаётся в outputs и убирается их очисткой)
+Эндпоинты status/download отвечают из индекса, не обращаясь к API
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from utils.media_cache import load_json, cache_path
+
+logger = logging.getLogger(__name__)
+
+POLL_TICK_SECONDS = 2
+BASE_INTERVAL_SECONDS = 5
+MAX_INTERVAL_SECONDS = 60
+MAX_PARALLEL_CHECKS = 8
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# ~3 часа при интервале MAX_INTERVAL_SECONDS
+MAX_POLL_ATTEMPTS = int(os.getenv('AVATAR_MAX_POLL_ATTEMPTS', '180'))
+FINISHED_TTL_SECONDS = int(os.getenv('AVATAR_JOB_TTL_HOURS', '72')) * 3600
+PRUNE_INTERVAL_SECONDS = 600
+INDEX_FILENAME = 'avatar_jobs.db'
+
+FINAL_STATUSES = {'completed', 'failed'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    video_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+class AvatarAPIError(RuntimeError):
+    def __init__(self, status_code):
+        super().__init__(f'HeyGen API error: {status_code}')
+        self.status_code = status_code
+
+    @property
+    def terminal(self):
+        """Ошибка клиента (нет задачи, нет доступа) - повторная проверка не поможет"""
+        return 400 <= self.status_code < 500 and self.status_code != 429
+
+
+class AvatarJobPoller:
+    """Индекс задач аватаров + фоновый поток проверки и скачивания"""
+
+    def __init__(self, api_base, api_key, output_folder, cache_folder):
+        self.api_base = api_base
+        self.api_key = api_key
+        self.output_folder = output_folder
+        self.cache_folder = cache_folder
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._download_locks = {}
+        self.db_path = os.path.join(os.path.abspath(cache_folder), INDEX_FILENAME)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+        self._jobs = self._load()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pruned_at = 0
+
+    # --- Индекс ---
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _load(self):
+        conn = self._connect()
+        jobs = {video_id: json.loads(data)
+                for video_id, data in conn.execute('SELECT video_id, data FROM jobs')}
+        legacy_path = cache_path(self.cache_folder, 'avatar_jobs', 'index')
+        if not jobs and os.path.exists(legacy_path):
+            # Индекс прежнего формата (один JSON на все задачи)
+            jobs = load_json(self.cache_folder, 'avatar_jobs', 'index') or {}
+            conn.executemany(
+                'INSERT OR REPLACE INTO jobs (video_id, data) VALUES (?, ?)',
+                [(video_id, json.dumps(job, ensure_ascii=False)) for video_id, job in jobs.items()]
+            )
+            os.remove(legacy_path)
+        return jobs
+
+    def _read(self, video_id):
+        """Строка задачи из SQLite (её мог записать другой процесс сервера)"""
+        row = self._connect().execute(
+            'SELECT data FROM jobs WHERE video_id = ?', (video_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _update(self, video_id, **fields):
+        """Обновить поля задачи; на диск пишется только её строка"""
+        stored = None if video_id in self._jobs else self._read(video_id)
+        with self._lock:
+            job = self._jobs.setdefault(video_id, stored or {'video_id': video_id})
+            job.update(fields)
+            if job.get('status') in FINAL_STATUSES and not job.get('finished_at'):
+                job['finished_at'] = time.time()
+            result = dict(job)
+        self._connect().execute(
+            'INSERT OR REPLACE INTO jobs (video_id, data) VALUES (?, ?)',
+            (video_id, json.dumps(result, ensure_ascii=False))
+        )
+        return result
+
+    def prune(self, ttl=FINISHED_TTL_SECONDS):
+        """Удалить из индекса задачи, завершённые раньше ttl секунд назад. Возвращает число"""
+        cutoff = time.time() - ttl
+        with self._lock:
+            expired = [
+                video_id for video_id, job in self._jobs.items()
+                if job.get('status') in FINAL_STATUSES
+                and (job.get('finished_at') or job.get('created_at', 0)) < cutoff
+            ]
+            for video_id in expired:
+                del self._jobs[video_id]
+                self._download_locks.pop(video_id, None)
+        self._connect().executemany('DELETE FROM jobs WHERE video_id = ?',
+                                    [(video_id,) for video_id in expired])
+        if expired:
+            logger.info(f"Pruned {len(expired)} finished avatar job(s)")
+        return len(expired)
+
+    def get(self, video_id):
+        """Задача из памяти процесса, иначе из SQLite (создана другим процессом)"""
+        with self._lock:
+            job = self._jobs.get(video_id)
+            if job:
+                return dict(job)
+        return self._read(video_id)
+
+    def track(self, video_id):
+        """
+        Задача из индекса; неизвестную - разово проверить в HeyGen и взять
+        на отслеживание (создана до индекса или в обход сервиса)
+        None - HeyGen такой задачи не знает
+        """
+        job = self.get(video_id)
+        if job:
+            return job
+        try:
+            data = self._fetch_status(video_id)
+        except AvatarAPIError as e:
+            if e.terminal:
+                return None
+            raise
+        self.register(video_id)
+        return self._apply_status(video_id, data, attempts=1)
+
+    def register(self, video_id):
+        """Добавить созданную сервисом задачу в индекс (идемпотентно) и разбудить поллер"""
+        if not self.get(video_id):
+            now = time.time()
+            self._update(
+                video_id, status='processing', video_url=None, error=None,
+                created_at=now, attempts=0, next_check=now,
+                filename=None, path=None
+            )
+        self.start()
+        self._wakeup.set()
+        return self.get(video_id)
+
+    # --- Поллинг ---
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _due_jobs(self):
+        now = time.time()
+        with self._lock:
+            return [
+                video_id for video_id, job in self._jobs.items()
+                if (job['status'] not in FINAL_STATUSES
+                    or (job['status'] == 'completed' and not job.get('path')))
+                and job.get('next_check', 0) <= now
+            ]
+
+    def _run(self):
+        logger.info("Avatar job poller started")
+        while True:
+            if time.time() - self._pruned_at >= PRUNE_INTERVAL_SECONDS:
+                self._pruned_at = time.time()
+                try:
+                    self.prune()
+                except Exception as e:
+                    logger.warning(f"Avatar job prune failed: {e}")
+            due = self._due_jobs()
+            if due:
+                with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_CHECKS, len(due))) as executor:
+                    list(executor.map(self.poll_once, due))
+            self._wakeup.wait(POLL_TICK_SECONDS)
+            self._wakeup.clear()
+
+    def _fetch_status(self, video_id):
+        response = self._session.get(
+            f"{self.api_base}/video/{video_id}",
+            headers={'X-Api-Key': self.api_key},
+            timeout=10
+        )
+        if response.status_code != 200:
+            raise AvatarAPIError(response.status_code)
+        return response.json().get('data', {})
+
+    def poll_once(self, video_id):
+        """Проверить статус задачи из индекса; готовое видео - скачать. None - задачи нет"""
+        job = self.get(video_id)
+        if not job:
+            return None
+        attempts = job.get('attempts', 0) + 1
+        backoff = min(MAX_INTERVAL_SECONDS, BASE_INTERVAL_SECONDS * 2 ** (attempts - 1))
+        give_up = attempts >= MAX_POLL_ATTEMPTS
+
+        try:
+            data = self._fetch_status(video_id)
+        except AvatarAPIError as e:
+            if e.terminal:
+                logger.error(f"HeyGen rejected status check for {video_id}: {e}")
+                return self._update(video_id, status='failed', error=str(e), attempts=attempts)
+            return self._retry_later(video_id, attempts, backoff, give_up, e)
+        except Exception as e:
+            return self._retry_later(video_id, attempts, backoff, give_up, e)
+        return self._apply_status(video_id, data, attempts)
+
+    def _apply_status(self, video_id, data, attempts):
+        """Записать ответ HeyGen; готовое видео - скачать"""
+        backoff = min(MAX_INTERVAL_SECONDS, BASE_INTERVAL_SECONDS * 2 ** (attempts - 1))
+        give_up = attempts >= MAX_POLL_ATTEMPTS
+        status = data.get('status', 'unknown')
+        job = self._update(
+            video_id,
+            status=status,
+            video_url=data.get('video_url'),
+            error=data.get('error') if status == 'failed' else None,
+            attempts=attempts,
+            last_checked=time.time(),
+            next_check=time.time() + backoff
+        )
+
+        if status == 'completed' and job['video_url'] and not job.get('path'):
+            try:
+                job = self.download(video_id)
+            except Exception as e:
+                # Ссылка могла истечь - следующая проверка получит новую
+                logger.warning(f"Avatar download failed for {video_id}: {e}")
+                if give_up:
+                    job = self._update(video_id, status='failed',
+                                       error=f'Download failed after {attempts} attempts: {e}')
+        elif status == 'failed':
+            logger.error(f"HeyGen video failed: {video_id}")
+        elif give_up:
+            job = self._give_up(video_id, attempts, f'still {status}')
+        return job
+
+    def _retry_later(self, video_id, attempts, backoff, give_up, error):
+        logger.warning(f"Avatar status check failed for {video_id}: {error}")
+        if give_up:
+            return self._give_up(video_id, attempts, error)
+        return self._update(video_id, attempts=attempts, next_check=time.time() + backoff)
+
+    def _give_up(self, video_id, attempts, reason):
+        logger.error(f"Avatar job {video_id} abandoned after {attempts} checks: {reason}")
+        return self._update(video_id, status='failed', attempts=attempts,
+                            error=f'Status polling gave up after {attempts} checks ({reason})')
+
+    # --- Скачивание ---
+
+    def _download_lock(self, video_id):
+        with self._lock:
+            return self._download_locks.setdefault(video_id, threading.Lock())
+
+    def download(self, video_id):
+        """Скачать готовое видео один раз (с докачкой .part файла)"""
+        with self._download_lock(video_id):
+            job = self.get(video_id)
+            if job.get('path') and os.path.exists(job['path']):
+                return job
+            if not job.get('video_url'):
+                raise RuntimeError('Video URL not available')
+
+            video_filename = f'avatar_{video_id}.mp4'
+            video_path = os.path.join(self.output_folder, video_filename)
+            part_path = f'{video_path}.part'
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            with self._session.get(job['video_url'], headers=headers,
+                                   stream=True, timeout=60) as response:
+                if response.status_code == 416:
+                    # Файл уже полностью скачан
+                    pass
+                elif response.status_code in (200, 206):
+                    # 200 на Range - сервер не поддерживает докачку, пишем заново
+                    mode = 'ab' if response.status_code == 206 else 'wb'
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                else:
+                    raise RuntimeError(f'Download failed: {response.status_code}')
+
+            os.replace(part_path, video_path)
+            logger.info(f"Avatar video downloaded: {video_filename}")
+            return self._update(
+                video_id, status='completed', filename=video_filename, path=video_path,
+                size=os.path.getsize(video_path), downloaded_at=time.time()
+            )
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_avatar_poller(config):
+    """Общий поллер процесса (конфигурация берётся из app.config)"""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = AvatarJobPoller(
+                config['HEYGEN_API_BASE'],
+                config['HEYGEN_API_KEY'],
+                config['OUTPUT_FOLDER'],
+                config['CACHE_FOLDER']
+            )
+            _poller.start()
+        return _poller
@@ -0,0 +1,128 @@
+"""
+TTL-кэш каталогов внешних API (голоса, аватары)
+- Свежая запись отдаётся из памяти без обращения к API
+- Устаревшая запись отдаётся сразу, обновление идёт в фоне (stale-while-revalidate)
+- При ошибке API отдаётся последняя удачная версия (stale-if-error)
+- ETag от содержимого: фронтенд получает 304 без тела, если каталог не менялся
+"""
+
+import time
+import json
+import hashlib
+import logging
+import threading
+
+from flask import Response, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300          # 5 минут - запись свежая
+DEFAULT_STALE_TTL = 86400  # сутки - можно отдавать устаревшую, обновляя в фоне
+
+
+class CatalogError(Exception):
+    """Ошибка API каталога (status_code - HTTP код ответа API)"""
+
+    def __init__(self, status_code, message=None):
+        super().__init__(message or f'API error: {status_code}')
+        self.status_code = status_code
+
+
+def _etag_for(data):
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class CatalogCache:
+    """Потокобезопасный TTL-кэш с фоновым обновлением"""
+
+    def __init__(self, ttl=DEFAULT_TTL, stale_ttl=DEFAULT_STALE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _store(self, key, data):
+        entry = {'data': data, 'etag': _etag_for(data), 'fetched_at': time.time()}
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def _refresh_in_background(self, key, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._store(key, fetch())
+                logger.info(f"Catalog refreshed: {key}")
+            except Exception as e:
+                logger.warning(f"Background catalog refresh failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get(self, key, fetch):
+        """
+        Вернуть запись каталога {'data', 'etag', 'fetched_at'}
+        fetch() - функция загрузки (без контекста Flask, может выполняться в фоне)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        age = time.time() - entry['fetched_at'] if entry else None
+
+        if entry and age < self.ttl:
+            return entry
+
+        if entry and age < self.stale_ttl:
+            self._refresh_in_background(key, fetch)
+            return entry
+
+        # Нет записи (или слишком старая) - загрузка синхронно, один запрос на ключ
+        with self._key_lock(key):
+            with self._lock:
+                current = self._entries.get(key)
+            if current and current is not entry:
+                return current
+            try:
+                return self._store(key, fetch())
+            except Exception:
+                if entry:
+                    logger.warning(f"Catalog API failed, serving stale {key}")
+                    return entry
+                raise
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+catalog_cache = CatalogCache()
+
+
+def catalog_response(entry, max_age=60):
+    """JSON ответ с ETag; 304 если у клиента та же версия"""
+    etag = entry['etag']
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(entry['data'])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = (
+        f'private, max-age={max_age}, stale-while-revalidate={DEFAULT_TTL}'
+    )
+    return response
+
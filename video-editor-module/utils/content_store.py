@@ -0,0 +1,218 @@
+"""
+Хранилище файлов по содержимому
+- Хэш BLAKE2b считается во время приёма файла - без повторного чтения с диска
+- Объекты: <cache>/content/objects/<id[:2]>/<id>, рабочие файлы - жёсткие ссылки на них
+- Повторная загрузка того же файла под новым именем не занимает места
+- content_id(path) - ID по (устройство, inode, размер, mtime) без перечитывания файла
+- Объекты без ссылок удаляет prune_orphans (уборщик outputs / start_orphan_pruner)
+Файлы из хранилища и всё, что размещено через link_or_copy (загрузки, результаты
+из memo, ссылки в outputs), нельзя менять на месте: все ссылки делят одно содержимое.
+Новая версия пишется в отдельный файл и ставится на место через os.replace
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+from utils.media_cache import HASH_CHUNK_SIZE, file_content_hash, load_json, save_json
+
+logger = logging.getLogger(__name__)
+
+CONTENT_NAMESPACE = 'content'
+INODE_NAMESPACE = 'content_ids'
+PROBE_NAMESPACE = 'probe'
+# Объект только что помещён в хранилище, а ссылка на него ещё не создана
+ORPHAN_GRACE_SECONDS = 3600
+PRUNE_INTERVAL = int(os.getenv('CONTENT_PRUNE_INTERVAL', '3600'))
+
+_inode_ids = {}
+_inode_ids_lock = threading.Lock()
+
+
+def _objects_folder(cache_folder):
+    return os.path.join(cache_folder, CONTENT_NAMESPACE, 'objects')
+
+
+def object_path(cache_folder, cid):
+    """Путь к объекту хранилища по content ID"""
+    return os.path.join(_objects_folder(cache_folder), cid[:2], cid)
+
+
+def _stat_key(stat):
+    return f'{stat.st_dev}_{stat.st_ino}'
+
+
+def _remember(cache_folder, path, cid):
+    """Запомнить content ID для inode файла (в памяти и в кэше)"""
+    stat = os.stat(path)
+    entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'id': cid}
+    with _inode_ids_lock:
+        _inode_ids[_stat_key(stat)] = entry
+    save_json(cache_folder, INODE_NAMESPACE, _stat_key(stat), entry)
+
+
+def link_or_copy(src, dest):
+    """
+    Жёсткая ссылка на файл, на другой файловой системе - копия
+    dest делит содержимое с src: открывать его на запись нельзя, только заменять
+    """
+    if os.path.abspath(src) == os.path.abspath(dest):
+        return dest
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+    return dest
+
+
+def _store(tmp_path, cid, cache_folder):
+    """Переместить временный файл в хранилище (или выбросить, если такой объект уже есть)"""
+    obj = object_path(cache_folder, cid)
+    if os.path.exists(obj):
+        os.remove(tmp_path)
+        logger.info(f"Duplicate content {cid}, reusing stored object")
+    else:
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        os.replace(tmp_path, obj)
+    return obj
+
+
+def ingest_stream(stream, dest_path, cache_folder, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Записать поток в хранилище, хэшируя на лету, и разместить по dest_path ссылкой
+    Возвращает content ID
+    """
+    objects = _objects_folder(cache_folder)
+    os.makedirs(objects, exist_ok=True)
+    tmp_path = os.path.join(objects, f'.incoming_{os.getpid()}_{threading.get_ident()}')
+
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                h.update(chunk)
+                f.write(chunk)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    cid = h.hexdigest()
+    obj = _store(tmp_path, cid, cache_folder)
+    link_or_copy(obj, dest_path)
+    _remember(cache_folder, dest_path, cid)
+    return cid
+
+
+def save_upload(file_storage, dest_path, cache_folder):
+    """Сохранить загруженный файл (werkzeug FileStorage) через хранилище"""
+    return ingest_stream(file_storage.stream, dest_path, cache_folder)
+
+
+def ingest_file(path, cache_folder):
+    """
+    Занести уже лежащий на диске файл в хранилище
+    Если такое содержимое уже есть - файл заменяется ссылкой на объект
+    Возвращает content ID
+    """
+    cid = content_id(path, cache_folder)
+    obj = object_path(cache_folder, cid)
+    if os.path.exists(obj):
+        if not os.path.samefile(obj, path):
+            link_or_copy(obj, path)
+            _remember(cache_folder, path, cid)
+            logger.info(f"Deduplicated {os.path.basename(path)} -> {cid}")
+    else:
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        link_or_copy(path, obj)
+    return cid
+
+
+def content_id(path, cache_folder, compute=True):
+    """
+    Content ID файла
+    Известен по inode - без чтения; иначе хэш содержимого (compute=False - None)
+    """
+    stat = os.stat(path)
+    key = _stat_key(stat)
+    with _inode_ids_lock:
+        entry = _inode_ids.get(key)
+    if entry is None:
+        entry = load_json(cache_folder, INODE_NAMESPACE, key)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        with _inode_ids_lock:
+            _inode_ids[key] = entry
+        return entry['id']
+
+    if not compute:
+        return None
+    cid = file_content_hash(path)
+    _remember(cache_folder, path, cid)
+    return cid
+
+
+def cached_probe(path, cache_folder, probe_func):
+    """
+    Метаданные файла с кэшем по content ID
+    Файлы с неизвестным ID не хэшируются ради проверки - просто probe_func
+    """
+    cid = content_id(path, cache_folder, compute=False)
+    if cid is None:
+        return probe_func(path)
+    info = load_json(cache_folder, PROBE_NAMESPACE, cid)
+    if info is None:
+        info = probe_func(path)
+        save_json(cache_folder, PROBE_NAMESPACE, cid, info)
+    return info
+
+
+def prune_orphans(cache_folder, grace=ORPHAN_GRACE_SECONDS):
+    """
+    Удалить объекты, на которые не осталось ни одной ссылки. Возвращает число байт
+    Объекты, у которых число ссылок менялось позже grace секунд назад, не трогаются
+    """
+    freed = 0
+    removed = 0
+    objects = _objects_folder(cache_folder)
+    if not os.path.isdir(objects):
+        return 0
+    cutoff = time.time() - grace
+    for prefix in os.listdir(objects):
+        folder = os.path.join(objects, prefix)
+        if not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+                # st_ctime меняется при создании и удалении ссылок
+                if stat.st_nlink <= 1 and stat.st_ctime < cutoff:
+                    os.remove(path)
+                    freed += stat.st_size
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    if removed:
+        logger.info(f"Pruned {removed} unreferenced content objects ({freed / 1024 ** 2:.1f} MB)")
+    return freed
+
+
+def start_orphan_pruner(cache_folder, interval=PRUNE_INTERVAL):
+    """Фоновая очистка хранилища там, где нет уборщика outputs"""
+    def loop():
+        while True:
+            try:
+                prune_orphans(cache_folder)
+            except Exception as e:
+                logger.warning(f"Content store prune failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='content-pruner')
+    thread.daemon = True
+    thread.start()
+    return thread
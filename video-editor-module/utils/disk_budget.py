@@ -0,0 +1,264 @@
+"""
+Допуск задач по месту на диске
+- Перед запуском задача оценивает объём результата:
+  копирование потоков - битрейт исходника × длительность (≈ размер исходника),
+  перекодирование - целевой битрейт × длительность
+- Оценка резервируется против свободного места (os.statvfs): занято + резервы
+  + новая задача не должны превышать порог заполнения диска
+- Не помещается сейчас - задача ждёт освобождения резервов (или места);
+  не поместится никогда - отклоняется сразу
+- По мере записи файлов резерв уменьшается (записанное уже видно в statvfs)
+Резервы хранятся в SQLite (DISK_BUDGET_DB, по умолчанию - база общей очереди
+JOB_QUEUE_DB): воркеры на разных процессах и машинах, пишущие на один диск,
+видят резервы друг друга. Резервы умерших процессов этого хоста снимаются сразу,
+других хостов - если резерв не обновлялся дольше RESERVATION_TTL
+"""
+
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DISK_WATERMARK = float(os.getenv('DISK_BUDGET_WATERMARK', '0.90'))
+# Запас к оценке: контейнер, ключевые кадры на краях, неточность битрейта
+ESTIMATE_MARGIN = 1.1
+ADMISSION_TIMEOUT = int(os.getenv('DISK_ADMISSION_TIMEOUT', '1800'))
+# Место может освободиться и без наших резервов (очистка, выселение папок,
+# резервы других процессов)
+RECHECK_INTERVAL = 5
+RESERVATION_TTL = int(os.getenv('DISK_RESERVATION_TTL', str(12 * 3600)))
+BUDGET_FILENAME = 'disk_budget.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS disk_reservations (
+    id TEXT PRIMARY KEY,
+    disk TEXT NOT NULL,
+    job_id TEXT,
+    host TEXT,
+    pid INTEGER,
+    size INTEGER NOT NULL,
+    remaining INTEGER NOT NULL,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS disk_reservations_disk ON disk_reservations (disk);
+"""
+
+
+class DiskBudgetExceeded(Exception):
+    pass
+
+
+def copy_estimate(duration=0, bitrate=0, size=None):
+    """Объём копии потоков: размер исходника или битрейт (бит/с) × длительность"""
+    if size is None:
+        size = bitrate * duration / 8
+    return int(size * ESTIMATE_MARGIN)
+
+
+def encode_estimate(duration, video_bitrate=0, audio_bitrate=0):
+    """Объём перекодированного результата по целевым битрейтам (бит/с)"""
+    return int((video_bitrate + audio_bitrate) * duration / 8 * ESTIMATE_MARGIN)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Reservation:
+    """Резерв места одной задачи"""
+
+    def __init__(self, budget, reservation_id, job_id, size):
+        self.budget = budget
+        self.id = reservation_id
+        self.job_id = job_id
+        self.size = size
+        self.remaining = size
+
+    def written(self, nbytes):
+        """Записано nbytes результата - эта часть резерва больше не нужна"""
+        self.remaining = max(self.remaining - nbytes, 0)
+        self.budget._shrink(self)
+
+    def release(self):
+        self.budget._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class DiskBudget:
+    """Резервы места для папки результатов (общие для всех процессов с той же базой)"""
+
+    def __init__(self, path, db_path, watermark=DISK_WATERMARK):
+        self.path = path
+        self.db_path = db_path
+        self.watermark = watermark
+        self.host = socket.gethostname()
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None - транзакции вручную (BEGIN IMMEDIATE при допуске)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _disk(self):
+        statvfs = os.statvfs(self.path)
+        total = statvfs.f_blocks * statvfs.f_frsize
+        free = statvfs.f_bavail * statvfs.f_frsize
+        return total, total - free
+
+    def _drop_stale(self, conn):
+        """Снять резервы упавших процессов (вызывается внутри транзакции)"""
+        stale = [
+            row['id'] for row in conn.execute(
+                'SELECT id, host, pid, updated_at FROM disk_reservations WHERE disk = ?',
+                (self.path,)
+            )
+            if (row['host'] == self.host and row['pid'] != os.getpid() and not _pid_alive(row['pid']))
+            or row['updated_at'] < time.time() - RESERVATION_TTL
+        ]
+        if stale:
+            conn.executemany('DELETE FROM disk_reservations WHERE id = ?', [(r,) for r in stale])
+            logger.warning(f"Dropped {len(stale)} disk reservation(s) of dead processes")
+
+    def _reserved(self, conn):
+        row = conn.execute(
+            'SELECT COUNT(*) AS n, COALESCE(SUM(remaining), 0) AS size '
+            'FROM disk_reservations WHERE disk = ?', (self.path,)
+        ).fetchone()
+        return row['n'], row['size']
+
+    def _try_admit(self, job_id, size):
+        """
+        Одна попытка: (Reservation, 0) или (None, занято резервами) - ждать
+        Не поместится никогда - DiskBudgetExceeded
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._drop_stale(conn)
+            count, reserved = self._reserved(conn)
+            total, used = self._disk()
+            limit = total * self.watermark
+            if used + reserved + size <= limit:
+                reservation = Reservation(self, uuid.uuid4().hex, job_id, size)
+                now = time.time()
+                conn.execute(
+                    'INSERT INTO disk_reservations (id, disk, job_id, host, pid, size, remaining, '
+                    'created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (reservation.id, self.path, job_id, self.host, os.getpid(),
+                     size, size, now, now)
+                )
+                conn.execute('COMMIT')
+                return reservation, 0
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        # Других резервов нет - ждать нечего, место само не освободится
+        if used + size > limit and not count:
+            raise DiskBudgetExceeded(
+                f'Not enough disk space: needs {size / 1024 ** 3:.2f} GB, '
+                f'{max(limit - used, 0) / 1024 ** 3:.2f} GB available below '
+                f'the {self.watermark:.0%} watermark'
+            )
+        return None, reserved
+
+    def admit(self, job_id, size, timeout=ADMISSION_TIMEOUT, on_wait=None):
+        """
+        Зарезервировать size байт. Ждёт не дольше timeout (0 - без ожидания)
+        on_wait() вызывается один раз, если задача встала в ожидание
+        Возвращает Reservation или бросает DiskBudgetExceeded
+        """
+        deadline = time.time() + timeout
+        waiting = False
+        with self._cond:
+            while True:
+                reservation, reserved = self._try_admit(job_id, size)
+                if reservation:
+                    if waiting:
+                        logger.info(f"Job {job_id} admitted after waiting for disk space")
+                    return reservation
+                left = deadline - time.time()
+                if left <= 0:
+                    raise DiskBudgetExceeded(
+                        f'Not enough disk space for {size / 1024 ** 3:.2f} GB: '
+                        f'{reserved / 1024 ** 3:.2f} GB is reserved by running jobs'
+                    )
+                if not waiting:
+                    waiting = True
+                    logger.info(f"Job {job_id} waits for disk space ({size / 1024 ** 3:.2f} GB)")
+                    if on_wait:
+                        on_wait()
+                # Освобождение в этом процессе будит сразу, в других - следующая проверка
+                self._cond.wait(min(left, RECHECK_INTERVAL))
+
+    def _shrink(self, reservation):
+        self._connect().execute(
+            'UPDATE disk_reservations SET remaining = ?, updated_at = ? WHERE id = ?',
+            (reservation.remaining, time.time(), reservation.id)
+        )
+        with self._cond:
+            self._cond.notify_all()
+
+    def _release(self, reservation):
+        cursor = self._connect().execute(
+            'DELETE FROM disk_reservations WHERE id = ?', (reservation.id,)
+        )
+        if cursor.rowcount:
+            with self._cond:
+                self._cond.notify_all()
+
+    def status(self):
+        conn = self._connect()
+        count, reserved = self._reserved(conn)
+        total, used = self._disk()
+        return {
+            'watermark': self.watermark,
+            'disk_total_gb': round(total / 1024 ** 3, 2),
+            'disk_used_gb': round(used / 1024 ** 3, 2),
+            'reserved_gb': round(reserved / 1024 ** 3, 2),
+            'reservations': count
+        }
+
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def get_disk_budget(path, cache_folder):
+    """
+    Бюджет процесса для папки результатов
+    База резервов: DISK_BUDGET_DB, иначе JOB_QUEUE_DB (общая очередь воркеров),
+    иначе <cache_folder>/disk_budget.db (один сервер)
+    """
+    key = os.path.abspath(path)
+    db_path = (os.getenv('DISK_BUDGET_DB') or os.getenv('JOB_QUEUE_DB')
+               or os.path.join(os.path.abspath(cache_folder), BUDGET_FILENAME))
+    with _budgets_lock:
+        if key not in _budgets:
+            _budgets[key] = DiskBudget(key, db_path)
+        return _budgets[key]
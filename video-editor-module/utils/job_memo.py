@@ -0,0 +1,63 @@
+"""
+Мемоизация результатов задач
+- Ключ: (content ID исходника, операция, нормализованные параметры)
+- Запись хранит результат задачи и список выходных файлов
+- Результат выдаётся, только если все выходные файлы ещё на месте
+"""
+
+import os
+import logging
+
+from utils.media_cache import params_key, cache_path, load_json, save_json
+
+logger = logging.getLogger(__name__)
+
+MEMO_NAMESPACE = 'job_memo'
+
+
+def normalize_params(params):
+    """Параметры в каноническом виде: без None, числа как float, строки без регистра/пробелов"""
+    normalized = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            normalized[name] = value
+        elif isinstance(value, (int, float)):
+            normalized[name] = round(float(value), 3)
+        elif isinstance(value, str):
+            normalized[name] = value.strip().lower()
+        else:
+            normalized[name] = value
+    return normalized
+
+
+def memo_key(source_id, operation, params):
+    return f"{operation}_{source_id[:16]}_{params_key(source_id, operation, normalize_params(params))}"
+
+
+def lookup(cache_folder, key):
+    """Сохранённый результат или None (нет записи или выходные файлы удалены)"""
+    entry = load_json(cache_folder, MEMO_NAMESPACE, key)
+    if entry is None:
+        return None
+    missing = [f for f in entry.get('files', []) if not os.path.exists(f)]
+    if missing:
+        logger.info(f"Memo {key} is stale: {len(missing)} output file(s) gone")
+        forget(cache_folder, key)
+        return None
+    return entry['result']
+
+
+def remember(cache_folder, key, result, files):
+    """Сохранить результат завершённой задачи"""
+    save_json(cache_folder, MEMO_NAMESPACE, key, {
+        'result': result,
+        'files': [os.path.abspath(f) for f in files]
+    })
+
+
+def forget(cache_folder, key):
+    path = cache_path(cache_folder, MEMO_NAMESPACE, key)
+    if os.path.exists(path):
+        os.remove(path)
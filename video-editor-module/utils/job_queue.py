@@ -0,0 +1,265 @@
+"""
+Надёжная очередь задач для воркеров на нескольких машинах
+- SQLite на общем хранилище (JOB_QUEUE_DB), переживает перезапуск процессов
+- Воркеры регистрируют возможности (операции) и ёмкость, шлют heartbeat
+- Захват задачи атомарный (BEGIN IMMEDIATE), задача берётся только воркером,
+  умеющим все нужные ей операции
+- Задачи умерших воркеров (нет heartbeat дольше таймаута) возвращаются в очередь
+- Состояние задачи (прогресс, результаты) - JSON, который воркер периодически обновляет
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+QUEUE_FILENAME = 'job_queue.db'
+HEARTBEAT_INTERVAL = 5
+WORKER_TIMEOUT = int(os.getenv('JOB_WORKER_TIMEOUT', '30'))
+DEFAULT_MAX_ATTEMPTS = 3
+CLAIM_SCAN_LIMIT = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    op TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    requires TEXT NOT NULL,
+    status TEXT NOT NULL,
+    state TEXT,
+    initial_state TEXT,
+    worker_id TEXT,
+    attempts INTEGER DEFAULT 0,
+    max_attempts INTEGER DEFAULT 3,
+    cancel_requested INTEGER DEFAULT 0,
+    error TEXT,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    capabilities TEXT,
+    capacity INTEGER,
+    running INTEGER DEFAULT 0,
+    started_at REAL,
+    heartbeat_at REAL
+);
+"""
+
+FINAL_STATUSES = ('completed', 'error', 'cancelled')
+
+
+class JobQueue:
+    """Очередь задач поверх SQLite"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None - транзакции вручную (BEGIN IMMEDIATE при захвате)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _job_to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        for field in ('payload', 'requires', 'state', 'initial_state'):
+            job[field] = json.loads(job[field]) if job.get(field) else None
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        return job
+
+    # ---------- задачи ----------
+
+    def enqueue(self, job_id, op, payload, requires=None, state=None,
+                max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """Поставить задачу в очередь (задача с тем же id перезаписывается)"""
+        now = time.time()
+        state = json.dumps(state or {})
+        self._connect().execute(
+            'INSERT OR REPLACE INTO jobs (id, op, payload, requires, status, state, initial_state, '
+            'attempts, max_attempts, cancel_requested, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, 0, ?, ?)',
+            (job_id, op, json.dumps(payload), json.dumps(sorted(requires or [op])),
+             'queued', state, state, max_attempts, now, now)
+        )
+        return job_id
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._job_to_dict(row)
+
+    def claim(self, worker_id, capabilities, limit=1):
+        """
+        Атомарно забрать до limit задач, которые воркер умеет выполнять
+        Повторный запуск (после умершего воркера) начинается с исходного состояния
+        """
+        capabilities = set(capabilities)
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT ?",
+                (CLAIM_SCAN_LIMIT,)
+            ).fetchall()
+            claimed = []
+            now = time.time()
+            for row in rows:
+                if len(claimed) >= limit:
+                    break
+                if not set(json.loads(row['requires'])) <= capabilities:
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_id = ?, attempts = attempts + 1, "
+                    "state = initial_state, updated_at = ? WHERE id = ?",
+                    (worker_id, now, row['id'])
+                )
+                claimed.append(row['id'])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [self.get(job_id) for job_id in claimed]
+
+    def update_state(self, job_id, state):
+        """Обновить состояние выполняющейся задачи. Возвращает флаг отмены"""
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET state = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+            (json.dumps(state), time.time(), job_id)
+        )
+        row = conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def finish(self, job_id, status, state=None, error=None):
+        """Завершить задачу: completed / error / cancelled"""
+        if status not in FINAL_STATUSES:
+            raise ValueError(f'Not a final status: {status}')
+        self._connect().execute(
+            'UPDATE jobs SET status = ?, state = COALESCE(?, state), error = ?, updated_at = ? '
+            'WHERE id = ?',
+            (status, json.dumps(state) if state is not None else None, error, time.time(), job_id)
+        )
+
+    def cancel(self, job_id):
+        """Отменить: задача в очереди снимается сразу, выполняющаяся - по флагу у воркера"""
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id)
+        )
+        conn.execute(
+            "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'running'",
+            (time.time(), job_id)
+        )
+        return self.get(job_id)
+
+    def counts(self):
+        rows = self._connect().execute(
+            'SELECT status, COUNT(*) AS n FROM jobs GROUP BY status'
+        ).fetchall()
+        return {r['status']: r['n'] for r in rows}
+
+    # ---------- воркеры ----------
+
+    def register_worker(self, worker_id, capabilities, capacity):
+        now = time.time()
+        self._connect().execute(
+            'INSERT OR REPLACE INTO workers (id, host, pid, capabilities, capacity, running, '
+            'started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?)',
+            (worker_id, socket.gethostname(), os.getpid(), json.dumps(sorted(capabilities)),
+             capacity, now, now)
+        )
+
+    def heartbeat(self, worker_id, running):
+        """False - воркер уже признан умершим (нужно зарегистрироваться заново)"""
+        cursor = self._connect().execute(
+            'UPDATE workers SET heartbeat_at = ?, running = ? WHERE id = ?',
+            (time.time(), running, worker_id)
+        )
+        return cursor.rowcount > 0
+
+    def unregister_worker(self, worker_id):
+        self._connect().execute('DELETE FROM workers WHERE id = ?', (worker_id,))
+
+    def list_workers(self):
+        rows = self._connect().execute('SELECT * FROM workers ORDER BY started_at').fetchall()
+        now = time.time()
+        workers = []
+        for row in rows:
+            worker = dict(row)
+            worker['capabilities'] = json.loads(worker['capabilities'])
+            worker['alive'] = now - worker['heartbeat_at'] <= WORKER_TIMEOUT
+            workers.append(worker)
+        return workers
+
+    def requeue_dead(self, timeout=WORKER_TIMEOUT):
+        """
+        Вернуть в очередь задачи воркеров без heartbeat дольше timeout
+        Задачи, исчерпавшие попытки, помечаются ошибкой. Возвращает число задач
+        """
+        conn = self._connect()
+        deadline = time.time() - timeout
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            dead = [r['id'] for r in conn.execute(
+                'SELECT id FROM workers WHERE heartbeat_at < ?', (deadline,)
+            ).fetchall()]
+            # Задачи, чей воркер пропал совсем (запись удалена или не регистрировался)
+            orphaned = conn.execute(
+                "SELECT id, attempts, max_attempts FROM jobs WHERE status = 'running' AND "
+                "(worker_id IS NULL OR worker_id NOT IN (SELECT id FROM workers) "
+                "OR worker_id IN (SELECT id FROM workers WHERE heartbeat_at < ?))",
+                (deadline,)
+            ).fetchall()
+            now = time.time()
+            for job in orphaned:
+                if job['attempts'] >= job['max_attempts']:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'error', error = 'Worker lost too many times', "
+                        "updated_at = ? WHERE id = ?", (now, job['id'])
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'queued', worker_id = NULL, updated_at = ? "
+                        "WHERE id = ?", (now, job['id'])
+                    )
+            if dead:
+                conn.executemany('DELETE FROM workers WHERE id = ?', [(w,) for w in dead])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if orphaned:
+            logger.warning(f"Requeued {len(orphaned)} job(s) from dead workers {dead}")
+        return len(orphaned)
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_job_queue(cache_folder):
+    """Очередь процесса: JOB_QUEUE_DB (общее хранилище) или <cache_folder>/job_queue.db"""
+    db_path = os.getenv('JOB_QUEUE_DB') or os.path.join(os.path.abspath(cache_folder), QUEUE_FILENAME)
+    with _queues_lock:
+        if db_path not in _queues:
+            _queues[db_path] = JobQueue(db_path)
+        return _queues[db_path]
@@ -0,0 +1,59 @@
+"""
+Утилиты кэширования медиа
+- Хэш содержимого файла (BLAKE2b, потоковое чтение)
+- JSON-кэш результатов анализа в CACHE_FOLDER
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+def file_content_hash(filepath, chunk_size=HASH_CHUNK_SIZE):
+    """Хэш содержимого файла (BLAKE2b, 128 бит, hex)"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_key(*parts):
+    """Короткий ключ из набора параметров (для имён файлов кэша)"""
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def cache_path(cache_folder, namespace, key, ext='json'):
+    """Путь к файлу кэша: <cache_folder>/<namespace>/<key>.<ext>"""
+    folder = os.path.join(cache_folder, namespace)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f'{key}.{ext}')
+
+
+def load_json(cache_folder, namespace, key):
+    """Прочитать JSON из кэша (None если нет или файл повреждён)"""
+    path = cache_path(cache_folder, namespace, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Broken cache entry {path}: {e}")
+        return None
+
+
+def save_json(cache_folder, namespace, key, data):
+    """Атомарно записать JSON в кэш"""
+    path = cache_path(cache_folder, namespace, key)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,162 @@
+"""
+Каталог медиафайлов (SQLite в CACHE_FOLDER)
+- Метаданные мастеров: размер, mtime, длительность, разрешение, fps
+- Состояние mezzanine-копии: статус, прогресс, путь, ошибка,
+  размер и mtime мастера, из которого она сделана (копия устаревшего мастера не используется)
+Одна база на папку кэша, соединение на поток (sqlite3 не делится между потоками)
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FILENAME = 'media_catalog.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    info TEXT,
+    mezzanine_path TEXT,
+    mezzanine_status TEXT,
+    mezzanine_progress REAL DEFAULT 0,
+    mezzanine_error TEXT,
+    mezzanine_source_size INTEGER,
+    mezzanine_source_mtime REAL,
+    created_at REAL,
+    updated_at REAL
+);
+"""
+
+# Колонки, добавленные после первой версии схемы (ALTER TABLE для старых баз)
+ADDED_COLUMNS = {
+    'mezzanine_source_size': 'INTEGER',
+    'mezzanine_source_mtime': 'REAL'
+}
+
+MEDIA_FIELDS = {
+    'size', 'mtime', 'info', 'mezzanine_path', 'mezzanine_status',
+    'mezzanine_progress', 'mezzanine_error', *ADDED_COLUMNS
+}
+
+
+class MediaCatalog:
+    """Каталог медиа поверх SQLite"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            existing = {row['name'] for row in conn.execute('PRAGMA table_info(media)')}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE media ADD COLUMN {column} {column_type}')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_dict(row):
+        if row is None:
+            return None
+        item = dict(row)
+        item['info'] = json.loads(item['info']) if item.get('info') else None
+        return item
+
+    def get(self, path):
+        row = self._connect().execute(
+            'SELECT * FROM media WHERE path = ?', (os.path.abspath(path),)
+        ).fetchone()
+        return self._row_to_dict(row)
+
+    def update(self, path, **fields):
+        """Создать или обновить запись (только известные поля)"""
+        unknown = set(fields) - MEDIA_FIELDS
+        if unknown:
+            raise ValueError(f'Unknown catalog fields: {sorted(unknown)}')
+        if 'info' in fields and fields['info'] is not None:
+            fields['info'] = json.dumps(fields['info'])
+
+        path = os.path.abspath(path)
+        now = time.time()
+        columns = ', '.join(fields)
+        placeholders = ', '.join('?' for _ in fields)
+        updates = ', '.join(f'{k} = excluded.{k}' for k in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f'INSERT INTO media (path, created_at, updated_at{", " + columns if fields else ""}) '
+                f'VALUES (?, ?, ?{", " + placeholders if fields else ""}) '
+                f'ON CONFLICT(path) DO UPDATE SET updated_at = excluded.updated_at'
+                f'{", " + updates if fields else ""}',
+                (path, now, now, *fields.values())
+            )
+        return self.get(path)
+
+    def register(self, path, probe_func=None):
+        """
+        Запись о файле с актуальными метаданными
+        Пересчитывается только если размер или mtime изменились
+        """
+        stat = os.stat(path)
+        item = self.get(path)
+        if item and item['size'] == stat.st_size and item['mtime'] == stat.st_mtime:
+            return item
+        info = probe_func(path) if probe_func else None
+        return self.update(path, size=stat.st_size, mtime=stat.st_mtime, info=info)
+
+    def mezzanine_for(self, path):
+        """Путь готовой mezzanine-копии, если она сделана из текущей версии файла, иначе None"""
+        item = self.get(path)
+        if not item or item['mezzanine_status'] != 'ready' or not item['mezzanine_path']:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if (item['mezzanine_source_size'], item['mezzanine_source_mtime']) != (stat.st_size, stat.st_mtime):
+            logger.info(f"Mezzanine of {path} is stale (master changed)")
+            self.update(path, mezzanine_status='stale')
+            return None
+        if not os.path.exists(item['mezzanine_path']):
+            return None
+        return item['mezzanine_path']
+
+    def list(self, prefix=None):
+        sql = 'SELECT * FROM media'
+        params = ()
+        if prefix:
+            sql += ' WHERE path LIKE ?'
+            params = (os.path.abspath(prefix).rstrip(os.sep) + os.sep + '%',)
+        rows = self._connect().execute(sql + ' ORDER BY updated_at DESC', params).fetchall()
+        return [self._row_to_dict(r) for r in rows]
+
+    def remove(self, path):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM media WHERE path = ?', (os.path.abspath(path),))
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(cache_folder):
+    """Каталог для папки кэша (один объект на процесс)"""
+    db_path = os.path.join(os.path.abspath(cache_folder), CATALOG_FILENAME)
+    with _catalogs_lock:
+        if db_path not in _catalogs:
+            _catalogs[db_path] = MediaCatalog(db_path)
+        return _catalogs[db_path]
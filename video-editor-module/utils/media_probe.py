@@ -0,0 +1,100 @@
+"""
+Получение метаданных медиафайлов
+- PyAV (libav в процессе): без fork процесса Flask и без разбора JSON
+- ffprobe (subprocess): запасной вариант, если PyAV не установлен или не смог
+Бэкенд выбирается переменной MEDIA_PROBE_BACKEND: auto | pyav | ffprobe
+"""
+
+import os
+import json
+import logging
+
+from utils.spawn_server import run as run_command
+
+logger = logging.getLogger(__name__)
+
+try:
+    import av
+    PYAV_AVAILABLE = True
+except ImportError:
+    PYAV_AVAILABLE = False
+
+PROBE_BACKEND = os.getenv('MEDIA_PROBE_BACKEND', 'auto')
+DEFAULT_FPS = 30.0
+
+
+def probe_pyav(path):
+    """Метаданные через PyAV: {'duration', 'width', 'height', 'fps', 'has_audio'}"""
+    with av.open(path) as container:
+        video = next(iter(container.streams.video), None)
+        audio = next(iter(container.streams.audio), None)
+
+        duration = 0.0
+        if container.duration is not None:
+            duration = container.duration / av.time_base
+        elif video is not None and video.duration is not None:
+            duration = float(video.duration * video.time_base)
+
+        fps = DEFAULT_FPS
+        if video is not None:
+            rate = video.average_rate or video.guessed_rate
+            if rate:
+                fps = float(rate)
+
+        return {
+            'duration': float(duration),
+            'width': video.codec_context.width if video is not None else 0,
+            'height': video.codec_context.height if video is not None else 0,
+            'fps': fps,
+            'has_audio': audio is not None
+        }
+
+
+def probe_ffprobe(path, runner=None):
+    """
+    Метаданные через ffprobe: {'duration', 'width', 'height', 'fps', 'has_audio'}
+    runner - замена run_command (например, subprocess.run для прямого fork)
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration:stream=codec_type,width,height,r_frame_rate',
+        '-of', 'json',
+        path
+    ]
+    result = (runner or run_command)(cmd, capture_output=True, text=True)
+    data = json.loads(result.stdout)
+
+    streams = data.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+
+    # Парсинг frame rate
+    fps_parts = video.get('r_frame_rate', '').split('/')
+    fps = DEFAULT_FPS
+    if len(fps_parts) == 2 and float(fps_parts[1]):
+        fps = float(fps_parts[0]) / float(fps_parts[1])
+
+    return {
+        'duration': float(data['format']['duration']),
+        'width': video.get('width', 0),
+        'height': video.get('height', 0),
+        'fps': fps,
+        'has_audio': any(s.get('codec_type') == 'audio' for s in streams)
+    }
+
+
+def probe(path, backend=None):
+    """
+    Метаданные файла выбранным бэкендом
+    auto - PyAV если установлен, при ошибке - ffprobe
+    """
+    backend = backend or PROBE_BACKEND
+    if backend == 'ffprobe' or (backend == 'auto' and not PYAV_AVAILABLE):
+        return probe_ffprobe(path)
+
+    try:
+        return probe_pyav(path)
+    except Exception as e:
+        if backend == 'pyav':
+            raise
+        logger.debug(f"PyAV probe failed for {path}: {e}, using ffprobe")
+        return probe_ffprobe(path)
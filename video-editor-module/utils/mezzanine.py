@@ -0,0 +1,66 @@
+"""
+Mezzanine-копия мастера для монтажа
+- Закрытый GOP, ключевой кадр ровно каждую секунду, постоянный fps
+- Аудио AAC 48 кГц стерео
+Нарезка по целым секундам из такой копии - точная при -c copy
+"""
+
+import os
+import logging
+
+from utils.spawn_server import run as run_command
+from utils.media_probe import probe
+
+logger = logging.getLogger(__name__)
+
+MEZZANINE_CRF = 18
+MEZZANINE_PRESET = 'fast'
+MEZZANINE_AUDIO_RATE = 48000
+MEZZANINE_AUDIO_BITRATE = '192k'
+KEYFRAME_INTERVAL_SECONDS = 1
+
+
+def mezzanine_path_for(source_path, mezzanine_folder):
+    base = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(mezzanine_folder, f'{base}_mezz.mp4')
+
+
+def transcode_mezzanine(source_path, output_path, on_progress=None):
+    """
+    Перекодировать мастер в mezzanine-профиль
+    on_progress(fraction 0..1) - прогресс по времени ffmpeg
+    """
+    info = probe(source_path)
+    duration = info['duration'] or 0
+    # Постоянный целый fps (29.97 -> 30), в разумных пределах
+    fps = min(60, max(1, int(round(info['fps'] or 30))))
+    gop = fps * KEYFRAME_INTERVAL_SECONDS
+
+    tmp_path = f'{output_path}.tmp.mp4'
+    cmd = [
+        'ffmpeg', '-y', '-i', source_path,
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-c:v', 'libx264', '-preset', MEZZANINE_PRESET, '-crf', str(MEZZANINE_CRF),
+        '-pix_fmt', 'yuv420p',
+        '-r', str(fps), '-vsync', 'cfr',
+        '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+        '-flags', '+cgop', '-x264-params', 'open-gop=0',
+        '-c:a', 'aac', '-b:a', MEZZANINE_AUDIO_BITRATE,
+        '-ar', str(MEZZANINE_AUDIO_RATE), '-ac', '2',
+        '-movflags', '+faststart',
+        tmp_path
+    ]
+
+    progress = None
+    if on_progress and duration > 0:
+        progress = lambda seconds: on_progress(min(1.0, seconds / duration))
+
+    result = run_command(cmd, capture_output=True, text=True, on_progress=progress)
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise RuntimeError(f"Mezzanine transcode failed: {result.stderr[-300:]}")
+
+    os.replace(tmp_path, output_path)
+    logger.info(f"Mezzanine ready: {os.path.basename(output_path)} ({fps} fps, GOP {gop})")
+    return {'path': output_path, 'fps': fps, 'gop': gop, 'duration': duration}
@@ -0,0 +1,289 @@
+"""
+Объектное хранилище (S3-совместимое: Selectel, MinIO) без SDK
+- Presigned URL (AWS SigV4, подпись в query) - ffmpeg читает их сам, с Range-запросами:
+  короткий -c copy кусок длинного мастера скачивает только нужные байты
+- Загрузка: один PUT для небольших файлов, multipart для больших и для потока
+- encode_to_object: вывод ffmpeg (fragmented MP4 в pipe) уходит в хранилище
+  частями по мере кодирования, без файла на локальном диске
+Ссылки на объекты: s3://bucket/key
+Настройки: S3_ENDPOINT_URL, S3_BUCKET, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY, S3_REGION
+"""
+
+import os
+import hmac
+import hashlib
+import logging
+import threading
+import subprocess
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from urllib.parse import quote, urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINT = 'https://s3.ru-3.storage.selcloud.ru'
+DEFAULT_BUCKET = 'video-editor-files'
+DEFAULT_REGION = 'ru-3'
+PRESIGN_EXPIRES = 6 * 3600
+# Минимальный размер части multipart в S3 - 5 МБ
+PART_SIZE = 16 * 1024 * 1024
+REF_PREFIX = 's3://'
+
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+
+def _quote(value, safe='-_.~'):
+    return quote(str(value), safe=safe)
+
+
+def presign_v4(method, host, uri, access_key, secret_key, region, expires,
+               params=None, now=None):
+    """
+    Query-подпись AWS SigV4 (подписан только заголовок host, тело - UNSIGNED-PAYLOAD)
+    Возвращает строку query с подписью
+    """
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    datestamp = now.strftime('%Y%m%d')
+    scope = f'{datestamp}/{region}/s3/aws4_request'
+
+    query = {
+        'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+        'X-Amz-Credential': f'{access_key}/{scope}',
+        'X-Amz-Date': amz_date,
+        'X-Amz-Expires': str(expires),
+        'X-Amz-SignedHeaders': 'host',
+    }
+    query.update(params or {})
+    canonical_query = '&'.join(
+        f'{_quote(k)}={_quote(v)}' for k, v in sorted(query.items())
+    )
+    canonical_request = '\n'.join([
+        method, uri, canonical_query, f'host:{host}', '', 'host', 'UNSIGNED-PAYLOAD'
+    ])
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256', amz_date, scope,
+        hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+    ])
+    signing_key = _hmac(_hmac(_hmac(_hmac(
+        f'AWS4{secret_key}'.encode('utf-8'), datestamp), region), 's3'), 'aws4_request')
+    signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f'{canonical_query}&X-Amz-Signature={signature}'
+
+
+def is_object_ref(ref):
+    return isinstance(ref, str) and ref.startswith(REF_PREFIX)
+
+
+def parse_ref(ref):
+    """s3://bucket/key -> (bucket, key)"""
+    bucket, _, key = ref[len(REF_PREFIX):].partition('/')
+    if not bucket or not key:
+        raise ValueError(f'Invalid object reference: {ref}')
+    return bucket, key
+
+
+def _xml_find(root, name):
+    """Поиск элемента без учёта namespace"""
+    for element in root.iter():
+        if element.tag.rsplit('}', 1)[-1] == name:
+            return element.text
+    return None
+
+
+class ObjectStoreError(Exception):
+    pass
+
+
+class ObjectStore:
+    """Клиент S3-совместимого хранилища (path-style адресация)"""
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region=DEFAULT_REGION):
+        self.endpoint = endpoint.rstrip('/')
+        self.host = urlparse(self.endpoint).netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.session = requests.Session()
+
+    def ref(self, key, bucket=None):
+        return f'{REF_PREFIX}{bucket or self.bucket}/{key}'
+
+    def presign(self, method, key, bucket=None, expires=PRESIGN_EXPIRES, params=None):
+        uri = f'/{_quote(bucket or self.bucket)}/{_quote(key, safe="/-_.~")}'
+        query = presign_v4(method, self.host, uri, self.access_key, self.secret_key,
+                           self.region, expires, params)
+        return f'{self.endpoint}{uri}?{query}'
+
+    def presign_ref(self, ref, expires=PRESIGN_EXPIRES):
+        """Presigned GET для ссылки s3://bucket/key (для чтения ffmpeg/ffprobe)"""
+        bucket, key = parse_ref(ref)
+        return self.presign('GET', key, bucket=bucket, expires=expires)
+
+    def _check(self, response, what):
+        if response.status_code >= 300:
+            raise ObjectStoreError(f'{what} failed: HTTP {response.status_code} {response.text[:200]}')
+        return response
+
+    def head(self, key, bucket=None):
+        """Размер объекта или None, если его нет"""
+        response = self.session.head(self.presign('HEAD', key, bucket), timeout=30)
+        if response.status_code == 404:
+            return None
+        self._check(response, 'HEAD')
+        return int(response.headers.get('Content-Length', 0))
+
+    def download(self, key, path, bucket=None):
+        tmp_path = f'{path}.{threading.get_ident()}.part'
+        with self.session.get(self.presign('GET', key, bucket), stream=True, timeout=60) as response:
+            self._check(response, 'GET')
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+        return path
+
+    def delete(self, key, bucket=None):
+        response = self.session.delete(self.presign('DELETE', key, bucket), timeout=30)
+        if response.status_code != 404:
+            self._check(response, 'DELETE')
+
+    def upload_file(self, path, key, bucket=None):
+        """Загрузить файл: один PUT или multipart для больших"""
+        if os.path.getsize(path) <= PART_SIZE:
+            with open(path, 'rb') as f:
+                self._check(self.session.put(self.presign('PUT', key, bucket), data=f, timeout=300),
+                            'PUT')
+            return self.ref(key, bucket)
+        with open(path, 'rb') as f:
+            return self.upload_stream(f, key, bucket)
+
+    def upload_stream(self, stream, key, bucket=None, part_size=PART_SIZE):
+        """Multipart-загрузка из потока (размер заранее не известен)"""
+        def read_part():
+            buf = bytearray()
+            while len(buf) < part_size:
+                chunk = stream.read(part_size - len(buf))
+                if not chunk:
+                    break
+                buf.extend(chunk)
+            return bytes(buf)
+
+        first = read_part()
+        if len(first) < part_size:
+            # Весь поток поместился в одну часть - обычный PUT
+            self._check(self.session.put(self.presign('PUT', key, bucket), data=first, timeout=300),
+                        'PUT')
+            return self.ref(key, bucket)
+
+        response = self._check(self.session.post(
+            self.presign('POST', key, bucket, params={'uploads': ''}), timeout=30), 'Initiate upload')
+        upload_id = _xml_find(ET.fromstring(response.content), 'UploadId')
+        if not upload_id:
+            raise ObjectStoreError('Initiate upload: no UploadId in response')
+
+        parts = []
+        try:
+            data = first
+            while data:
+                number = len(parts) + 1
+                url = self.presign('PUT', key, bucket,
+                                   params={'partNumber': str(number), 'uploadId': upload_id})
+                response = self._check(self.session.put(url, data=data, timeout=300),
+                                       f'Upload part {number}')
+                parts.append((number, response.headers.get('ETag', '')))
+                data = read_part()
+
+            body = '<CompleteMultipartUpload>' + ''.join(
+                f'<Part><PartNumber>{n}</PartNumber><ETag>{etag}</ETag></Part>' for n, etag in parts
+            ) + '</CompleteMultipartUpload>'
+            response = self._check(self.session.post(
+                self.presign('POST', key, bucket, params={'uploadId': upload_id}),
+                data=body.encode('utf-8'), timeout=120), 'Complete upload')
+            # S3 может вернуть 200 с ошибкой в теле
+            if b'<Error>' in response.content:
+                raise ObjectStoreError(f'Complete upload failed: {response.text[:200]}')
+        except Exception:
+            self.session.delete(self.presign('DELETE', key, bucket, params={'uploadId': upload_id}),
+                                timeout=30)
+            raise
+        logger.info(f"Uploaded {key} in {len(parts)} parts")
+        return self.ref(key, bucket)
+
+
+def encode_to_object(store, cmd, key, bucket=None, timeout=None):
+    """
+    Запустить ffmpeg (cmd без выходного файла) с выводом fragmented MP4 в pipe
+    и загрузить результат в хранилище по мере кодирования
+    """
+    cmd = list(cmd) + ['-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+                       '-f', 'mp4', 'pipe:1']
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_chunks = []
+    # stderr читается отдельно, иначе ffmpeg встанет на заполненном pipe
+    reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()))
+    reader.daemon = True
+    reader.start()
+    try:
+        ref = store.upload_stream(process.stdout, key, bucket)
+        returncode = process.wait(timeout=timeout)
+    except Exception:
+        process.kill()
+        process.wait()
+        raise
+    reader.join(timeout=5)
+    if returncode != 0:
+        store.delete(key, bucket)
+        stderr = b''.join(stderr_chunks).decode('utf-8', 'replace')
+        raise ObjectStoreError(f'ffmpeg failed: {stderr[-300:]}')
+    return ref
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_object_store():
+    """Хранилище из переменных окружения или None, если ключи не заданы"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            access_key = os.getenv('S3_ACCESS_KEY_ID')
+            secret_key = os.getenv('S3_SECRET_ACCESS_KEY')
+            if not access_key or not secret_key:
+                return None
+            _store = ObjectStore(
+                os.getenv('S3_ENDPOINT_URL', DEFAULT_ENDPOINT),
+                os.getenv('S3_BUCKET', DEFAULT_BUCKET),
+                access_key, secret_key,
+                os.getenv('S3_REGION', DEFAULT_REGION)
+            )
+        return _store
+
+
+def resolve_source(name, folder):
+    """
+    Источник для ffmpeg/ffprobe: ссылка s3://bucket/key - presigned URL
+    (ffmpeg читает только нужные байты), иначе файл name в папке folder
+    Возвращает (путь или URL, размер); (None, 0) - источника нет
+    """
+    if is_object_ref(name):
+        store = get_object_store()
+        try:
+            bucket, key = parse_ref(name)
+        except ValueError:
+            return None, 0
+        size = store.head(key, bucket) if store else None
+        if size is None:
+            return None, 0
+        return store.presign_ref(name), size
+
+    path = os.path.join(folder, name)
+    if not os.path.isfile(path):
+        return None, 0
+    return path, os.path.getsize(path)
@@ -0,0 +1,89 @@
+"""
+Профили вывода монтажа (несколько форматов из одного декодирования)
+- Нормализация профилей: aspect, разрешение, битрейт, способ вписывания
+- Цепочка crop/scale/pad для ветки после split
+"""
+
+import os
+import re
+
+# Стандартные профили по соотношению сторон
+PRESET_PROFILES = {
+    '9:16': {'width': 1080, 'height': 1920, 'video_bitrate': '6M'},
+    '1:1': {'width': 1080, 'height': 1080, 'video_bitrate': '5M'},
+    '4:5': {'width': 1080, 'height': 1350, 'video_bitrate': '5M'},
+    '16:9': {'width': 1920, 'height': 1080, 'video_bitrate': '6M'},
+}
+
+FIT_MODES = {'crop', 'pad'}
+
+
+def normalize_profiles(raw_profiles):
+    """
+    Привести список профилей к единому виду
+    Элемент: '9:16' или {"aspect": "1:1", "width": 1080, "height": 1080,
+                         "video_bitrate": "5M", "fit": "crop", "name": "square"}
+    """
+    profiles = []
+    used_names = set()
+
+    if raw_profiles and not isinstance(raw_profiles, list):
+        raise ValueError('output_profiles must be a list')
+
+    for raw in raw_profiles or []:
+        if isinstance(raw, str):
+            raw = {'aspect': raw}
+        if not isinstance(raw, dict):
+            raise ValueError(f'Invalid profile: {raw!r}')
+
+        aspect = str(raw.get('aspect', '9:16'))
+        if not re.match(r'^\d+:\d+$', aspect):
+            raise ValueError(f'Invalid aspect: {aspect}')
+
+        preset = PRESET_PROFILES.get(aspect, {})
+        aw, ah = (int(x) for x in aspect.split(':'))
+        if not aw or not ah:
+            raise ValueError(f'Invalid aspect: {aspect}')
+        width = int(raw.get('width') or preset.get('width') or 1080)
+        height = int(raw.get('height') or preset.get('height') or round(width * ah / aw))
+        # libx264 требует чётные размеры
+        width, height = width - width % 2, height - height % 2
+        if width <= 0 or height <= 0:
+            raise ValueError(f'Invalid size for {aspect}: {width}x{height}')
+
+        fit = raw.get('fit', 'crop')
+        if fit not in FIT_MODES:
+            fit = 'crop'
+
+        name = re.sub(r'[^a-zA-Z0-9_-]', '_', str(raw.get('name') or aspect.replace(':', 'x')))
+        while name in used_names:
+            name = f'{name}_'
+        used_names.add(name)
+
+        profiles.append({
+            'name': name,
+            'aspect': aspect,
+            'width': width,
+            'height': height,
+            'video_bitrate': str(raw.get('video_bitrate') or preset.get('video_bitrate') or '5M'),
+            'audio_bitrate': str(raw.get('audio_bitrate') or '128k'),
+            'fit': fit
+        })
+
+    return profiles
+
+
+def profile_filter(profile):
+    """Цепочка фильтров ветки: вписать кадр в профиль (crop или pad)"""
+    w, h = profile['width'], profile['height']
+    if profile['fit'] == 'pad':
+        return (f'scale={w}:{h}:force_original_aspect_ratio=decrease,'
+                f'pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1')
+    return (f'scale={w}:{h}:force_original_aspect_ratio=increase,'
+            f'crop={w}:{h},setsar=1')
+
+
+def profile_output_path(base_path, profile):
+    """Путь выходного файла профиля рядом с базовым: <base>_<name>.mp4"""
+    root, ext = os.path.splitext(base_path)
+    return f"{root}_{profile['name']}{ext or '.mp4'}"
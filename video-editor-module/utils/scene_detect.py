@@ -0,0 +1,139 @@
+"""
+Автоматическое определение границ сцен (shot boundaries)
+- Один проход ffmpeg: уменьшенные grayscale кадры в pipe
+- Векторизованная оценка в NumPy: разница кадров + разница гистограмм
+- Кэш результата по хэшу содержимого шота
+"""
+
+import subprocess
+import logging
+
+import numpy as np
+
+from utils.media_cache import params_key, load_json, save_json
+from utils.content_store import content_id
+
+logger = logging.getLogger(__name__)
+
+# Размер кадра для анализа (достаточно для детекции склеек)
+ANALYSIS_WIDTH = 64
+ANALYSIS_HEIGHT = 36
+
+DEFAULT_SAMPLE_FPS = 10
+DEFAULT_THRESHOLD = 0.3
+DEFAULT_MIN_SCENE_LEN = 1.0  # секунды
+HISTOGRAM_BINS = 16
+
+
+def read_gray_frames(video_path, sample_fps=DEFAULT_SAMPLE_FPS,
+                     width=ANALYSIS_WIDTH, height=ANALYSIS_HEIGHT):
+    """Декодировать видео один раз и вернуть массив кадров (N, H, W) uint8"""
+    cmd = [
+        'ffmpeg', '-v', 'error', '-i', video_path,
+        '-an', '-sn',
+        '-vf', f'fps={sample_fps},scale={width}:{height},format=gray',
+        '-f', 'rawvideo', '-pix_fmt', 'gray',
+        'pipe:1'
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', 'replace')[:300])
+
+    frame_size = width * height
+    frame_count = len(result.stdout) // frame_size
+    frames = np.frombuffer(result.stdout[:frame_count * frame_size], dtype=np.uint8)
+    return frames.reshape(frame_count, height, width)
+
+
+def score_transitions(frames, bins=HISTOGRAM_BINS):
+    """
+    Оценка смены сцены между соседними кадрами (0..1)
+    Среднее из нормированной разницы пикселей и разницы гистограмм
+    """
+    n = len(frames)
+    if n < 2:
+        return np.zeros(0, dtype=np.float32)
+
+    flat = frames.reshape(n, -1)
+    pixels = flat.shape[1]
+
+    # Разница пикселей
+    pixel_diff = np.abs(np.diff(flat.astype(np.int16), axis=0)).mean(axis=1) / 255.0
+
+    # Гистограммы всех кадров за один bincount
+    shift = 8 - int(np.log2(bins))
+    binned = (flat >> shift).astype(np.int64) + (np.arange(n, dtype=np.int64) * bins)[:, None]
+    hist = np.bincount(binned.ravel(), minlength=n * bins).reshape(n, bins) / pixels
+    hist_diff = 0.5 * np.abs(np.diff(hist, axis=0)).sum(axis=1)
+
+    return ((pixel_diff + hist_diff) / 2.0).astype(np.float32)
+
+
+def pick_boundaries(scores, sample_fps, threshold=DEFAULT_THRESHOLD,
+                    min_scene_len=DEFAULT_MIN_SCENE_LEN):
+    """Выбрать границы: локальные максимумы выше порога с минимальной длиной сцены"""
+    if len(scores) == 0:
+        return []
+
+    # Адаптивный порог: не ниже заданного и заметно выше фона
+    adaptive = max(threshold, float(scores.mean() + 3 * scores.std()))
+
+    padded = np.concatenate(([-1.0], scores, [-1.0]))
+    is_peak = (scores >= padded[:-2]) & (scores > padded[2:])
+    candidates = np.nonzero(is_peak & (scores >= adaptive))[0]
+
+    # Сильные пики первыми, затем отбрасываем слишком близкие
+    min_gap = min_scene_len * sample_fps
+    chosen = []
+    for i in candidates[np.argsort(-scores[candidates])]:
+        if all(abs(int(i) - c) >= min_gap for c in chosen):
+            chosen.append(int(i))
+
+    # Граница между кадром i и i+1
+    return [
+        {'time': round((i + 1) / sample_fps, 2), 'score': round(float(scores[i]), 3)}
+        for i in sorted(chosen)
+    ]
+
+
+def detect_scenes(video_path, duration, cache_folder=None,
+                  sample_fps=DEFAULT_SAMPLE_FPS, threshold=DEFAULT_THRESHOLD,
+                  min_scene_len=DEFAULT_MIN_SCENE_LEN):
+    """
+    Предложить границы шотов внутри видео
+    Возвращает boundaries (время склеек) и segments (start_time/end_time)
+    """
+    cache_key = None
+    if cache_folder:
+        source_id = content_id(video_path, cache_folder)
+        cache_key = f"{source_id}_{params_key(sample_fps, threshold, min_scene_len)}"
+        cached = load_json(cache_folder, 'scenes', cache_key)
+        if cached is not None:
+            cached['cached'] = True
+            return cached
+
+    frames = read_gray_frames(video_path, sample_fps)
+    scores = score_transitions(frames)
+    boundaries = pick_boundaries(scores, sample_fps, threshold, min_scene_len)
+
+    end = duration or len(frames) / sample_fps
+    cut_times = [0.0] + [b['time'] for b in boundaries] + [round(end, 2)]
+    segments = [
+        {'start_time': cut_times[i], 'end_time': cut_times[i + 1]}
+        for i in range(len(cut_times) - 1)
+        if cut_times[i + 1] > cut_times[i]
+    ]
+
+    result = {
+        'boundaries': boundaries,
+        'segments': segments,
+        'frames_analyzed': int(len(frames)),
+        'sample_fps': sample_fps
+    }
+
+    if cache_key:
+        save_json(cache_folder, 'scenes', cache_key, result)
+
+    logger.info(f"Detected {len(boundaries)} scene boundaries in {video_path}")
+    result['cached'] = False
+    return result
@@ -0,0 +1,171 @@
+"""
+Временное рабочее пространство для промежуточных файлов задач
+(обрезанные шоты, concat-списки, субтитры, временные звуки)
+- Сначала tmpfs (/dev/shm), если ожидаемый объём помещается в бюджет памяти
+  и в свободное место tmpfs; иначе - папка на диске
+- Рабочее пространство - отдельная папка задачи, удаляется при выходе из with
+  (и при завершении процесса); папки упавших процессов удаляются при старте
+- fifo() - именованный канал внутри пространства: один ffmpeg пишет,
+  следующий этап читает, промежуточный файл не создаётся вовсе
+Имя папки: <хост>_<pid>_<задача>_<счётчик> - по нему определяется владелец
+"""
+
+import os
+import re
+import shutil
+import socket
+import atexit
+import logging
+import itertools
+import threading
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+TMPFS_ROOT = os.getenv('SCRATCH_TMPFS_DIR', '/dev/shm/video-editor-scratch')
+MEMORY_BUDGET = int(os.getenv('SCRATCH_MEMORY_BUDGET_MB', '1024')) * MB
+# Свободная память tmpfs, которую рабочие пространства не занимают
+TMPFS_MIN_FREE = 256 * MB
+
+
+def files_size(paths):
+    """Суммарный размер существующих файлов (оценка объёма промежуточных)"""
+    return sum(os.path.getsize(p) for p in paths if p and os.path.isfile(p))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Workspace:
+    """Папка промежуточных файлов одной задачи"""
+
+    def __init__(self, manager, path, on_tmpfs, reserved):
+        self.manager = manager
+        self.path = path
+        self.on_tmpfs = on_tmpfs
+        self.reserved = reserved
+        self.closed = False
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def fifo(self, name):
+        """Именованный канал для передачи потока между этапами (например, -f mpegts)"""
+        path = self.file(name)
+        os.mkfifo(path)
+        return path
+
+    def close(self):
+        self.manager._close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ScratchSpace:
+    """Выбор места (tmpfs / диск) и учёт бюджета памяти"""
+
+    def __init__(self, disk_root, tmpfs_root=TMPFS_ROOT, memory_budget=MEMORY_BUDGET):
+        self.disk_root = os.path.abspath(disk_root)
+        self.tmpfs_root = tmpfs_root
+        self.memory_budget = memory_budget
+        self.prefix = f'{socket.gethostname()}_{os.getpid()}_'
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._open = {}
+        self._in_memory = 0
+        os.makedirs(self.disk_root, exist_ok=True)
+        self.tmpfs_usable = self._prepare_tmpfs()
+        self.reap_stale()
+        atexit.register(self.close_all)
+
+    def _prepare_tmpfs(self):
+        if not self.tmpfs_root or self.memory_budget <= 0:
+            return False
+        try:
+            os.makedirs(self.tmpfs_root, exist_ok=True)
+            return os.access(self.tmpfs_root, os.W_OK)
+        except OSError as e:
+            logger.info(f"tmpfs scratch not available ({e}), using disk only")
+            return False
+
+    def _tmpfs_free(self):
+        statvfs = os.statvfs(self.tmpfs_root)
+        return statvfs.f_bavail * statvfs.f_frsize
+
+    def workspace(self, job_id, expected_size=0):
+        """Новое рабочее пространство задачи (в tmpfs, если помещается)"""
+        name = f"{self.prefix}{re.sub(r'[^a-zA-Z0-9_-]', '_', job_id)}_{next(self._counter)}"
+        with self._lock:
+            on_tmpfs = (
+                self.tmpfs_usable
+                and self._in_memory + expected_size <= self.memory_budget
+                and self._tmpfs_free() - expected_size >= TMPFS_MIN_FREE
+            )
+            if on_tmpfs:
+                self._in_memory += expected_size
+        path = os.path.join(self.tmpfs_root if on_tmpfs else self.disk_root, name)
+        os.makedirs(path)
+        workspace = Workspace(self, path, on_tmpfs, expected_size if on_tmpfs else 0)
+        with self._lock:
+            self._open[path] = workspace
+        logger.info(f"Scratch {name}: {'tmpfs' if on_tmpfs else 'disk'}, "
+                    f"expected {expected_size / MB:.1f} MB")
+        return workspace
+
+    def _close(self, workspace):
+        with self._lock:
+            if workspace.closed:
+                return
+            workspace.closed = True
+            self._open.pop(workspace.path, None)
+            self._in_memory -= workspace.reserved
+        shutil.rmtree(workspace.path, ignore_errors=True)
+
+    def close_all(self):
+        for workspace in list(self._open.values()):
+            workspace.close()
+
+    def reap_stale(self):
+        """Удалить пространства процессов этого хоста, которых уже нет. Возвращает число"""
+        host_prefix = f'{socket.gethostname()}_'
+        reaped = 0
+        roots = [self.disk_root] + ([self.tmpfs_root] if self.tmpfs_usable else [])
+        for root in roots:
+            for name in os.listdir(root):
+                if not name.startswith(host_prefix):
+                    continue
+                pid = name[len(host_prefix):].split('_', 1)[0]
+                if not pid.isdigit():
+                    continue
+                pid = int(pid)
+                if pid == os.getpid() or _pid_alive(pid):
+                    continue
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+                reaped += 1
+        if reaped:
+            logger.info(f"Removed {reaped} scratch workspace(s) left by dead processes")
+        return reaped
+
+
+_spaces = {}
+_spaces_lock = threading.Lock()
+
+
+def get_scratch_space(disk_root):
+    """Менеджер процесса для дисковой папки disk_root"""
+    key = os.path.abspath(disk_root)
+    with _spaces_lock:
+        if key not in _spaces:
+            _spaces[key] = ScratchSpace(key)
+        return _spaces[key]
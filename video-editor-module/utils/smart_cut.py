@@ -0,0 +1,235 @@
+"""
+Smart render: покадрово точная обрезка почти со скоростью копирования
+- Перекодируются только неполные GOP в начале и конце диапазона
+- Всё между первым и последним ключевым кадром копируется (-c copy)
+- Куски пишутся в MPEG-TS (SPS/PPS в потоке) и склеиваются concat demuxer
+- Параметры энкодера (профиль, уровень, pix_fmt, fps, timescale) берутся из исходника
+- Аудио режется отдельно по точным границам (дёшево) и мультиплексируется в конце
+Для не-H.264 исходников или диапазона внутри одного GOP - обычное перекодирование
+"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import threading
+
+from utils.spawn_server import run as run_command
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRESET = 'fast'
+DEFAULT_AUDIO_BITRATE = '192k'
+
+H264_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+}
+
+# Ключевые кадры по (путь, mtime, размер) - файл нарезается на десятки кусков
+_keyframe_cache = {}
+_keyframe_cache_lock = threading.Lock()
+KEYFRAME_CACHE_SIZE = 64
+
+
+def _ffprobe_json(args):
+    result = run_command(['ffprobe', '-v', 'error'] + args + ['-of', 'json'],
+                         capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr[:300]}")
+    return json.loads(result.stdout)
+
+
+def get_keyframes(path):
+    """Отсортированные времена ключевых кадров видео (по пакетам, без декодирования)"""
+    if os.path.exists(path):
+        stat = os.stat(path)
+        cache_key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    else:
+        # URL (presigned): подпись в query меняется, объект - нет
+        cache_key = (path.split('?', 1)[0],)
+    with _keyframe_cache_lock:
+        if cache_key in _keyframe_cache:
+            return _keyframe_cache[cache_key]
+
+    data = _ffprobe_json([
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        path
+    ])
+    keyframes = sorted(
+        float(p['pts_time']) for p in data.get('packets', [])
+        if 'K' in p.get('flags', '') and p.get('pts_time') not in (None, 'N/A')
+    )
+
+    with _keyframe_cache_lock:
+        if len(_keyframe_cache) >= KEYFRAME_CACHE_SIZE:
+            _keyframe_cache.clear()
+        _keyframe_cache[cache_key] = keyframes
+    return keyframes
+
+
+def get_stream_params(path):
+    """Параметры видео и формата для подбора совместимого энкодера"""
+    data = _ffprobe_json([
+        '-select_streams', 'v:0',
+        '-show_entries',
+        'stream=codec_name,profile,level,pix_fmt,width,height,r_frame_rate,time_base'
+        ':format=duration',
+        path
+    ])
+    stream = data['streams'][0]
+    num, _, den = stream.get('r_frame_rate', '30/1').partition('/')
+    fps = float(num) / float(den or 1) if float(den or 1) else 30.0
+    _, _, timescale = stream.get('time_base', '1/15360').partition('/')
+    return {
+        'codec': stream.get('codec_name'),
+        'profile': stream.get('profile'),
+        'level': stream.get('level'),
+        'pix_fmt': stream.get('pix_fmt', 'yuv420p'),
+        'width': stream.get('width'),
+        'height': stream.get('height'),
+        'fps': fps,
+        'frame_rate': stream.get('r_frame_rate', '30/1'),
+        'timescale': timescale or '15360',
+        'duration': float(data.get('format', {}).get('duration') or 0)
+    }
+
+
+def _encoder_args(params, preset):
+    """libx264 с параметрами исходника - перекодированные края стыкуются с копией"""
+    args = [
+        '-c:v', 'libx264', '-preset', preset,
+        '-pix_fmt', params['pix_fmt'],
+        '-r', params['frame_rate'],
+    ]
+    profile = H264_PROFILES.get(params['profile'])
+    if profile:
+        args.extend(['-profile:v', profile])
+    if isinstance(params['level'], int) and params['level'] > 0:
+        args.extend(['-level', f"{params['level'] / 10:.1f}"])
+    return args
+
+
+def _run(cmd, what):
+    result = run_command(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{what} failed: {result.stderr[:300]}")
+
+
+def _detach(output_path):
+    """
+    Убрать старый результат перед записью: он может быть жёсткой ссылкой
+    на мемоизированную нарезку, и ffmpeg -y перезаписал бы общий inode
+    """
+    if os.path.lexists(output_path):
+        os.unlink(output_path)
+
+
+def reencode_cut(source_path, start, end, output_path, preset=DEFAULT_PRESET,
+                 audio_bitrate=DEFAULT_AUDIO_BITRATE):
+    """Обычная точная обрезка с полным перекодированием"""
+    _detach(output_path)
+    _run([
+        'ffmpeg', '-y', '-ss', f'{start:.6f}', '-i', source_path,
+        '-t', f'{end - start:.6f}',
+        '-c:v', 'libx264', '-preset', preset,
+        '-c:a', 'aac', '-b:a', audio_bitrate,
+        '-movflags', '+faststart',
+        output_path
+    ], 'Re-encode cut')
+    return {'mode': 'reencode', 'copied_duration': 0.0, 'encoded_duration': end - start}
+
+
+def smart_cut(source_path, start, end, output_path, preset=DEFAULT_PRESET,
+              audio_bitrate=DEFAULT_AUDIO_BITRATE):
+    """
+    Вырезать [start, end) из source_path в output_path покадрово точно
+    end=None - до конца файла
+    Возвращает {'mode': 'smart' | 'reencode', 'copied_duration', 'encoded_duration'}
+    """
+    params = get_stream_params(source_path)
+    if end is None or end > params['duration'] > 0:
+        end = params['duration']
+    start = max(0.0, start)
+    if end <= start:
+        raise ValueError(f'Empty range: {start}-{end}')
+
+    if params['codec'] != 'h264':
+        logger.info(f"Smart cut: codec {params['codec']} not supported, re-encoding")
+        return reencode_cut(source_path, start, end, output_path, preset, audio_bitrate)
+
+    frame = 1.0 / params['fps']
+    keyframes = get_keyframes(source_path)
+    # Первый ключевой кадр не раньше start и последний не позже end
+    k_in = next((k for k in keyframes if k >= start - frame / 2), None)
+    k_out = next((k for k in reversed(keyframes) if k <= end + frame / 2), None)
+
+    if k_in is None or k_out is None or k_out - k_in < frame:
+        return reencode_cut(source_path, start, end, output_path, preset, audio_bitrate)
+
+    encoder = _encoder_args(params, preset)
+    _detach(output_path)
+    work_dir = tempfile.mkdtemp(prefix='smartcut_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        pieces = []
+        encoded = 0.0
+
+        # Начало: неполный GOP [start, k_in)
+        if k_in - start >= frame / 2:
+            head = os.path.join(work_dir, 'head.ts')
+            _run(['ffmpeg', '-y', '-ss', f'{start:.6f}', '-i', source_path,
+                  '-t', f'{k_in - start:.6f}', '-an'] + encoder + ['-f', 'mpegts', head],
+                 'Head encode')
+            pieces.append(head)
+            encoded += k_in - start
+
+        # Середина: целые GOP без перекодирования
+        middle = os.path.join(work_dir, 'middle.ts')
+        _run(['ffmpeg', '-y', '-ss', f'{k_in:.6f}', '-i', source_path,
+              '-t', f'{k_out - k_in - frame / 2:.6f}', '-an',
+              '-c:v', 'copy', '-bsf:v', 'h264_mp4toannexb',
+              '-avoid_negative_ts', 'make_zero', '-f', 'mpegts', middle],
+             'Middle copy')
+        pieces.append(middle)
+
+        # Конец: неполный GOP [k_out, end)
+        if end - k_out >= frame / 2:
+            tail = os.path.join(work_dir, 'tail.ts')
+            _run(['ffmpeg', '-y', '-ss', f'{k_out:.6f}', '-i', source_path,
+                  '-t', f'{end - k_out:.6f}', '-an'] + encoder + ['-f', 'mpegts', tail],
+                 'Tail encode')
+            pieces.append(tail)
+            encoded += end - k_out
+
+        concat_file = os.path.join(work_dir, 'concat.txt')
+        with open(concat_file, 'w') as f:
+            for piece in pieces:
+                f.write(f"file '{piece}'\n")
+
+        # Склейка видео + точно обрезанное аудио исходника
+        _run([
+            'ffmpeg', '-y',
+            '-f', 'concat', '-safe', '0', '-i', concat_file,
+            '-ss', f'{start:.6f}', '-t', f'{end - start:.6f}', '-i', source_path,
+            '-map', '0:v', '-map', '1:a?',
+            '-c:v', 'copy', '-c:a', 'aac', '-b:a', audio_bitrate,
+            '-video_track_timescale', params['timescale'],
+            '-movflags', '+faststart',
+            output_path
+        ], 'Stitch')
+
+        logger.info(
+            f"Smart cut {os.path.basename(source_path)} {start:.2f}-{end:.2f}s: "
+            f"copied {k_out - k_in:.2f}s, encoded {encoded:.2f}s"
+        )
+        return {'mode': 'smart', 'copied_duration': round(k_out - k_in, 3),
+                'encoded_duration': round(encoded, 3)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
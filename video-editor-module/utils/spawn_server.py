@@ -0,0 +1,286 @@
+"""
+Лёгкий процесс-запускатель для ffmpeg/ffprobe
+- Стартует рано (пока процесс Flask маленький) отдельным интерпретатором
+- Принимает команды по pipe (JSON строки), запускает и контролирует дочерние процессы
+- Возвращает прогресс (time= из stderr ffmpeg) и код завершения
+Стоимость запуска не зависит от размера веб-воркера: fork делает маленький процесс
+
+run() - замена subprocess.run(cmd, capture_output=True, ...): тот же результат
+(CompletedProcess), те же TimeoutExpired / CalledProcessError.
+Если запускатель недоступен - выполняется обычный subprocess.run.
+
+Файл не импортирует ничего из проекта: сервер запускается как отдельный скрипт.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import base64
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+SPAWN_SERVER_ENABLED = os.getenv('SPAWN_SERVER', '1') != '0'
+PROGRESS_INTERVAL_SECONDS = 0.5
+READ_CHUNK_SIZE = 64 * 1024
+
+PROGRESS_RE = re.compile(rb'time=(\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+# id из повреждённой строки протокола - чтобы ответить ошибкой именно этому запросу
+ID_RE = re.compile(rb'"id":\s*(\d+)')
+
+
+# ==================== СЕРВЕР (отдельный процесс) ====================
+
+def _serve():
+    """Цикл запускателя: stdin - запросы, stdout - события"""
+    out_lock = threading.Lock()
+    procs = {}
+    procs_lock = threading.Lock()
+
+    def send(message):
+        data = (json.dumps(message) + '\n').encode('utf-8')
+        with out_lock:
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+
+    def run_job(request):
+        job_id = request['id']
+        try:
+            # stdin запускателя - канал команд: дети не должны его наследовать,
+            # иначе ffmpeg читает из него (q/?) и съедает запросы из очереди
+            proc = subprocess.Popen(
+                request['cmd'],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=request.get('cwd'),
+                env=request.get('env')
+            )
+        except Exception as e:
+            send({'id': job_id, 'event': 'error', 'error': str(e),
+                  'type': type(e).__name__})
+            return
+
+        with procs_lock:
+            procs[job_id] = proc
+
+        stdout_chunks = []
+
+        def read_stdout():
+            for chunk in iter(lambda: proc.stdout.read(READ_CHUNK_SIZE), b''):
+                stdout_chunks.append(chunk)
+
+        reader = threading.Thread(target=read_stdout, daemon=True)
+        reader.start()
+
+        stderr_chunks = []
+        last_progress = 0.0
+        for chunk in iter(lambda: proc.stderr.read1(READ_CHUNK_SIZE), b''):
+            stderr_chunks.append(chunk)
+            if request.get('progress'):
+                matches = PROGRESS_RE.findall(chunk)
+                now = time.monotonic()
+                if matches and now - last_progress >= PROGRESS_INTERVAL_SECONDS:
+                    h, m, s = matches[-1]
+                    send({'id': job_id, 'event': 'progress',
+                          'time': int(h) * 3600 + int(m) * 60 + float(s)})
+                    last_progress = now
+
+        returncode = proc.wait()
+        reader.join()
+        with procs_lock:
+            procs.pop(job_id, None)
+
+        send({
+            'id': job_id,
+            'event': 'exit',
+            'returncode': returncode,
+            'stdout': base64.b64encode(b''.join(stdout_chunks)).decode('ascii'),
+            'stderr': base64.b64encode(b''.join(stderr_chunks)).decode('ascii')
+        })
+
+    for line in sys.stdin.buffer:
+        try:
+            request = json.loads(line)
+            if request.get('op') == 'run' and not isinstance(request.get('cmd'), list):
+                raise ValueError('no command')
+        except (ValueError, AttributeError) as e:
+            logger.error(f"Bad spawn request ({e}): {line[:200]!r}")
+            match = ID_RE.search(line)
+            if match:
+                send({'id': int(match.group(1)), 'event': 'error',
+                      'error': f'Bad spawn request: {e}', 'type': 'RuntimeError'})
+            continue
+        if request.get('op') == 'run':
+            threading.Thread(target=run_job, args=(request,), daemon=True).start()
+        elif request.get('op') == 'kill':
+            with procs_lock:
+                proc = procs.get(request['id'])
+            if proc:
+                proc.kill()
+
+    # stdin закрыт - родитель завершился: гасим всех детей
+    with procs_lock:
+        for proc in procs.values():
+            proc.kill()
+
+
+# ==================== КЛИЕНТ (процесс Flask) ====================
+
+class SpawnClient:
+    """Соединение с запускателем (по одному на PID процесса)"""
+
+    def __init__(self):
+        self._proc = None
+        self._pid = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._counter = 0
+
+    @property
+    def alive(self):
+        return (self._proc is not None and self._proc.poll() is None
+                and self._pid == os.getpid())
+
+    def start(self):
+        with self._lock:
+            if self.alive:
+                return
+            # Новый процесс после fork (gunicorn) или упавший сервер - свой запускатель
+            self._pending = {}
+            self._proc = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                bufsize=0,
+                close_fds=True
+            )
+            self._pid = os.getpid()
+            threading.Thread(target=self._read_events, args=(self._proc,), daemon=True).start()
+            logger.info(f"Spawn server started: pid={self._proc.pid}")
+
+    def _read_events(self, proc):
+        for line in proc.stdout:
+            try:
+                message = json.loads(line)
+                message['event']
+            except (ValueError, TypeError, KeyError) as e:
+                logger.error(f"Bad spawn server event ({e}): {line[:200]!r}")
+                match = ID_RE.search(line)
+                if match:
+                    with self._lock:
+                        pending = self._pending.get(int(match.group(1)))
+                    if pending:
+                        pending['result'] = {'event': 'error', 'type': 'RuntimeError',
+                                             'error': 'Unreadable spawn server response'}
+                        pending['event'].set()
+                continue
+            with self._lock:
+                pending = self._pending.get(message.get('id'))
+            if not pending:
+                continue
+            if message['event'] == 'progress':
+                if pending['on_progress']:
+                    try:
+                        pending['on_progress'](message['time'])
+                    except Exception as e:
+                        logger.warning(f"Progress callback error: {e}")
+            else:
+                pending['result'] = message
+                pending['event'].set()
+
+        # Сервер завершился - ожидающие запросы получают ошибку
+        with self._lock:
+            for pending in self._pending.values():
+                pending['result'] = {'event': 'error', 'error': 'Spawn server exited',
+                                     'type': 'RuntimeError'}
+                pending['event'].set()
+
+    def _send(self, message):
+        data = (json.dumps(message) + '\n').encode('utf-8')
+        with self._write_lock:
+            self._proc.stdin.write(data)
+            self._proc.stdin.flush()
+
+    def run(self, cmd, timeout=None, text=False, check=False, on_progress=None,
+            cwd=None, env=None):
+        self.start()
+        with self._lock:
+            self._counter += 1
+            job_id = self._counter
+            pending = {'event': threading.Event(), 'result': None, 'on_progress': on_progress}
+            self._pending[job_id] = pending
+
+        try:
+            self._send({
+                'op': 'run', 'id': job_id, 'cmd': [str(c) for c in cmd],
+                'cwd': cwd, 'env': env, 'progress': on_progress is not None
+            })
+            if not pending['event'].wait(timeout):
+                self._send({'op': 'kill', 'id': job_id})
+                raise subprocess.TimeoutExpired(cmd, timeout)
+        finally:
+            with self._lock:
+                self._pending.pop(job_id, None)
+
+        result = pending['result']
+        if result['event'] == 'error':
+            if result.get('type') == 'FileNotFoundError':
+                raise FileNotFoundError(result['error'])
+            raise RuntimeError(result['error'])
+
+        stdout = base64.b64decode(result['stdout'])
+        stderr = base64.b64decode(result['stderr'])
+        if text:
+            stdout = stdout.decode('utf-8', 'replace')
+            stderr = stderr.decode('utf-8', 'replace')
+
+        completed = subprocess.CompletedProcess(cmd, result['returncode'], stdout, stderr)
+        if check:
+            completed.check_returncode()
+        return completed
+
+
+_client = SpawnClient()
+
+
+def start_spawn_server():
+    """Запустить запускатель заранее (вызывать как можно раньше при старте приложения)"""
+    if not SPAWN_SERVER_ENABLED:
+        return False
+    try:
+        _client.start()
+        return True
+    except Exception as e:
+        logger.warning(f"Spawn server not available: {e}")
+        return False
+
+
+def run(cmd, capture_output=True, text=False, timeout=None, check=False,
+        on_progress=None, cwd=None, env=None):
+    """
+    Выполнить команду через запускатель (замена subprocess.run с capture_output=True)
+    on_progress(seconds) - вызывается по мере обработки (строки time= ffmpeg)
+    """
+    if SPAWN_SERVER_ENABLED:
+        try:
+            return _client.run(cmd, timeout=timeout, text=text, check=check,
+                               on_progress=on_progress, cwd=cwd, env=env)
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError, FileNotFoundError):
+            raise
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"Spawn server failed ({e}), running directly")
+
+    return subprocess.run(cmd, capture_output=True, text=text, timeout=timeout,
+                          check=check, cwd=cwd, env=env)
+
+
+if __name__ == '__main__':
+    # stderr запускателя - общий с родителем: сообщения попадают в его лог
+    logging.basicConfig(level=logging.INFO, format='spawn-server: %(levelname)s %(message)s')
+    _serve()
@@ -0,0 +1,177 @@
+"""
+Учёт файлов в папке результатов (outputs) без обхода диска на каждый запрос
+- Индекс (SQLite в кэше): имя файла, размер, время изменения
+- Модули, пишущие результаты, отмечают файлы через record()
+- Фоновый уборщик раз в interval секунд удаляет старые файлы по индексу
+  и сверяет индекс с диском (файлы, записанные в обход record())
+- /storage-info читает итоги и страницы списка из индекса
+- Тот же проход удаляет объекты хранилища по содержимому, на которые
+  после удаления файлов не осталось ссылок (content_cache)
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from utils.content_store import prune_orphans
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'storage_index.db'
+SWEEP_INTERVAL = int(os.getenv('STORAGE_SWEEP_INTERVAL', '3600'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+"""
+
+
+class StorageIndex:
+    """Индекс файлов одной папки результатов"""
+
+    def __init__(self, output_folder, cache_folder):
+        self.output_folder = os.path.abspath(output_folder)
+        self.db_path = os.path.join(os.path.abspath(cache_folder), INDEX_FILENAME)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._local = threading.local()
+        self._sweep_lock = threading.Lock()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    # ---------- запись ----------
+
+    def record(self, path):
+        """Отметить записанный (или перезаписанный) файл результата"""
+        path = os.path.abspath(path)
+        if os.path.dirname(path) != self.output_folder:
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        self._connect().execute(
+            'INSERT OR REPLACE INTO files (filename, size, mtime) VALUES (?, ?, ?)',
+            (os.path.basename(path), stat.st_size, stat.st_mtime)
+        )
+
+    def forget(self, filename):
+        self._connect().execute('DELETE FROM files WHERE filename = ?', (filename,))
+
+    def reconcile(self):
+        """Сверить индекс с диском. Возвращает (добавлено/обновлено, удалено)"""
+        conn = self._connect()
+        known = {row['filename']: (row['size'], row['mtime'])
+                 for row in conn.execute('SELECT filename, size, mtime FROM files')}
+        on_disk = set()
+        updated = 0
+        with os.scandir(self.output_folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                on_disk.add(entry.name)
+                if known.get(entry.name) != (stat.st_size, stat.st_mtime):
+                    conn.execute(
+                        'INSERT OR REPLACE INTO files (filename, size, mtime) VALUES (?, ?, ?)',
+                        (entry.name, stat.st_size, stat.st_mtime)
+                    )
+                    updated += 1
+        removed = [name for name in known if name not in on_disk]
+        conn.executemany('DELETE FROM files WHERE filename = ?', [(name,) for name in removed])
+        return updated, len(removed)
+
+    # ---------- очистка ----------
+
+    def sweep(self, max_age_days):
+        """Удалить файлы старше max_age_days. Возвращает число удалённых"""
+        cutoff = time.time() - max_age_days * 86400
+        deleted = 0
+        with self._sweep_lock:
+            rows = self._connect().execute(
+                'SELECT filename FROM files WHERE mtime < ?', (cutoff,)
+            ).fetchall()
+            for row in rows:
+                path = os.path.join(self.output_folder, row['filename'])
+                try:
+                    # Файл мог быть перезаписан после отметки в индексе
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        deleted += 1
+                        logger.info(f"Deleted old file: {row['filename']}")
+                    else:
+                        self.record(path)
+                        continue
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Could not delete {row['filename']}: {e}")
+                    continue
+                self.forget(row['filename'])
+        if deleted:
+            logger.info(f"Cleaned up {deleted} old files")
+        return deleted
+
+    # ---------- чтение ----------
+
+    def totals(self):
+        row = self._connect().execute(
+            'SELECT COUNT(*) AS files, COALESCE(SUM(size), 0) AS size FROM files'
+        ).fetchone()
+        return row['files'], row['size']
+
+    def page(self, offset=0, limit=100):
+        """Файлы, новые первыми"""
+        rows = self._connect().execute(
+            'SELECT filename, size, mtime FROM files ORDER BY mtime DESC LIMIT ? OFFSET ?',
+            (limit, offset)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def start_storage_sweeper(index, max_age_days, interval=SWEEP_INTERVAL, content_cache=None):
+    """
+    Фоновый уборщик: сверка индекса с диском и удаление старых файлов
+    content_cache - папка кэша с хранилищем по содержимому (очистка объектов без ссылок)
+    """
+    def loop():
+        while True:
+            try:
+                index.reconcile()
+                index.sweep(max_age_days)
+                if content_cache:
+                    prune_orphans(content_cache)
+            except Exception as e:
+                logger.warning(f"Storage sweep failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='storage-sweeper')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_storage_index(output_folder, cache_folder):
+    """Индекс процесса для папки результатов"""
+    key = os.path.abspath(output_folder)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = StorageIndex(output_folder, cache_folder)
+        return _indexes[key]
@@ -0,0 +1,173 @@
+"""
+Субтитры для монтажа
+- Парсинг SRT / VTT в список реплик
+- Сдвиг тайминга под порядок шотов в варианте
+- Конвертация в стилизованный ASS для прожига (фильтр ass)
+- Запись SRT / VTT / JSON из сегментов транскрипции
+"""
+
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_RE = re.compile(
+    r'(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{1,3})\s*-->\s*(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{1,3})'
+)
+
+DEFAULT_STYLE = {
+    'font': 'Arial',
+    'font_size': 64,
+    'primary_color': '&H00FFFFFF',
+    'outline_color': '&H00000000',
+    'outline': 4,
+    'shadow': 0,
+    'bold': True,
+    'alignment': 2,  # снизу по центру
+    'margin_v': 220
+}
+
+
+def _to_seconds(hours, minutes, seconds, millis):
+    return (int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+            + int(millis.ljust(3, '0')) / 1000.0)
+
+
+def parse_subtitles(content):
+    """Разобрать SRT или VTT -> [{'start': float, 'end': float, 'text': str}]"""
+    cues = []
+    blocks = re.split(r'\r?\n\s*\r?\n', content.replace('\ufeff', '').strip())
+    for block in blocks:
+        lines = block.splitlines()
+        for i, line in enumerate(lines):
+            match = TIMESTAMP_RE.search(line)
+            if match:
+                g = match.groups()
+                text = '\n'.join(l.strip() for l in lines[i + 1:] if l.strip())
+                if text:
+                    cues.append({
+                        'start': _to_seconds(*g[0:4]),
+                        'end': _to_seconds(*g[4:8]),
+                        'text': re.sub(r'<[^>]+>', '', text)
+                    })
+                break
+    return cues
+
+
+def load_subtitles(path):
+    """Прочитать файл субтитров (SRT или VTT)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_subtitles(f.read())
+
+
+def shift_cues(cues, offset, clip_start=0.0, clip_end=None):
+    """
+    Перенести реплики фрагмента [clip_start, clip_end] исходника
+    в позицию offset на таймлайне монтажа
+    """
+    shifted = []
+    for cue in cues:
+        start = max(cue['start'], clip_start)
+        end = cue['end'] if clip_end is None else min(cue['end'], clip_end)
+        if end <= start:
+            continue
+        shifted.append({
+            'start': start - clip_start + offset,
+            'end': end - clip_start + offset,
+            'text': cue['text']
+        })
+    return shifted
+
+
+def _ass_time(seconds):
+    centis = int(round(max(0.0, seconds) * 100))
+    hours, centis = divmod(centis, 360000)
+    minutes, centis = divmod(centis, 6000)
+    secs, centis = divmod(centis, 100)
+    return f'{hours}:{minutes:02d}:{secs:02d}.{centis:02d}'
+
+
+def _ass_text(text):
+    return text.replace('\\', '\\\\').replace('{', '(').replace('}', ')').replace('\n', '\\N')
+
+
+def cues_to_ass(cues, width=1080, height=1920, style=None):
+    """Собрать ASS документ со стилем Default"""
+    st = dict(DEFAULT_STYLE)
+    st.update(style or {})
+
+    header = [
+        '[Script Info]',
+        'ScriptType: v4.00+',
+        f'PlayResX: {int(width)}',
+        f'PlayResY: {int(height)}',
+        'WrapStyle: 0',
+        'ScaledBorderAndShadow: yes',
+        '',
+        '[V4+ Styles]',
+        'Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, '
+        'BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, '
+        'BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding',
+        f"Style: Default,{st['font']},{st['font_size']},{st['primary_color']},&H000000FF,"
+        f"{st['outline_color']},&H64000000,{-1 if st['bold'] else 0},0,0,0,100,100,0,0,"
+        f"1,{st['outline']},{st['shadow']},{st['alignment']},60,60,{st['margin_v']},1",
+        '',
+        '[Events]',
+        'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text'
+    ]
+
+    events = [
+        f"Dialogue: 0,{_ass_time(c['start'])},{_ass_time(c['end'])},Default,,0,0,0,,{_ass_text(c['text'])}"
+        for c in sorted(cues, key=lambda c: c['start'])
+    ]
+    return '\n'.join(header + events) + '\n'
+
+
+def write_ass(path, cues, width=1080, height=1920, style=None):
+    """Записать ASS файл и вернуть путь"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(cues_to_ass(cues, width, height, style))
+    return path
+
+
+def ass_filter(path):
+    """Фильтр ffmpeg для прожига ASS (с экранированием пути)"""
+    escaped = path.replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
+    return f"ass='{escaped}'"
+
+
+def _srt_time(seconds, separator=','):
+    millis = int(round(max(0.0, seconds) * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f'{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}'
+
+
+def cues_to_srt(cues):
+    """Собрать SRT из реплик/сегментов"""
+    blocks = [
+        f"{i}\n{_srt_time(c['start'])} --> {_srt_time(c['end'])}\n{c['text'].strip()}\n"
+        for i, c in enumerate(cues, 1)
+    ]
+    return '\n'.join(blocks)
+
+
+def cues_to_vtt(cues):
+    """Собрать WebVTT из реплик/сегментов"""
+    blocks = [
+        f"{_srt_time(c['start'], '.')} --> {_srt_time(c['end'], '.')}\n{c['text'].strip()}\n"
+        for c in cues
+    ]
+    return 'WEBVTT\n\n' + '\n'.join(blocks)
+
+
+def render_transcript(transcript, subtitle_format='srt'):
+    """Текст субтитров в нужном формате из транскрипции {'segments': [...]}"""
+    segments = transcript.get('segments', [])
+    if subtitle_format == 'vtt':
+        return cues_to_vtt(segments)
+    if subtitle_format == 'json':
+        return json.dumps(transcript, ensure_ascii=False, indent=2)
+    return cues_to_srt(segments)
@@ -0,0 +1,263 @@
+"""
+Двухуровневое хранение папок результатов: локальный диск + объектное хранилище
+- Индекс папок (SQLite в кэше): корень, размер, последнее обращение, состояние
+- Когда диск заполнен выше верхней отметки - самые давно не открывавшиеся папки
+  уходят в хранилище, пока заполнение не опустится ниже нижней отметки
+- Вместо файлов в папке остаётся манифест .evicted.json (имена, размеры, ключи)
+- Папка восстанавливается при первом обращении (ensure_local)
+Ключи объектов: <prefix>/<корень>/<папка>/<файл> - совпадают с s3_url у нарезки
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'storage_tiers.db'
+MANIFEST_NAME = '.evicted.json'
+HIGH_WATERMARK = float(os.getenv('STORAGE_HIGH_WATERMARK', '0.85'))
+LOW_WATERMARK = float(os.getenv('STORAGE_LOW_WATERMARK', '0.75'))
+# Свежие папки не выселяются (могут ещё дописываться)
+MIN_IDLE_SECONDS = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER DEFAULT 0,
+    files INTEGER DEFAULT 0,
+    state TEXT DEFAULT 'local',
+    last_access REAL,
+    evicted_at REAL
+);
+CREATE INDEX IF NOT EXISTS folders_lru ON folders (state, last_access);
+"""
+
+
+def manifest_path(folder):
+    return os.path.join(folder, MANIFEST_NAME)
+
+
+def is_evicted(folder):
+    return os.path.exists(manifest_path(folder))
+
+
+def read_manifest(folder):
+    with open(manifest_path(folder), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def folder_stats(folder):
+    """(размер в байтах, число файлов) без манифеста"""
+    size = 0
+    count = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name != MANIFEST_NAME and os.path.isfile(path):
+            size += os.path.getsize(path)
+            count += 1
+    return size, count
+
+
+class TieredStorage:
+    """Менеджер выселения и восстановления папок"""
+
+    def __init__(self, roots, cache_folder, store, prefix='outputs',
+                 high_watermark=HIGH_WATERMARK, low_watermark=LOW_WATERMARK):
+        self.roots = {name: os.path.abspath(path) for name, path in roots.items()}
+        self.store = store
+        self.prefix = prefix.strip('/')
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.db_path = os.path.join(os.path.abspath(cache_folder), INDEX_FILENAME)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._local = threading.local()
+        self._folder_locks = {}
+        self._locks_lock = threading.Lock()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _lock(self, folder):
+        with self._locks_lock:
+            return self._folder_locks.setdefault(folder, threading.Lock())
+
+    def _root_of(self, folder):
+        parent = os.path.dirname(os.path.abspath(folder))
+        for name, path in self.roots.items():
+            if path == parent:
+                return name
+        return None
+
+    def object_key(self, root, folder_name, filename):
+        return f'{self.prefix}/{root}/{folder_name}/{filename}'
+
+    # ---------- индекс ----------
+
+    def touch(self, folder):
+        """Отметить обращение к папке (и зарегистрировать её в индексе)"""
+        folder = os.path.abspath(folder)
+        root = self._root_of(folder)
+        if root is None or not os.path.isdir(folder):
+            return
+        self._connect().execute(
+            'INSERT INTO folders (path, root, name, state, last_access) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(path) DO UPDATE SET last_access = excluded.last_access',
+            (folder, root, os.path.basename(folder),
+             'evicted' if is_evicted(folder) else 'local', time.time())
+        )
+
+    def scan(self):
+        """Синхронизировать индекс с диском: новые папки, размеры, удалённые"""
+        conn = self._connect()
+        known = set()
+        for root, base in self.roots.items():
+            if not os.path.isdir(base):
+                continue
+            for name in os.listdir(base):
+                folder = os.path.join(base, name)
+                if not os.path.isdir(folder):
+                    continue
+                known.add(folder)
+                evicted = is_evicted(folder)
+                if evicted:
+                    manifest = read_manifest(folder)
+                    size = sum(f['size'] for f in manifest['files'])
+                    count = len(manifest['files'])
+                else:
+                    size, count = folder_stats(folder)
+                conn.execute(
+                    'INSERT INTO folders (path, root, name, size, files, state, last_access) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET '
+                    'size = excluded.size, files = excluded.files, state = excluded.state',
+                    (folder, root, name, size, count, 'evicted' if evicted else 'local',
+                     os.path.getmtime(folder))
+                )
+        for row in conn.execute('SELECT path FROM folders').fetchall():
+            if row['path'] not in known:
+                conn.execute('DELETE FROM folders WHERE path = ?', (row['path'],))
+
+    def disk_usage(self):
+        """Доля занятого места на диске с папками результатов"""
+        usage = shutil.disk_usage(next(iter(self.roots.values())))
+        return usage.used / usage.total if usage.total else 0.0
+
+    # ---------- выселение / восстановление ----------
+
+    def evict(self, folder):
+        """Загрузить файлы папки в хранилище и заменить их манифестом"""
+        folder = os.path.abspath(folder)
+        root = self._root_of(folder)
+        name = os.path.basename(folder)
+        with self._lock(folder):
+            if is_evicted(folder) or not os.path.isdir(folder):
+                return 0
+            files = []
+            for filename in sorted(os.listdir(folder)):
+                path = os.path.join(folder, filename)
+                if not os.path.isfile(path):
+                    continue
+                key = self.object_key(root, name, filename)
+                size = os.path.getsize(path)
+                # Уже загруженные (upload_to_s3 у нарезки) не грузим повторно
+                if self.store.head(key) != size:
+                    self.store.upload_file(path, key)
+                files.append({'name': filename, 'size': size, 'key': key,
+                              'mtime': os.path.getmtime(path)})
+
+            tmp_path = manifest_path(folder) + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'root': root, 'folder': name, 'evicted_at': time.time(),
+                           'files': files}, f, ensure_ascii=False)
+            os.replace(tmp_path, manifest_path(folder))
+            for item in files:
+                os.remove(os.path.join(folder, item['name']))
+
+            freed = sum(item['size'] for item in files)
+            self._connect().execute(
+                "UPDATE folders SET state = 'evicted', evicted_at = ?, size = ?, files = ? "
+                "WHERE path = ?",
+                (time.time(), freed, len(files), folder)
+            )
+        logger.info(f"Evicted {root}/{name}: {len(files)} files, {freed / 1024 / 1024:.1f} MB")
+        return freed
+
+    def ensure_local(self, folder):
+        """Вернуть выселенную папку на диск (если нужно). True - папка была восстановлена"""
+        folder = os.path.abspath(folder)
+        if not is_evicted(folder):
+            self.touch(folder)
+            return False
+        with self._lock(folder):
+            if not is_evicted(folder):
+                return False
+            manifest = read_manifest(folder)
+            for item in manifest['files']:
+                path = os.path.join(folder, item['name'])
+                if not os.path.exists(path):
+                    self.store.download(item['key'], path)
+                    os.utime(path, (time.time(), item['mtime']))
+            os.remove(manifest_path(folder))
+            self._connect().execute(
+                "UPDATE folders SET state = 'local', evicted_at = NULL, last_access = ? "
+                "WHERE path = ?", (time.time(), folder)
+            )
+        logger.info(f"Restored {manifest['root']}/{manifest['folder']}")
+        return True
+
+    def enforce_watermark(self, busy=None):
+        """
+        Выселять папки в порядке LRU, пока диск выше верхней отметки
+        busy - множество путей папок, которые сейчас используются задачами
+        Возвращает число выселенных папок
+        """
+        if self.disk_usage() < self.high_watermark:
+            return 0
+        self.scan()
+        busy = {os.path.abspath(p) for p in (busy or ())}
+        candidates = self._connect().execute(
+            "SELECT path FROM folders WHERE state = 'local' AND files > 0 AND last_access < ? "
+            "ORDER BY last_access",
+            (time.time() - MIN_IDLE_SECONDS,)
+        ).fetchall()
+        evicted = 0
+        for row in candidates:
+            if self.disk_usage() < self.low_watermark:
+                break
+            if row['path'] in busy:
+                continue
+            try:
+                if self.evict(row['path']):
+                    evicted += 1
+            except Exception as e:
+                logger.warning(f"Eviction of {row['path']} failed: {e}")
+        return evicted
+
+
+def start_tier_manager(storage, interval=300, busy=None):
+    """Фоновая проверка заполнения диска раз в interval секунд"""
+    def loop():
+        while True:
+            try:
+                storage.enforce_watermark(busy() if busy else None)
+            except Exception as e:
+                logger.warning(f"Tier manager check failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='tier-manager')
+    thread.daemon = True
+    thread.start()
+    return thread
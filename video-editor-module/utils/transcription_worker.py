@@ -0,0 +1,290 @@
+"""
+Резидентный воркер транскрибации (Whisper)
+- Долгоживущие процессы с загруженной моделью (без загрузки на каждый запрос)
+- Общая очередь запросов от всех потоков Flask
+- Аудио читается из pipe ffmpeg (без временных файлов)
+- Длинное аудио режется по паузам (VAD) и куски транскрибируются параллельно,
+  затем склеиваются со смещением таймингов
+"""
+
+import os
+import time
+import uuid
+import logging
+import threading
+import subprocess
+import importlib.util
+import multiprocessing
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+DEFAULT_MODEL = os.getenv('WHISPER_MODEL', 'base')
+DEFAULT_WORKERS = int(os.getenv('WHISPER_WORKERS', '2'))
+
+# Параметры нарезки по паузам
+MAX_CHUNK_SECONDS = 30.0
+MIN_CHUNK_SECONDS = 10.0
+VAD_FRAME_SECONDS = 0.03
+MIN_SILENCE_SECONDS = 0.3
+SILENCE_DB = -40.0
+
+# Таймаут ожидания: не фиксированный, а от длительности аудио
+MIN_TIMEOUT_SECONDS = 120
+TIMEOUT_PER_AUDIO_SECOND = 3
+
+# Повтор после ошибки загрузки модели: пауза растёт вдвое до максимума
+FATAL_RETRY_SECONDS = 60
+FATAL_RETRY_MAX_SECONDS = 3600
+
+
+def transcription_timeout(duration):
+    """Таймаут транскрибации по длительности аудио (секунды)"""
+    return max(MIN_TIMEOUT_SECONDS, (duration or 0) * TIMEOUT_PER_AUDIO_SECOND)
+
+
+def whisper_available():
+    """Установлен ли пакет openai-whisper (без тяжёлого импорта torch)"""
+    return importlib.util.find_spec('whisper') is not None
+
+
+def decode_audio(audio_path, sample_rate=SAMPLE_RATE):
+    """Декодировать аудио через pipe ffmpeg в mono float32 массив"""
+    cmd = [
+        'ffmpeg', '-nostdin', '-v', 'error', '-i', audio_path,
+        '-vn', '-ac', '1', '-ar', str(sample_rate),
+        '-f', 's16le', 'pipe:1'
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', 'replace')[:300])
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def split_on_silence(audio, sample_rate=SAMPLE_RATE, max_chunk=MAX_CHUNK_SECONDS,
+                     min_chunk=MIN_CHUNK_SECONDS):
+    """
+    Энергетический VAD: границы кусков ставятся в середину пауз
+    Возвращает список (start_sample, end_sample)
+    """
+    total = len(audio)
+    if total <= max_chunk * sample_rate:
+        return [(0, total)]
+
+    frame = max(1, int(VAD_FRAME_SECONDS * sample_rate))
+    n_frames = total // frame
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1) + 1e-12)
+    db = 20 * np.log10(rms)
+    silent = db < SILENCE_DB
+
+    # Серии тихих кадров -> середины пауз (в сэмплах)
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0]
+    min_frames = int(MIN_SILENCE_SECONDS / VAD_FRAME_SECONDS)
+    pauses = [
+        ((s + e) // 2 * frame, e - s)
+        for s, e in zip(starts, ends) if e - s >= min_frames
+    ]
+
+    chunks = []
+    start = 0
+    while total - start > max_chunk * sample_rate:
+        low = start + int(min_chunk * sample_rate)
+        high = start + int(max_chunk * sample_rate)
+        candidates = [p for p in pauses if low <= p[0] <= high]
+        # Самая длинная пауза в окне, иначе жёсткий разрез
+        cut = max(candidates, key=lambda p: p[1])[0] if candidates else high
+        chunks.append((start, cut))
+        start = cut
+    chunks.append((start, total))
+    return chunks
+
+
+def _worker_main(model_name, task_queue, result_queue):
+    """Процесс-воркер: загружает модель один раз и обрабатывает куски из очереди"""
+    try:
+        import whisper
+        model = whisper.load_model(model_name)
+    except Exception as e:
+        result_queue.put(('__fatal__', None, None, None, f'Model load failed: {e}'))
+        return
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, chunk_idx, audio, language = task
+        try:
+            result = model.transcribe(
+                audio,
+                language=None if language in (None, 'auto') else language,
+                word_timestamps=True,
+                fp16=False
+            )
+            segments = [
+                {
+                    'start': float(seg['start']),
+                    'end': float(seg['end']),
+                    'text': seg['text'].strip(),
+                    'words': [
+                        {'start': float(w['start']), 'end': float(w['end']), 'word': w['word']}
+                        for w in seg.get('words', [])
+                    ]
+                }
+                for seg in result.get('segments', [])
+            ]
+            result_queue.put((task_id, chunk_idx, segments, result.get('language'), None))
+        except Exception as e:
+            result_queue.put((task_id, chunk_idx, None, None, str(e)))
+
+
+class TranscriptionService:
+    """Пул резидентных воркеров Whisper с общей очередью запросов"""
+
+    def __init__(self, model_name=DEFAULT_MODEL, workers=DEFAULT_WORKERS):
+        self.model_name = model_name
+        self.workers_count = max(1, workers)
+        # spawn: не форкаем процесс Flask с его потоками и памятью
+        self._ctx = multiprocessing.get_context('spawn')
+        self._task_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        self._workers = []
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._dispatcher = None
+        self._fatal_error = None
+        self._retry_at = 0
+        self._retry_delay = FATAL_RETRY_SECONDS
+
+    def start(self):
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < self.workers_count:
+                worker = self._ctx.Process(
+                    target=_worker_main,
+                    args=(self.model_name, self._task_queue, self._result_queue),
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+                logger.info(f"Started transcription worker pid={worker.pid} model={self.model_name}")
+
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch_results, daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch_results(self):
+        """Раскладывает результаты кусков по ожидающим запросам"""
+        while True:
+            task_id, chunk_idx, segments, language, error = self._result_queue.get()
+            with self._lock:
+                if task_id == '__fatal__':
+                    # Воркер завершился; новый будет запущен после паузы
+                    if not self._fatal_error:
+                        self._retry_at = time.time() + self._retry_delay
+                        logger.error(f"{error}; retrying in {self._retry_delay}s")
+                        self._retry_delay = min(self._retry_delay * 2, FATAL_RETRY_MAX_SECONDS)
+                    self._fatal_error = error
+                    for pending in self._pending.values():
+                        pending['error'] = error
+                        pending['event'].set()
+                    continue
+                # Модель загрузилась и работает - сбрасываем паузу повтора
+                self._retry_delay = FATAL_RETRY_SECONDS
+                pending = self._pending.get(task_id)
+                if not pending:
+                    continue
+                if error:
+                    pending['error'] = error
+                    pending['event'].set()
+                    continue
+                pending['chunks'][chunk_idx] = (segments, language)
+                if len(pending['chunks']) == pending['expected']:
+                    pending['event'].set()
+
+    def transcribe(self, audio_path, language='auto'):
+        """
+        Транскрибировать файл: {'language': str, 'duration': float, 'segments': [...]}
+        Тайминги сегментов и слов - от начала файла
+        """
+        with self._lock:
+            if self._fatal_error:
+                if time.time() < self._retry_at:
+                    raise RuntimeError(self._fatal_error)
+                self._fatal_error = None
+        self.start()
+
+        audio = decode_audio(audio_path)
+        duration = len(audio) / SAMPLE_RATE
+        chunks = split_on_silence(audio)
+
+        task_id = uuid.uuid4().hex
+        event = threading.Event()
+        with self._lock:
+            self._pending[task_id] = {
+                'chunks': {}, 'expected': len(chunks), 'event': event, 'error': None
+            }
+
+        try:
+            for idx, (start, end) in enumerate(chunks):
+                self._task_queue.put((task_id, idx, audio[start:end], language))
+
+            timeout = transcription_timeout(duration)
+            if not event.wait(timeout):
+                raise TimeoutError(f'Transcription timed out after {timeout:.0f}s')
+
+            with self._lock:
+                pending = self._pending[task_id]
+            if pending['error']:
+                raise RuntimeError(pending['error'])
+
+            # Склейка: сдвиг таймингов каждого куска на его начало
+            segments = []
+            detected_language = None
+            for idx, (start, _) in enumerate(chunks):
+                chunk_segments, chunk_language = pending['chunks'][idx]
+                detected_language = detected_language or chunk_language
+                offset = start / SAMPLE_RATE
+                for seg in chunk_segments:
+                    segments.append({
+                        'start': round(seg['start'] + offset, 3),
+                        'end': round(seg['end'] + offset, 3),
+                        'text': seg['text'],
+                        'words': [
+                            {
+                                'start': round(w['start'] + offset, 3),
+                                'end': round(w['end'] + offset, 3),
+                                'word': w['word']
+                            }
+                            for w in seg['words']
+                        ]
+                    })
+
+            logger.info(f"Transcribed {audio_path}: {duration:.1f}s in {len(chunks)} chunks")
+            return {
+                'language': detected_language or language,
+                'duration': round(duration, 3),
+                'model': self.model_name,
+                'segments': segments
+            }
+        finally:
+            with self._lock:
+                self._pending.pop(task_id, None)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_transcription_service():
+    """Общий сервис на процесс (создаётся при первом обращении)"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TranscriptionService()
+        return _service
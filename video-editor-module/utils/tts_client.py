@@ -0,0 +1,184 @@
+"""
+Клиент ElevenLabs TTS
+- Общая HTTP-сессия с пулом соединений и ретраями
+- Кэш озвучки по (текст, voice_id, model_id, voice_settings)
+- Потоковая запись ответа на диск
+- Длинные тексты: разбиение по предложениям, параллельная озвучка, склейка ffmpeg concat
+"""
+
+import os
+import re
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.spawn_server import run as run_command
+from utils.media_cache import params_key, cache_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = os.getenv('ELEVENLABS_API_BASE', 'https://api.elevenlabs.io/v1')
+DEFAULT_VOICE_ID = '21m00Tcm4TlvDq8ikWAM'  # Rachel voice
+DEFAULT_MODEL_ID = 'eleven_multilingual_v2'
+DEFAULT_VOICE_SETTINGS = {
+    'stability': 0.5,
+    'similarity_boost': 0.75,
+    'style': 0.0,
+    'use_speaker_boost': True
+}
+
+# Тексты длиннее - режутся по предложениям
+MAX_CHUNK_CHARS = 2500
+# Одновременных запросов к API на процесс (лимит аккаунта ElevenLabs)
+MAX_CONCURRENT_REQUESTS = int(os.getenv('ELEVENLABS_MAX_CONCURRENCY', '4'))
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_api_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+_session = None
+_session_lock = threading.Lock()
+
+
+class TTSError(Exception):
+    """Ошибка API озвучки (status_code - HTTP код ответа API)"""
+
+    def __init__(self, status_code, details):
+        super().__init__(f'ElevenLabs API error: {status_code}')
+        self.status_code = status_code
+        self.details = details
+
+
+def get_session():
+    """Общая сессия: keep-alive и пул соединений на все потоки"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3, backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(['GET', 'POST'])
+            )
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=MAX_CONCURRENT_REQUESTS * 2,
+                max_retries=retry
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def split_text(text, max_chars=MAX_CHUNK_CHARS):
+    """Разбить текст на куски не длиннее max_chars по границам предложений"""
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text]
+
+    sentences = re.split(r'(?<=[.!?…])\s+', text)
+    chunks = []
+    current = ''
+    for sentence in sentences:
+        # Предложение длиннее лимита - режем по словам
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f'{current} {sentence}'.strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _request_speech(text, voice_id, model_id, voice_settings, api_key, api_base, output_path):
+    """Один запрос TTS с потоковой записью ответа в файл"""
+    url = f"{api_base}/text-to-speech/{voice_id}"
+    headers = {
+        'Accept': 'audio/mpeg',
+        'Content-Type': 'application/json',
+        'xi-api-key': api_key
+    }
+    payload = {
+        'text': text,
+        'model_id': model_id,
+        'voice_settings': voice_settings
+    }
+
+    tmp_path = f'{output_path}.{threading.get_ident()}.tmp'
+    with _api_slots:
+        with get_session().post(url, json=payload, headers=headers,
+                                timeout=60, stream=True) as response:
+            if response.status_code != 200:
+                raise TTSError(response.status_code, response.text)
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    if chunk:
+                        f.write(chunk)
+    os.replace(tmp_path, output_path)
+
+
+def _concat_audio(parts, output_path):
+    """Склейка mp3 кусков без перекодирования (concat demuxer)"""
+    temp_dir = tempfile.mkdtemp(prefix='tts_concat_')
+    try:
+        list_path = os.path.join(temp_dir, 'concat.txt')
+        with open(list_path, 'w') as f:
+            for part in parts:
+                f.write(f"file '{os.path.abspath(part)}'\n")
+        tmp_path = os.path.join(temp_dir, 'joined.mp3')
+        cmd = [
+            'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
+            '-i', list_path, '-c', 'copy', tmp_path
+        ]
+        result = run_command(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Audio concat failed: {result.stderr[:300]}")
+        shutil.move(tmp_path, output_path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def synthesize(text, api_key, cache_folder, voice_id=DEFAULT_VOICE_ID,
+               model_id=DEFAULT_MODEL_ID, voice_settings=None, api_base=DEFAULT_API_BASE):
+    """
+    Озвучить текст (с кэшем)
+    Возвращает (путь к mp3 в кэше, cached)
+    """
+    settings = dict(DEFAULT_VOICE_SETTINGS)
+    settings.update(voice_settings or {})
+
+    key = params_key(text, voice_id, model_id, settings)
+    audio_path = cache_path(cache_folder, 'tts', key, ext='mp3')
+    if os.path.exists(audio_path):
+        logger.info(f"Using cached voice: {key}")
+        return audio_path, True
+
+    chunks = split_text(text)
+    if len(chunks) == 1:
+        _request_speech(text, voice_id, model_id, settings, api_key, api_base, audio_path)
+        return audio_path, False
+
+    # Куски кэшируются отдельно: правка одного предложения не переозвучивает весь текст
+    logger.info(f"Long text ({len(text)} chars): voicing {len(chunks)} parts in parallel")
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        parts = list(executor.map(
+            lambda chunk: synthesize(chunk, api_key, cache_folder, voice_id,
+                                     model_id, settings, api_base)[0],
+            chunks
+        ))
+    _concat_audio(parts, audio_path)
+    return audio_path, False
@@ -0,0 +1,153 @@
+"""
+Планировщик вариантов монтажа
+- Подбор подмножества middle шотов под target_duration (DP / subset-sum)
+- Порядок шотов из seed: планы воспроизводимы
+- Гарантия различных планов (без повторных рендеров одинаковых порядков)
+Ничего не рендерит - работает только с известными длительностями
+"""
+
+import math
+import random
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Дискретизация длительностей для DP (0.1 секунды)
+TIME_UNIT = 0.1
+DEFAULT_TOLERANCE = 1.0
+# Сколько случайных попыток делать на один план до детерминированного добора
+ATTEMPTS_PER_PLAN = 50
+
+
+def _to_units(seconds):
+    return max(0, int(round(seconds / TIME_UNIT)))
+
+
+def _reachable_sums(weights, limit):
+    """reach[i] - битовая маска сумм, достижимых первыми i шотами (до limit)"""
+    mask = (1 << (limit + 1)) - 1
+    reach = [1]
+    for w in weights:
+        prev = reach[-1]
+        reach.append((prev | (prev << w)) & mask)
+    return reach
+
+
+def _sample_subset(weights, reach, total, rng):
+    """Случайное подмножество шотов с суммой ровно total (обратный проход по DP)"""
+    subset = []
+    s = total
+    for i in range(len(weights), 0, -1):
+        w = weights[i - 1]
+        options = []
+        if (reach[i - 1] >> s) & 1:
+            options.append(False)
+        if s >= w and (reach[i - 1] >> (s - w)) & 1:
+            options.append(True)
+        if rng.choice(options):
+            subset.append(i - 1)
+            s -= w
+    return sorted(subset)
+
+
+def _feasible_totals(reach_all, target, tolerance, limit):
+    """Суммы в пределах допуска; если таких нет - ближайшая достижимая"""
+    low = max(0, target - tolerance)
+    totals = [s for s in range(low, limit + 1) if (reach_all >> s) & 1 and s > 0]
+    if totals:
+        return totals, True
+
+    achievable = [s for s in range(1, limit + 1) if (reach_all >> s) & 1]
+    if not achievable:
+        return [], False
+    closest = min(achievable, key=lambda s: abs(s - target))
+    return [closest], False
+
+
+def plan_variants(middle_durations, count, seed, target_middle_duration=None,
+                  tolerance=DEFAULT_TOLERANCE):
+    """
+    Построить до count различных планов монтажа middle шотов
+
+    - middle_durations: длительности middle шотов (секунды)
+    - target_middle_duration: сколько секунд должны занять middle шоты
+      (None или <= 0 - используются все шоты, меняется только порядок)
+    - tolerance: допустимое отклонение от цели (секунды)
+
+    Возвращает (plans, info):
+    plans - список {'order': [индексы middle шотов], 'middle_duration': float}
+    info - {'target_met': bool, 'max_distinct': int | None}
+    """
+    rng = random.Random(seed)
+    n = len(middle_durations)
+    count = max(1, int(count))
+
+    if n == 0:
+        return [{'order': [], 'middle_duration': 0.0}], {'target_met': True, 'max_distinct': 1}
+
+    use_target = bool(target_middle_duration and target_middle_duration > 0)
+    weights = [_to_units(d) for d in middle_durations]
+
+    if use_target:
+        target = _to_units(target_middle_duration)
+        tol = _to_units(tolerance)
+        limit = min(sum(weights), target + tol)
+        reach = _reachable_sums(weights, max(limit, 1))
+        totals, target_met = _feasible_totals(reach[-1], target, tol, max(limit, 1))
+        if not target_met:
+            logger.warning(
+                f"Target {target_middle_duration:.1f}s not reachable within ±{tolerance}s, "
+                f"using closest achievable duration"
+            )
+        if not totals:
+            # Все шоты нулевой длительности - берём все
+            use_target, target_met = False, False
+    else:
+        target_met = True
+
+    def make_plan(subset):
+        order = list(subset)
+        rng.shuffle(order)
+        return tuple(order)
+
+    seen = set()
+    plans = []
+
+    # Случайная выборка: подмножество по DP + перестановка
+    for _ in range(count * ATTEMPTS_PER_PLAN):
+        if len(plans) >= count:
+            break
+        if use_target:
+            subset = _sample_subset(weights, reach, rng.choice(totals), rng)
+        else:
+            subset = list(range(n))
+        order = make_plan(subset)
+        if order not in seen:
+            seen.add(order)
+            plans.append(order)
+
+    # Добор: перебираем перестановки уже найденных подмножеств
+    max_distinct = None
+    if len(plans) < count:
+        subsets = sorted({tuple(sorted(p)) for p in plans})
+        for subset in subsets:
+            for order in itertools.permutations(subset):
+                if len(plans) >= count:
+                    break
+                if order not in seen:
+                    seen.add(order)
+                    plans.append(order)
+        if len(plans) < count and not use_target:
+            max_distinct = math.factorial(n)
+        if len(plans) < count:
+            logger.warning(f"Only {len(plans)} distinct plans available (requested {count})")
+
+    result = [
+        {
+            'order': list(order),
+            'middle_duration': round(sum(middle_durations[i] for i in order), 2)
+        }
+        for order in plans
+    ]
+    return result, {'target_met': target_met, 'max_distinct': max_distinct}